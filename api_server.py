@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import io
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import telemetry
+
+
+class FaceEnhanceBackend:
+    """Runs jobs through face_enhance. Models load when the backend is created."""
+
+    name = "face_enhance"
+
+    def __init__(self):
+        # Imported here so the stub backend never pulls in ComfyUI or torch
+        import face_enhance
+        face_enhance.initialize_models()
+
+    def enhance(self, input_image, ref_image, id_weight=0.75):
+        import face_enhance
+        return face_enhance.face_enhance(ref_image, input_image, id_weight=id_weight)
+
+
+class StubBackend:
+    """CPU stand-in for load testing: sleeps, then blends the reference into the input."""
+
+    name = "stub"
+
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+
+    def enhance(self, input_image, ref_image, id_weight=0.75):
+        time.sleep(self.delay)
+        input_image = input_image.convert("RGB")
+        ref_image = ref_image.convert("RGB").resize(input_image.size)
+        return Image.blend(input_image, ref_image, min(max(id_weight, 0.0), 1.0) * 0.25)
+
+
+BACKENDS = {
+    "face_enhance": FaceEnhanceBackend,
+    "stub": StubBackend,
+}
+
+
+class Job:
+    def __init__(self, input_image, ref_image, id_weight):
+        self.id = uuid.uuid4().hex
+        self.input_image = input_image
+        self.ref_image = ref_image
+        self.id_weight = id_weight
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobRunner:
+    """Bounded job queue in front of a backend.
+
+    `concurrency` worker coroutines pull jobs off the queue and run them on an executor
+    with as many threads. With the default of 1, model execution is always serialized;
+    a WorkerPool backend takes one job per worker process. A full queue rejects new jobs
+    instead of growing. A job that exceeds `job_timeout` is marked "timeout" and the
+    worker moves on; the backend call itself can't be interrupted, so the next job
+    starts once it returns, and only then does its own timeout start.
+    """
+
+    def __init__(self, backend, max_queue: int = 16, job_timeout: float = 120.0, max_finished: int = 256,
+                 concurrency: int = 1):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="model-worker")
+        self._workers = []
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _run_job(self, job, on_start):
+        # Runs on the model worker thread, so the trace also picks up the pipeline's stages
+        on_start()
+        with telemetry.trace("api_job", job_id=job.id, backend=self.backend.name):
+            return self.backend.enhance(job.input_image, job.ref_image, job.id_weight)
+
+    def submit(self, input_image, ref_image, id_weight=0.75):
+        """Queues a job and returns it, or returns None if the queue is full."""
+        job = Job(input_image, ref_image, id_weight)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return None
+        self.jobs[job.id] = job
+        return job
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            started = asyncio.Event()
+            try:
+                result = loop.run_in_executor(self.executor, self._run_job, job,
+                                              lambda: loop.call_soon_threadsafe(started.set))
+                # A timed-out job keeps its thread until it returns, so the job only counts as
+                # running, and its timeout only starts, once it is actually on a thread
+                started_wait = asyncio.ensure_future(started.wait())
+                await asyncio.wait([started_wait, result], return_when=asyncio.FIRST_COMPLETED)
+                started_wait.cancel()
+                job.status = "running"
+                job.started_at = time.time()
+                telemetry.QUEUE_WAIT_SECONDS.observe(job.started_at - job.created_at, endpoint="api")
+                job.result = await asyncio.wait_for(result, timeout=self.job_timeout)
+                job.status = "done"
+            except asyncio.TimeoutError:
+                job.status = "timeout"
+                job.error = f"Job exceeded {self.job_timeout}s"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                print(f"Error processing job {job.id}: {e}")
+            finally:
+                job.finished_at = time.time()
+                telemetry.REQUESTS.inc(endpoint="api", status=job.status)
+                telemetry.REQUEST_SECONDS.observe(job.finished_at - job.created_at, endpoint="api")
+                job.input_image = job.ref_image = None
+                self.queue.task_done()
+                self._forget_finished()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        stats = {
+            "backend": self.backend.name,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "max_queue": self.max_queue,
+            "jobs": len(self.jobs),
+        }
+        if hasattr(self.backend, "stats"):
+            stats["pool"] = self.backend.stats()
+        return stats
+
+
+def create_app(backend, max_queue: int = 16, job_timeout: float = 120.0, concurrency: int = 1):
+    """Builds the FastAPI app serving `backend` through a JobRunner running `concurrency` jobs at once."""
+    from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+    from fastapi.responses import JSONResponse, Response
+
+    runner = JobRunner(backend, max_queue=max_queue, job_timeout=job_timeout, concurrency=concurrency)
+    telemetry.enable()
+    queue_depth = telemetry.REGISTRY.gauge("face_enhance_queue_depth", "Jobs waiting in the queue.", labels=("endpoint",))
+    telemetry.REGISTRY.add_collector(lambda registry: queue_depth.set(runner.stats()["queue_depth"], endpoint="api"))
+    pool = getattr(backend, "pool", None)
+    if pool is not None:
+        workers = telemetry.REGISTRY.gauge("face_enhance_workers", "Pool worker processes by state.", labels=("state",))
+
+        def collect_workers(registry):
+            states = [worker["state"] for worker in pool.stats()["workers"]]
+            for state in ("starting", "ready", "draining", "stopped", "failed"):
+                workers.set(states.count(state), state=state)
+
+        telemetry.REGISTRY.add_collector(collect_workers)
+    app = FastAPI(title="Face Enhance API")
+    app.state.runner = runner
+
+    @app.on_event("startup")
+    async def startup():
+        await runner.start()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await runner.stop()
+
+    def read_image(upload_bytes, field):
+        try:
+            image = Image.open(io.BytesIO(upload_bytes))
+            image.load()
+            return image
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"Could not decode '{field}' as an image")
+
+    @app.post("/jobs", status_code=202)
+    async def create_job(input: UploadFile = File(...), ref: UploadFile = File(...), id_weight: float = Form(0.75)):
+        input_image = read_image(await input.read(), "input")
+        ref_image = read_image(await ref.read(), "ref")
+        job = runner.submit(input_image, ref_image, id_weight)
+        if job is None:
+            telemetry.REQUESTS.inc(endpoint="api", status="rejected")
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Job queue is full"},
+                headers={"Retry-After": str(max(1, int(job_timeout // 4)))},
+            )
+        return {"job_id": job.id, "status": job.status}
+
+    @app.get("/jobs/{job_id}")
+    async def job_status(job_id: str):
+        job = runner.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        return job.to_dict()
+
+    @app.get("/jobs/{job_id}/result")
+    async def job_result(job_id: str):
+        job = runner.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        if job.status != "done":
+            raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+        buffer = io.BytesIO()
+        job.result.save(buffer, format="PNG")
+        return Response(content=buffer.getvalue(), media_type="image/png")
+
+    @app.get("/health")
+    async def health():
+        return runner.stats()
+
+    if pool is not None:
+        @app.post("/workers/{worker_id}/restart", status_code=202)
+        async def restart_worker(worker_id: int):
+            if not 0 <= worker_id < len(pool.workers):
+                raise HTTPException(status_code=404, detail="Unknown worker")
+            # Draining waits for the worker's jobs, so it runs off the event loop
+            asyncio.get_running_loop().run_in_executor(None, pool.restart, worker_id)
+            return {"worker_id": worker_id, "state": "draining"}
+
+        @app.get("/workers/memory")
+        async def worker_memory():
+            return pool.memory_report()
+
+        @app.post("/workers/rolling-restart", status_code=202)
+        async def rolling_restart():
+            asyncio.get_running_loop().run_in_executor(None, pool.rolling_restart)
+            return {"workers": len(pool.workers)}
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(content=telemetry.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Face Enhancement job API')
+    parser.add_argument('--host', type=str, default='0.0.0.0', help='Host to bind')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='face_enhance', help='Pipeline backend')
+    parser.add_argument('--max-queue', type=int, default=16, help='Queued jobs allowed before returning 429')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Per-job timeout in seconds')
+    parser.add_argument('--stub-delay', type=float, default=0.5, help='Seconds per job for the stub backend')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Run the backend in this many worker processes (default: in this process)')
+    parser.add_argument('--devices', type=str, nargs='+',
+                        help='Device per worker, e.g. cuda:0 cuda:1 (default: one GPU each, or cpu for the stub)')
+    return parser.parse_args()
+
+
+def main():
+    import uvicorn
+
+    args = parse_args()
+    backend_kwargs = {"delay": args.stub_delay} if args.backend == "stub" else {}
+    pool = None
+    if args.workers or args.devices:
+        from worker_pool import PoolBackend, WorkerPool
+
+        devices = args.devices or [
+            "cpu" if args.backend == "stub" else f"cuda:{i}" for i in range(args.workers)
+        ]
+        pool = WorkerPool(devices, backend=args.backend, backend_kwargs=backend_kwargs)
+        pool.start()
+        backend = PoolBackend(pool)
+        concurrency = len(devices)
+    else:
+        backend = BACKENDS[args.backend](**backend_kwargs)
+        concurrency = 1
+    app = create_app(backend, max_queue=args.max_queue, job_timeout=args.timeout, concurrency=concurrency)
+    try:
+        uvicorn.run(app, host=args.host, port=args.port)
+    finally:
+        if pool is not None:
+            pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""Compare weight memory, latency and identity distance across precision profiles.
+
+Run from the repository root on a GPU machine with the models installed:
+
+    python benchmarks/bench_precision.py
+    python benchmarks/bench_precision.py --profiles bf16 fp8 --output precision.json
+
+Each profile runs in its own process (FACE_ENHANCE_PRECISION is read at import) and
+reports face_enhance.memory_report() after loading, the CUDA high-water mark during
+enhancement, and the mean cosine face-embedding distance to the reference over the
+examples. The run fails (exit 1) if a profile's mean distance is more than
+--max-distance-increase above the --reference profile's, which is the quality
+regression check for a cheaper profile.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EXAMPLES = [
+    ("examples/dany_gpt_1.png", "examples/dany_face.jpg"),
+    ("examples/dany_gpt_2.png", "examples/dany_face.jpg"),
+    ("examples/tim_gpt_1.png", "examples/tim_face.jpg"),
+    ("examples/tim_gpt_2.png", "examples/tim_face.jpg"),
+    ("examples/elon_gpt.png", "examples/elon_face.png"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Precision profile memory and quality benchmark')
+    parser.add_argument('--profiles', nargs='+', default=None, help='Profiles to run (default: all)')
+    parser.add_argument('--reference', type=str, default='bf16', help='Profile the others are compared against')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1, 2], help='Seeds run for every example')
+    parser.add_argument('--preset', type=str, default='max', help='Sampling preset')
+    parser.add_argument('--max-distance-increase', type=float, default=0.02,
+                        help='Allowed increase in mean cosine distance over the reference profile')
+    parser.add_argument('--output', type=str, help='Write per-profile results as JSON to this path')
+    parser.add_argument('--worker', type=str, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_worker(args):
+    """Runs one profile in this process and prints its results as the last line of output."""
+    import torch
+    import face_enhance
+    from image_utils import to_image_tensor
+
+    face_enhance.initialize_models(lazy=False)
+    report = face_enhance.memory_report()
+    scorer = face_enhance.get_face_scorer()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+    runs = []
+    for input_path, ref_path in EXAMPLES:
+        face_pixels = to_image_tensor(os.path.join(ROOT, ref_path))
+        input_pixels = to_image_tensor(os.path.join(ROOT, input_path))
+        for seed in args.seeds:
+            start = time.perf_counter()
+            with torch.inference_mode():
+                enhanced = face_enhance.enhance_pixels(face_pixels, input_pixels, seed=seed, preset=args.preset)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            seconds = time.perf_counter() - start
+            runs.append({"input": input_path, "seed": seed, "seconds": round(seconds, 3),
+                         "distance": scorer.score(face_pixels, enhanced)[0]})
+
+    # The first run includes warm-up, so latency is averaged over the rest when there are any
+    timed = runs[1:] or runs
+    distances = [run["distance"] for run in runs if run["distance"] is not None]
+    result = {
+        "profile": args.worker,
+        "memory": report,
+        "peak_cuda_bytes": torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None,
+        "mean_seconds": round(statistics.mean(run["seconds"] for run in timed), 3),
+        "mean_distance": round(statistics.mean(distances), 4) if distances else None,
+        "faces_missed": len(runs) - len(distances),
+        "runs": runs,
+    }
+    print(json.dumps(result))
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+        return
+
+    # Only the profile table is needed here; FACE_ENHANCE_LAZY keeps the import from loading models
+    os.environ["FACE_ENHANCE_LAZY"] = "1"
+    import face_enhance
+    profiles = args.profiles or list(face_enhance.PRECISION_PROFILES)
+    if args.reference not in profiles:
+        profiles = [args.reference] + profiles
+
+    results = {}
+    for profile in profiles:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", profile, "--preset", args.preset,
+                   "--seeds", *map(str, args.seeds)]
+        env = dict(os.environ, FACE_ENHANCE_PRECISION=profile)
+        completed = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            results[profile] = {"profile": profile, "error": f"worker exited with {completed.returncode}"}
+        else:
+            results[profile] = json.loads(completed.stdout.strip().splitlines()[-1])
+        summary = {key: value for key, value in results[profile].items() if key != "runs"}
+        print(json.dumps(summary), flush=True)
+
+    failures = []
+    reference = results[args.reference].get("mean_distance")
+    for profile, result in results.items():
+        if "error" in result:
+            failures.append(f"{profile}: {result['error']}")
+        elif result["mean_distance"] is None:
+            failures.append(f"{profile}: no face found in any output")
+        elif reference is not None and result["mean_distance"] > reference + args.max_distance_increase:
+            failures.append(f"{profile}: mean distance {result['mean_distance']} vs {reference} for {args.reference}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
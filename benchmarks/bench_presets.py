@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Measure wall time against face-embedding distance to the reference for each preset.
+
+Run from the repository root on a GPU machine with the models installed:
+
+    python benchmarks/bench_presets.py
+    python benchmarks/bench_presets.py --presets draft max --seeds 1 2 3 --output presets.json
+
+Distance is the cosine distance between the InsightFace (antelopev2) embeddings of the
+output and the reference, the same measure as workflows/FaceDistanceProd.json. Lower is
+closer to the reference identity.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+EXAMPLES = [
+    ("examples/dany_gpt_1.png", "examples/dany_face.jpg"),
+    ("examples/dany_gpt_2.png", "examples/dany_face.jpg"),
+    ("examples/tim_gpt_1.png", "examples/tim_face.jpg"),
+    ("examples/tim_gpt_2.png", "examples/tim_face.jpg"),
+    ("examples/elon_gpt.png", "examples/elon_face.png"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Preset latency vs identity distance benchmark')
+    parser.add_argument('--presets', nargs='+', default=None, help='Presets to run (default: all)')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1, 2], help='Seeds run for every example')
+    parser.add_argument('--output', type=str, help='Write per-run results and the summary as JSON to this path')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    import face_enhance
+    from image_utils import to_image_tensor
+
+    face_enhance.initialize_models()
+    scorer = face_enhance.get_face_scorer()
+    presets = args.presets or list(face_enhance.PRESETS)
+
+    # One untimed run so model loading and the identity/prompt caches don't land on the first preset
+    input_path, ref_path = EXAMPLES[0]
+    with torch.inference_mode():
+        face_enhance.enhance_pixels(to_image_tensor(ref_path), to_image_tensor(input_path), seed=0, preset=presets[0])
+
+    runs = []
+    for preset in presets:
+        for input_path, ref_path in EXAMPLES:
+            face_pixels = to_image_tensor(ref_path)
+            input_pixels = to_image_tensor(input_path)
+            for seed in args.seeds:
+                if torch.cuda.is_available():
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                with torch.inference_mode():
+                    enhanced = face_enhance.enhance_pixels(face_pixels, input_pixels, seed=seed, preset=preset)
+                if torch.cuda.is_available():
+                    torch.cuda.synchronize()
+                seconds = time.perf_counter() - start
+
+                distance = scorer.score(face_pixels, enhanced)[0]
+                run = {"preset": preset, "input": input_path, "seed": seed,
+                       "seconds": round(seconds, 3), "distance": distance}
+                runs.append(run)
+                print(json.dumps(run), flush=True)
+
+    summary = {}
+    for preset in presets:
+        preset_runs = [run for run in runs if run["preset"] == preset]
+        distances = [run["distance"] for run in preset_runs if run["distance"] is not None]
+        summary[preset] = {
+            "steps": face_enhance.PRESETS[preset]["steps"],
+            "mean_seconds": round(statistics.mean(run["seconds"] for run in preset_runs), 3),
+            "mean_distance": round(statistics.mean(distances), 4) if distances else None,
+            "faces_missed": len(preset_runs) - len(distances),
+        }
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"runs": runs, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""Time every stage of main_batch() across resolutions and batch sizes.
+
+Run from the repository root:
+
+    python benchmarks/bench_stages.py --output stages.json
+    python benchmarks/bench_stages.py --stub --output stages.json          # CPU only, no models
+    python benchmarks/bench_stages.py --stub --baseline stages.json        # exit 1 on a regression
+
+Stages are the profiling.stage() blocks in face_enhance (load_image, clip_encode,
+vae_encode, apply_pulid, controlnet_apply, sampling, vae_decode, to_pil, save, ...) plus
+"total". Each is reported as p50/p95/mean seconds over --repeats runs. With --stub the
+ComfyUI nodes are replaced by benchmarks/stub_nodes.py, so only the orchestration around
+the models is measured. Peak memory is CUDA max_memory_allocated on GPU and the process
+RSS high-water mark, which only ever grows, on the host.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import torch
+
+from image_utils import resize_image, to_image_tensor, to_pil_images
+import profiling
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Per-stage pipeline benchmark')
+    parser.add_argument('--input', type=str, default='examples/dany_gpt_1.png', help='Target image, resized to each resolution')
+    parser.add_argument('--ref', type=str, default='examples/dany_face.jpg', help='Reference face image')
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[512, 1024], help='Long-side sizes to test')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4], help='Targets per main_batch() call')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed runs per configuration')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs per configuration')
+    parser.add_argument('--preset', type=str, default='max', help='Preset passed to the pipeline')
+    parser.add_argument('--stub', action='store_true', help='Replace the ComfyUI nodes with CPU stubs')
+    parser.add_argument('--output', type=str, help='Write the report as JSON to this path')
+    parser.add_argument('--baseline', type=str, help='Compare against a previous --output report')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed fractional p50 slowdown vs the baseline')
+    parser.add_argument('--min-seconds', type=float, default=0.002, help='Ignore stages faster than this in the baseline')
+    return parser.parse_args()
+
+
+def percentile(values, q):
+    """Linearly interpolated percentile of `values` for q in [0, 100]."""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(samples):
+    return {
+        "p50": round(percentile(samples, 50), 6),
+        "p95": round(percentile(samples, 95), 6),
+        "mean": round(sum(samples) / len(samples), 6),
+    }
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def run_config(face_enhance, ref_path, input_path, batch_size, args, use_cuda, scratch_dir):
+    pairs = [(ref_path, input_path, os.path.join(scratch_dir, f"output_{i}.png")) for i in range(batch_size)]
+
+    def run():
+        with torch.inference_mode():
+            face_enhance.main_batch(pairs, seed=1, max_batch_size=batch_size, preset=args.preset)
+
+    for _ in range(args.warmup):
+        run()
+    if use_cuda:
+        torch.cuda.reset_peak_memory_stats()
+
+    samples = {}
+    for _ in range(args.repeats):
+        with profiling.record(synchronize=use_cuda) as recorder:
+            start = time.perf_counter()
+            run()
+            total = time.perf_counter() - start
+        for name, seconds in recorder.totals().items():
+            samples.setdefault(name, []).append(seconds)
+        samples.setdefault("total", []).append(total)
+
+    return {
+        "stages": {name: summarize(values) for name, values in samples.items()},
+        "peak_cuda_bytes": torch.cuda.max_memory_allocated() if use_cuda else None,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """Returns a description of every stage whose p50 is more than `tolerance` slower than the baseline."""
+    previous = {(row["width"], row["height"], row["batch_size"]): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        old = previous.get((row["width"], row["height"], row["batch_size"]))
+        if old is None:
+            continue
+        for name, timing in row["stages"].items():
+            old_timing = old["stages"].get(name)
+            if old_timing is None or old_timing["p50"] < min_seconds:
+                continue
+            if timing["p50"] > old_timing["p50"] * (1 + tolerance):
+                regressions.append(
+                    f"{row['width']}x{row['height']} batch {row['batch_size']} {name}: "
+                    f"p50 {old_timing['p50']:.4f}s -> {timing['p50']:.4f}s"
+                )
+    return regressions
+
+
+def main():
+    args = parse_args()
+    if args.stub:
+        from stub_nodes import load_stub_face_enhance
+        face_enhance = load_stub_face_enhance()
+    else:
+        import face_enhance
+        face_enhance.initialize_models()
+    use_cuda = not args.stub and torch.cuda.is_available()
+    source = to_image_tensor(args.input)
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for resolution in args.resolutions:
+            scale = resolution / max(source.shape[1], source.shape[2])
+            height, width = (int(round(source.shape[1] * scale / 16)) * 16, int(round(source.shape[2] * scale / 16)) * 16)
+            # Inputs go through the pipeline from disk, so decoding is part of what is measured
+            input_path = os.path.join(scratch_dir, f"input_{width}x{height}.png")
+            to_pil_images(resize_image(source, height, width))[0].save(input_path)
+            for batch_size in args.batch_sizes:
+                row = {"width": width, "height": height, "batch_size": batch_size}
+                row.update(run_config(face_enhance, args.ref, input_path, batch_size, args, use_cuda, scratch_dir))
+                results.append(row)
+                print(json.dumps(row), flush=True)
+
+    report = {
+        "config": {"stub": args.stub, "preset": args.preset, "repeats": args.repeats, "warmup": args.warmup,
+                   "device": "cuda" if use_cuda else "cpu", "torch": torch.__version__},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_seconds)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
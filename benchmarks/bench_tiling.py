@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Measure latency and peak memory of full-frame vs tiled enhancement across resolutions.
+
+Run from the repository root:
+
+    python benchmarks/bench_tiling.py --ref examples/dany_face.jpg --input examples/dany_gpt_1.png
+    python benchmarks/bench_tiling.py --stub   # CPU-only, exercises the tiling itself
+
+Peak memory is CUDA max_memory_allocated on GPU. With --stub it is the largest tensor
+handed to the per-tile function, which is what the tile size bounds.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from image_utils import resize_image, to_image_tensor
+import tiling
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Tiled vs full-frame enhancement benchmark')
+    parser.add_argument('--input', type=str, default='examples/dany_gpt_1.png', help='Target image, resized to each resolution')
+    parser.add_argument('--ref', type=str, default='examples/dany_face.jpg', help='Reference face image')
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[1024, 2048, 3072, 4096], help='Long-side sizes to test')
+    parser.add_argument('--tile-size', type=int, default=1024, help='Tile side in pixels')
+    parser.add_argument('--overlap', type=int, default=128, help='Tile overlap in pixels')
+    parser.add_argument('--stub', action='store_true', help='Replace the pipeline with a cheap CPU filter')
+    parser.add_argument('--skip-full', action='store_true', help='Only run the tiled mode (full frame may run out of memory)')
+    parser.add_argument('--output', type=str, help='Write the results as JSON to this path')
+    return parser.parse_args()
+
+
+def stub_enhance(tile, peak):
+    peak[0] = max(peak[0], tile.numel() * tile.element_size())
+    return torch.nn.functional.avg_pool2d(tile.movedim(-1, 1), 3, stride=1, padding=1).movedim(1, -1)
+
+
+def measure(fn, pixels, use_cuda):
+    if use_cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    fn(pixels)
+    if use_cuda:
+        torch.cuda.synchronize()
+    return time.perf_counter() - start, torch.cuda.max_memory_allocated() if use_cuda else None
+
+
+def main():
+    args = parse_args()
+    use_cuda = not args.stub and torch.cuda.is_available()
+    source = to_image_tensor(args.input)
+
+    if args.stub:
+        peak = [0]
+        enhance = lambda pixels: stub_enhance(pixels, peak)
+    else:
+        import face_enhance
+        face_enhance.initialize_models()
+        face_pixels = to_image_tensor(args.ref)
+
+        def enhance(pixels):
+            with torch.inference_mode():
+                return face_enhance.get_value_at_index(face_enhance.run_workflow(face_pixels, pixels, seed=1), 0)
+
+    results = []
+    for resolution in args.resolutions:
+        scale = resolution / max(source.shape[1], source.shape[2])
+        height, width = (int(round(source.shape[1] * scale / 16)) * 16, int(round(source.shape[2] * scale / 16)) * 16)
+        pixels = resize_image(source, height, width)
+
+        modes = {"tiled": lambda p: tiling.tiled_apply(p, enhance, args.tile_size, args.overlap)}
+        if not args.skip_full:
+            modes["full"] = enhance
+        for mode, fn in modes.items():
+            if args.stub:
+                peak[0] = 0
+            try:
+                seconds, peak_bytes = measure(fn, pixels, use_cuda)
+            except torch.cuda.OutOfMemoryError:
+                seconds, peak_bytes = None, "oom"
+                torch.cuda.empty_cache()
+            if args.stub:
+                peak_bytes = peak[0]
+            row = {"mode": mode, "width": width, "height": height, "megapixels": round(width * height / 1e6, 2),
+                   "seconds": seconds and round(seconds, 3), "peak_bytes": peak_bytes}
+            results.append(row)
+            print(json.dumps(row), flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
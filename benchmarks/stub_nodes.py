@@ -0,0 +1,198 @@
+"""Lightweight CPU stand-ins for the ComfyUI nodes and models face_enhance uses.
+
+The stubs keep the shapes and the call pattern of the real graph (latents at 1/8 of the
+image size with 16 channels, a sampler loop that calls the step callback, one decoded
+image per latent) but do almost no arithmetic. Timing face_enhance against them measures
+only the orchestration around the models: image decoding, tensor conversion and copies,
+resizing, PIL conversion and saving.
+
+    from stub_nodes import load_stub_face_enhance
+    face_enhance = load_stub_face_enhance()
+"""
+import os
+import sys
+import types
+
+import torch
+
+LATENT_CHANNELS = 16
+LATENT_STRIDE = 8
+
+
+class StubLatentFormat:
+    latent_rgb_factors = [[1.0 / LATENT_CHANNELS] * 3] * LATENT_CHANNELS
+    latent_rgb_factors_bias = None
+
+
+class StubModelPatcher:
+    def __init__(self):
+        self.model = types.SimpleNamespace(diffusion_model=types.SimpleNamespace(), latent_format=StubLatentFormat())
+
+
+class StubVAE:
+    def encode(self, pixels):
+        latent = torch.nn.functional.avg_pool2d(pixels.movedim(-1, 1), LATENT_STRIDE)
+        return latent.repeat(1, -(-LATENT_CHANNELS // latent.shape[1]), 1, 1)[:, :LATENT_CHANNELS]
+
+    def decode(self, samples):
+        pixels = torch.nn.functional.interpolate(samples[:, :3], scale_factor=LATENT_STRIDE, mode="nearest")
+        return pixels.movedim(1, -1).clamp(0, 1)
+
+
+class StubFaceAnalysis:
+    """Finds no faces, so crop_face falls back to the full frame."""
+
+    def get(self, image):
+        return []
+
+
+class StubNoise:
+    def __init__(self, seed):
+        self.seed = seed
+
+    def generate_noise(self, input_latent):
+        return prepare_noise(input_latent["samples"], self.seed)
+
+
+class StubGuider:
+    def __init__(self, model, conditioning):
+        self.model_patcher = model
+        self.conditioning = conditioning
+
+    def sample(self, noise, latent_image, sampler, sigmas, denoise_mask=None, callback=None, disable_pbar=False,
+               seed=None):
+        x = latent_image + noise * sigmas[0]
+        total_steps = len(sigmas) - 1
+        for i in range(total_steps):
+            denoised = x - noise * sigmas[i]
+            x = denoised + noise * sigmas[i + 1]
+            if callback is not None:
+                callback(i, denoised, x, total_steps)
+        return x
+
+
+def prepare_noise(latent_image, seed, noise_inds=None):
+    generator = torch.manual_seed(seed % (1 << 63))
+    return torch.randn(latent_image.size(), dtype=latent_image.dtype, generator=generator)
+
+
+class LoadImage:
+    def load_image(self, image):
+        from image_utils import to_image_tensor
+
+        pixels = to_image_tensor(os.path.join("ComfyUI", "input", image))
+        return pixels, torch.zeros(pixels.shape[:3])
+
+
+class CLIPTextEncode:
+    def encode(self, clip, text):
+        return ([[torch.zeros(1, 1, 64), {"pooled_output": torch.zeros(1, 64)}]],)
+
+
+class VAEEncode:
+    def encode(self, vae, pixels):
+        height = pixels.shape[1] // LATENT_STRIDE * LATENT_STRIDE
+        width = pixels.shape[2] // LATENT_STRIDE * LATENT_STRIDE
+        return ({"samples": vae.encode(pixels[:, :height, :width, :3])},)
+
+
+class VAEDecode:
+    def decode(self, vae, samples):
+        return (vae.decode(samples["samples"]),)
+
+
+class ControlNetApplyAdvanced:
+    def apply_controlnet(self, positive, negative, control_net, image, strength, start_percent, end_percent, vae=None):
+        return positive, negative
+
+
+class RandomNoise:
+    def get_noise(self, noise_seed):
+        return (StubNoise(noise_seed),)
+
+
+class KSamplerSelect:
+    def get_sampler(self, sampler_name):
+        return (sampler_name,)
+
+
+class BasicGuider:
+    def get_guider(self, model, conditioning):
+        return (StubGuider(model, conditioning),)
+
+
+class BasicScheduler:
+    def get_sigmas(self, model, scheduler, steps, denoise):
+        return (torch.linspace(denoise, 0.0, steps + 1),)
+
+
+class SamplerCustomAdvanced:
+    def sample(self, noise, guider, sampler, sigmas, latent_image):
+        samples = guider.sample(noise.generate_noise(latent_image), latent_image["samples"], sampler, sigmas,
+                                seed=noise.seed)
+        return {"samples": samples}, {"samples": samples}
+
+
+class SetUnionControlNetType:
+    def set_controlnet_type(self, control_net, type):
+        return (control_net,)
+
+
+class ApplyPulidFlux:
+    def apply_pulid_flux(self, model, **kwargs):
+        return (model,)
+
+
+NODE_CLASS_MAPPINGS = {
+    "RandomNoise": RandomNoise,
+    "KSamplerSelect": KSamplerSelect,
+    "BasicGuider": BasicGuider,
+    "BasicScheduler": BasicScheduler,
+    "SamplerCustomAdvanced": SamplerCustomAdvanced,
+    "SetUnionControlNetType": SetUnionControlNetType,
+    "ApplyPulidFlux": ApplyPulidFlux,
+}
+
+
+def stub_models() -> dict:
+    """COMFY_MODELS entries for every component face_enhance loads."""
+    return {
+        "dualcliploader_94": (object(),),
+        "vaeloader_95": (StubVAE(),),
+        "pulidfluxmodelloader_44": (object(),),
+        "pulidfluxevacliploader_45": (object(),),
+        "pulidfluxinsightfaceloader_46": (StubFaceAnalysis(),),
+        "controlnetloader_49": (object(),),
+        "unetloader_93": (StubModelPatcher(),),
+    }
+
+
+def install() -> None:
+    """Registers stub `nodes`, `comfy.sample` and `comfy.model_management` modules."""
+    nodes = types.ModuleType("nodes")
+    for name in ("LoadImage", "CLIPTextEncode", "VAEEncode", "VAEDecode", "ControlNetApplyAdvanced"):
+        setattr(nodes, name, globals()[name])
+    nodes.NODE_CLASS_MAPPINGS = NODE_CLASS_MAPPINGS
+
+    comfy = types.ModuleType("comfy")
+    comfy.sample = types.ModuleType("comfy.sample")
+    comfy.sample.prepare_noise = prepare_noise
+    comfy.model_management = types.ModuleType("comfy.model_management")
+    comfy.model_management.get_torch_device = lambda: torch.device("cpu")
+    comfy.model_management.soft_empty_cache = lambda *args, **kwargs: None
+
+    sys.modules["nodes"] = nodes
+    sys.modules["comfy"] = comfy
+    sys.modules["comfy.sample"] = comfy.sample
+    sys.modules["comfy.model_management"] = comfy.model_management
+
+
+def load_stub_face_enhance():
+    """Imports face_enhance with every ComfyUI node and model replaced by the stubs above."""
+    install()
+    os.environ["FACE_ENHANCE_LAZY"] = "1"
+    import face_enhance
+
+    face_enhance.COMFYUI_READY = True
+    face_enhance.COMFY_MODELS = stub_models()
+    return face_enhance
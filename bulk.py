@@ -0,0 +1,194 @@
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
+JOURNAL_NAME = "face_enhance_journal.jsonl"
+
+
+def _value(row, key, default):
+    """`row[key]`, or `default` when the column is absent or empty (0 is a value, not a gap)."""
+    value = row.get(key)
+    return default if value is None or value == "" else value
+
+
+def read_manifest(path, defaults=None):
+    """Reads bulk items from a CSV (with a header row) or JSONL manifest.
+
+    Each item needs `input`, `ref` and `output`; `id_weight`, `prompt` and `seed` are optional
+    and fall back to `defaults`. Relative paths are resolved against the manifest's directory.
+    """
+    defaults = defaults or {}
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    items = []
+    for line_no, row in enumerate(rows, start=1):
+        missing = [key for key in ("input", "ref", "output") if not row.get(key)]
+        if missing:
+            raise ValueError(f"{path}: item {line_no} is missing {', '.join(missing)}")
+        item = {key: os.path.join(base_dir, row[key]) for key in ("input", "ref", "output")}
+        item["id_weight"] = float(_value(row, "id_weight", defaults.get("id_weight", 0.75)))
+        item["prompt"] = _value(row, "prompt", defaults.get("prompt", ""))
+        seed = _value(row, "seed", defaults.get("seed"))
+        item["seed"] = int(seed) if seed not in (None, "") else None
+        items.append(item)
+    return items
+
+
+def scan_directory(input_dir, ref_path, output_dir, defaults=None):
+    """Builds bulk items for every image in `input_dir`, all enhanced against one reference."""
+    defaults = defaults or {}
+    items = []
+    for name in sorted(os.listdir(input_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            continue
+        items.append({
+            "input": os.path.join(input_dir, name),
+            "ref": ref_path,
+            "output": os.path.join(output_dir, f"{stem}.png"),
+            "id_weight": defaults.get("id_weight", 0.75),
+            "prompt": defaults.get("prompt", ""),
+            "seed": defaults.get("seed"),
+        })
+    return items
+
+
+def item_fingerprint(item):
+    """Hashes the parameters that determine an item's output, plus the size and mtime of both images."""
+    params = {key: value for key, value in item.items() if key != "output"}
+    for key in ("input", "ref"):
+        stat = os.stat(item[key])
+        params[f"{key}_stat"] = [stat.st_size, stat.st_mtime_ns]
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+class Journal:
+    """Append-only JSONL record of finished items, used to resume an interrupted run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # A line cut short by an interrupted run
+                    if entry.get("status") == "done":
+                        self.done[entry["output"]] = entry["fingerprint"]
+
+    def is_done(self, item, fingerprint):
+        return self.done.get(item["output"]) == fingerprint and os.path.exists(item["output"])
+
+    def record(self, entry):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            if entry["status"] == "done":
+                self.done[entry["output"]] = entry["fingerprint"]
+
+
+def run_bulk(items, journal_path, prefetch=2, on_result=None, **options):
+    """Enhances every item with the models kept resident, skipping items already journaled.
+
+    Extra keyword `options` (such as crop_face) are passed to face_enhance.enhance_pixels()
+    and are part of each item's fingerprint.
+
+    The next `prefetch` items are decoded on background threads while the current one is
+    on the GPU, and outputs are encoded and written on another thread. Each finished item
+    is journaled and passed to `on_result` as soon as it is written.
+
+    Returns:
+        dict: Counts of "done", "skipped" and "failed" items.
+    """
+    import torch
+    import face_enhance
+    from image_utils import to_image_tensor
+
+    journal = Journal(journal_path)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    on_result = on_result or (lambda entry: print(json.dumps(entry), flush=True))
+    finish_lock = threading.Lock()
+
+    def finish(entry):
+        journal.record(entry)
+        with finish_lock:
+            counts[entry["status"]] += 1
+            on_result(entry)
+
+    todo = []
+    for item in items:
+        fingerprint = item_fingerprint(dict(item, **options))
+        if journal.is_done(item, fingerprint):
+            counts["skipped"] += 1
+            on_result({"input": item["input"], "output": item["output"], "status": "skipped"})
+        else:
+            todo.append((item, fingerprint))
+    if not todo:
+        return counts
+
+    face_enhance.initialize_models()
+    ref_pixels = {}
+
+    def decode(item):
+        if item["ref"] not in ref_pixels:
+            ref_pixels[item["ref"]] = to_image_tensor(item["ref"])
+        return ref_pixels[item["ref"]], to_image_tensor(item["input"])
+
+    def encode(images, item, fingerprint, start):
+        try:
+            face_enhance.save_comfy_images(images, [item["output"]])
+            finish({"input": item["input"], "output": item["output"], "fingerprint": fingerprint,
+                    "status": "done", "seconds": round(time.perf_counter() - start, 3)})
+        except Exception as e:
+            finish({"input": item["input"], "output": item["output"], "fingerprint": fingerprint,
+                    "status": "failed", "error": str(e)})
+
+    remaining = iter(todo)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix="decode") as decode_pool, \
+         ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode") as encode_pool:
+
+        def fill():
+            while len(pending) < max(1, prefetch):
+                next_item = next(remaining, None)
+                if next_item is None:
+                    return
+                pending.append((next_item, decode_pool.submit(decode, next_item[0])))
+
+        fill()
+        while pending:
+            (item, fingerprint), decoded = pending.popleft()
+            fill()
+            start = time.perf_counter()
+            try:
+                face_pixels, input_pixels = decoded.result()
+                with torch.inference_mode():
+                    enhanced = face_enhance.enhance_pixels(
+                        face_pixels=face_pixels,
+                        input_pixels=input_pixels,
+                        positive_prompt=item["prompt"],
+                        id_weight=item["id_weight"],
+                        seed=item["seed"],
+                        **options,
+                    )
+            except Exception as e:
+                finish({"input": item["input"], "output": item["output"], "fingerprint": fingerprint,
+                        "status": "failed", "error": str(e)})
+                continue
+            encode_pool.submit(encode, enhanced, item, fingerprint, start)
+
+    return counts
@@ -0,0 +1,233 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def tensor_hash(tensor, *extra) -> str:
+    """Hash the raw contents of a tensor, plus any extra values that change its meaning."""
+    digest = hashlib.blake2b(digest_size=20)
+    array = tensor.detach().cpu().contiguous().numpy()
+    digest.update(str((array.shape, str(array.dtype), extra)).encode())
+    digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """A thread-safe in-memory LRU cache bounded by entry count.
+
+    Keeps hit/miss/eviction counters so the cache can be sized from real traffic.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class IdentityEmbeddingCache:
+    """Caches PuLID identity embeddings by the content of the reference face.
+
+    Lookups go to an in-memory LRU first and then, if `cache_dir` is set, to one
+    `<key>.pt` file per embedding on disk, so a reference survives process restarts.
+    """
+
+    def __init__(self, max_entries: int = 64, cache_dir: str = None):
+        self.memory = LRUCache(max_entries)
+        self.cache_dir = cache_dir
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image, **params) -> str:
+        """Key an embedding by the reference pixels and the parameters that shape it."""
+        return tensor_hash(image, sorted(params.items()))
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def get(self, key: str):
+        embedding = self.memory.get(key)
+        if embedding is not None:
+            return embedding
+
+        if self.cache_dir and os.path.exists(self._disk_path(key)):
+            import torch
+            try:
+                embedding = torch.load(self._disk_path(key), map_location="cpu")
+            except (OSError, RuntimeError) as e:
+                print(f"Error loading identity embedding from cache: {e}")
+            else:
+                self.disk_hits += 1
+                self.memory.put(key, embedding)
+                return embedding
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, embedding) -> None:
+        embedding = embedding.detach().cpu()
+        self.memory.put(key, embedding)
+        if self.cache_dir:
+            import torch
+            tmp_path = self._disk_path(key) + ".tmp"
+            try:
+                torch.save(embedding, tmp_path)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError as e:
+                print(f"Error caching identity embedding: {e}")
+
+    def stats(self) -> dict:
+        memory_stats = self.memory.stats()
+        return {
+            "entries": memory_stats["entries"],
+            "max_entries": memory_stats["max_entries"],
+            "memory_hits": memory_stats["hits"],
+            "disk_hits": self.disk_hits,
+            "hits": memory_stats["hits"] + self.disk_hits,
+            "misses": self.misses,
+            "evictions": memory_stats["evictions"],
+        }
+
+
+def image_key(image, **params) -> str:
+    """Key a PIL image by its raw pixel buffer and the generation parameters applied to it."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((image.mode, image.size, sorted(params.items()))).encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """A size-bounded on-disk LRU cache of encoded images, one `<key>.png` per entry.
+
+    Recency is kept in the file mtimes, so the LRU order survives restarts. Entries are
+    evicted oldest first whenever the cache holds more than `max_bytes` or `max_entries`.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1 << 30, max_entries: int = 1000):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        files = [entry for entry in os.scandir(cache_dir) if entry.is_file() and entry.name.endswith(".png")]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            size = entry.stat().st_size
+            self._entries[entry.name[:-len(".png")]] = size
+            self.total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def _evict(self) -> None:
+        while self._entries and (self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str):
+        """Returns the cached encoded bytes for `key`, or None."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                os.utime(self._path(key))
+            except OSError as e:
+                print(f"Error loading from cache: {e}")
+                self.total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_read += len(data)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            tmp_path = self._path(key) + ".tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                print(f"Error caching result: {e}")
+                return
+            self.total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self.bytes_written += len(data)
+            self._evict()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
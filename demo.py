@@ -9,91 +9,113 @@ if "HF_DEMO" in os.environ:
         INSTALLED = True
 
 import gradio as gr
-import tempfile
-import hashlib
 import io
-import pickle
 import sys
-from test import process_face
+import time
+import telemetry
+from caches import ResultCache, image_key
+from face_enhance import CONDITIONING_CACHE, IDENTITY_CACHE, face_enhance_stream
 from PIL import Image
 
 INPUT_CACHE_DIR = "./cache"
-os.makedirs(INPUT_CACHE_DIR, exist_ok=True)
+RESULT_CACHE = ResultCache(
+    INPUT_CACHE_DIR,
+    max_bytes=int(float(os.environ.get("DEMO_CACHE_MAX_MB", 1024)) * (1 << 20)),
+    max_entries=int(os.environ.get("DEMO_CACHE_MAX_ENTRIES", 1000)),
+)
+PREVIEW_EVERY = int(os.environ.get("DEMO_PREVIEW_EVERY", 4))
+# Prometheus metrics are served on this port next to the Gradio app; 0 disables them
+METRICS_PORT = int(os.environ.get("DEMO_METRICS_PORT", 9100))
 
-def get_image_hash(img):
-    """Generate a hash of the image content."""
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format='PNG')
-    return hashlib.md5(img_bytes.getvalue()).hexdigest()
+telemetry.enable()
+telemetry.add_cache_collector("result", RESULT_CACHE.stats)
+telemetry.add_cache_collector("identity", IDENTITY_CACHE.stats)
+telemetry.add_cache_collector("prompt", CONDITIONING_CACHE.stats)
 
-def enhance_face_gradio(input_image, ref_image):
+def get_cache_key(input_image, ref_image, id_weight, positive_prompt, seed, crop_face, preset):
+    """Combine the pixel hashes of both images with every generation parameter."""
+    params = {"id_weight": id_weight, "positive_prompt": positive_prompt, "seed": seed, "crop_face": crop_face,
+              "preset": preset}
+    return image_key(input_image, role="input", **params) + "_" + image_key(ref_image, role="ref")
+
+def get_cache_stats():
+    return RESULT_CACHE.stats()
+
+def enhance_face_gradio(input_image, ref_image, id_weight=0.75, positive_prompt="", seed=-1, crop_face=False,
+                        preset="max"):
     """
-    Wrapper function for process_face that works with Gradio.
+    Wrapper function for face_enhance_stream that works with Gradio.
+
+    Yields a low-resolution preview every few sampling steps, then the final image.
     
     Args:
         input_image: Input image from Gradio
         ref_image: Reference face image from Gradio
+        id_weight: Face ID weight
+        positive_prompt: Text prompt for the enhancement
+        seed: Sampling seed, or -1 for a random one
+        crop_face: Only enhance a crop around the face and blend it back
+        preset: Latency/quality preset (draft, balanced or max)
         
-    Returns:
-        PIL Image: Enhanced image
+    Yields:
+        PIL Image: Previews, then the enhanced image
     """
-    # Generate hashes for both images
-    input_hash = get_image_hash(input_image)
-    ref_hash = get_image_hash(ref_image)
-    combined_hash = f"{input_hash}_{ref_hash}"
-    cache_path = os.path.join(INPUT_CACHE_DIR, f"{combined_hash}.pkl")
-    
-    # Check if result exists in cache
-    if os.path.exists(cache_path):
-        try:
-            with open(cache_path, 'rb') as f:
-                result_img = pickle.load(f)
-                print(f"Returning cached result for images with hash {combined_hash}")
-                return result_img
-        except (pickle.PickleError, IOError) as e:
-            print(f"Error loading from cache: {e}")
-            # Continue to processing if cache load fails
-    
-    # Create temporary files for input, reference, and output
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as input_file, \
-         tempfile.NamedTemporaryFile(suffix=".png", delete=False) as ref_file, \
-         tempfile.NamedTemporaryFile(suffix=".png", delete=False) as output_file:
-        
-        input_path = input_file.name
-        ref_path = ref_file.name
-        output_path = output_file.name
-    
-    # Save uploaded images to temporary files
-    input_image.save(input_path)
-    ref_image.save(ref_path)
-    
+    seed = None if seed is None or seed < 0 else int(seed)
+    start = time.perf_counter()
+    status = "cancelled"
     try:
-        process_face(
-            input_path=input_path,
-            ref_path=ref_path,
-            output_path=output_path
-        )
-    except Exception as e:
-        # Handle the error, log it, and return an error message
-        print(f"Error processing face: {e}")
-        return "An error occurred while processing the face. Please try again."
+        with telemetry.trace("demo_request", preset=preset, crop_face=crop_face) as request_trace:
+            with telemetry.span("cache_lookup"):
+                cache_key = get_cache_key(input_image, ref_image, id_weight, positive_prompt, seed, crop_face, preset)
+                # Check if result exists in cache
+                cached = RESULT_CACHE.get(cache_key)
+            if cached is not None:
+                print(f"Returning cached result for key {cache_key}")
+                result_img = Image.open(io.BytesIO(cached))
+                result_img.load()
+                status = "cached"
+                yield result_img
+                return
+
+            result_img = None
+            try:
+                # The images go to the pipeline in memory; nothing is written to disk but the cache entry.
+                # Cancelling the event closes this generator, which stops sampling at the next step.
+                for event in face_enhance_stream(
+                    ref_image,
+                    input_image,
+                    id_weight=id_weight,
+                    positive_prompt=positive_prompt,
+                    seed=seed,
+                    crop_face=crop_face,
+                    preset=preset,
+                    preview_every=PREVIEW_EVERY,
+                ):
+                    if event["type"] == "preview":
+                        yield event["image"]
+                    else:
+                        result_img = event["image"]
+            except Exception as e:
+                # Handle the error, log it, and show an error message
+                status = "error"
+                print(f"Error processing face: {e}")
+                raise gr.Error("An error occurred while processing the face. Please try again.")
+            if result_img is None:
+                return
+
+            # Spans after a yield name the trace explicitly; see telemetry.trace()
+            with telemetry.span("encode_save", trace=request_trace):
+                result_bytes = io.BytesIO()
+                result_img.save(result_bytes, format="PNG")
+                RESULT_CACHE.put(cache_key, result_bytes.getvalue())
+            print(f"Cached result for key {cache_key}")
+            status = "ok"
+
+        yield result_img
     finally:
-        # Clean up temporary input and reference files
-        os.unlink(input_path)
-        os.unlink(ref_path)
-    
-    # Load the output image
-    result_img = Image.open(output_path)
-    
-    # Cache the result
-    try:
-        with open(cache_path, 'wb') as f:
-            pickle.dump(result_img, f)
-            print(f"Cached result for images with hash {combined_hash}")
-    except (pickle.PickleError, IOError) as e:
-        print(f"Error caching result: {e}")
-    
-    return result_img
+        telemetry.REQUESTS.inc(endpoint="demo", status=status)
+        if status in ("ok", "cached"):
+            telemetry.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="demo")
 
 def create_gradio_interface():
     with gr.Blocks(title="Face Enhancement") as demo:
@@ -104,7 +126,7 @@ def create_gradio_interface():
         2. Upload a high-quality face image
         3. Click 'Enhance Face'
 
-        Processing takes around 30 seconds.
+        Processing takes around 30 seconds. A rough preview appears every few steps; click 'Cancel' to stop early.
         """, elem_id="instructions")
 
         gr.Markdown("---")
@@ -113,17 +135,31 @@ def create_gradio_interface():
             with gr.Column():
                 input_image = gr.Image(label="Target Image", type="pil")
                 ref_image = gr.Image(label="Reference Face", type="pil")
-                enhance_button = gr.Button("Enhance Face")
+                preset = gr.Radio(["draft", "balanced", "max"], value="max", label="Speed preset",
+                                  info="draft and balanced use fewer sampling steps for quick previews")
+                with gr.Accordion("Advanced", open=False):
+                    id_weight = gr.Slider(0.0, 1.5, value=0.75, step=0.05, label="Face ID weight")
+                    positive_prompt = gr.Textbox(value="", label="Prompt")
+                    seed = gr.Number(value=-1, precision=0, label="Seed (-1 for random)")
+                    crop_face = gr.Checkbox(value=False, label="Only enhance the face region (faster on large images)")
+                with gr.Row():
+                    enhance_button = gr.Button("Enhance Face")
+                    cancel_button = gr.Button("Cancel")
             
             with gr.Column():
                 output_image = gr.Image(label="Enhanced Result")
+                with gr.Accordion("Cache stats", open=False):
+                    cache_stats = gr.JSON(value=get_cache_stats)
+                    refresh_button = gr.Button("Refresh")
+                    refresh_button.click(fn=get_cache_stats, inputs=None, outputs=cache_stats)
         
-        enhance_button.click(
+        enhance_event = enhance_button.click(
             fn=enhance_face_gradio,
-            inputs=[input_image, ref_image],
+            inputs=[input_image, ref_image, id_weight, positive_prompt, seed, crop_face, preset],
             outputs=output_image,
             queue=True  # Enable queue for sequential processing
         )
+        cancel_button.click(fn=None, inputs=None, outputs=None, cancels=[enhance_event])
         gr.Markdown("""
         ## Examples
         Click on an example to load the images into the interface.
@@ -146,6 +182,9 @@ def create_gradio_interface():
 
     # Launch the Gradio app with queue
     demo.queue(max_size=99)
+    if METRICS_PORT:
+        telemetry.serve_metrics(METRICS_PORT)
+        print(f"Serving metrics on port {METRICS_PORT} at /metrics")
     
     try:
         demo.launch()
@@ -1,98 +1,291 @@
 #!/usr/bin/env python
 import argparse
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from PIL import Image
 import numpy as np
 
-def create_comparison_gif(before_img_path, after_img_path, output_path=None, duration=100, frames=20, crop_pixels=0, bottom_bias=0.50):
+FORMATS = (".gif", ".webp", ".mp4")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def load_pair(before_img_path, after_img_path, crop_pixels=0, bottom_bias=0.50, even=False):
     """
-    Create a comparison GIF with a vertical bar revealing the 'after' image.
-    
-    Args:
-        before_img_path (str): Path to the 'before' image
-        after_img_path (str): Path to the 'after' image
-        output_path (str, optional): Path for the output GIF. Defaults to 'comparison.gif'
-        duration (int, optional): Duration of each frame in ms. Defaults to 100.
-        frames (int, optional): Number of frames in the GIF. Defaults to 20.
-        crop_pixels (int, optional): Number of pixels to crop from each side. Defaults to 0.
-        bottom_bias (float, optional): Percentage of additional cropping from the bottom. Defaults to 0.25 (25% more from the bottom).
-    
-    Returns:
-        str: Path to the created GIF
+    Load the 'before' and 'after' images as RGB uint8 arrays of the same size.
+
+    The 'after' image is resized to the 'before' image if they differ. crop_pixels and
+    bottom_bias crop both the same way as create_comparison_gif(). With even=True the
+    size is trimmed to even numbers, which H.264 needs.
     """
-    # Default output path
-    if output_path is None:
-        output_path = 'comparison.gif'
-     
-    # Open images and ensure they have the same size
-    before_img = Image.open(before_img_path)
-    after_img = Image.open(after_img_path)
-    
-    # Resize if they're different
+    before_img = Image.open(before_img_path).convert('RGB')
+    after_img = Image.open(after_img_path).convert('RGB')
     if before_img.size != after_img.size:
         after_img = after_img.resize(before_img.size, Image.LANCZOS)
-    
+
     width, height = before_img.size
-    
-    # Crop the images if crop_pixels is specified
+    left, top, right, bottom = 0, 0, width, height
     if crop_pixels > 0:
         left = crop_pixels
         right = width - crop_pixels
         top = int(crop_pixels * (1 - bottom_bias))
         bottom = height - int(crop_pixels * (1 + bottom_bias))
-        before_img = before_img.crop((left, top, right, bottom))
-        after_img = after_img.crop((left, top, right, bottom))
-        width, height = before_img.size  # Update width and height after cropping
-    
-    # Create frames for the GIF
-    gif_frames = []
-    
-    for i in range(frames + 1):
-        # Calculate position of the reveal bar
-        bar_position = int((width * i) / frames)
-        
-        # Create a new frame
-        frame = Image.new('RGBA', (width, height))
-        
-        # Paste the 'before' image
-        frame.paste(before_img, (0, 0))
-        
-        # Create a mask for the 'after' image
-        mask = Image.new('L', (width, height), 0)
-        mask_array = np.array(mask)
-        mask_array[:, :bar_position] = 255
-        mask = Image.fromarray(mask_array)
-        
-        # Paste the 'after' image with the mask
-        frame.paste(after_img, (0, 0), mask)
-        
-        # Add to frames
-        gif_frames.append(frame.convert('RGBA'))
-    
-    # Save as GIF
-    gif_frames[0].save(
+    if even:
+        right -= (right - left) % 2
+        bottom -= (bottom - top) % 2
+
+    # Cropping is slicing; no image copies until the frames are composed
+    before = np.asarray(before_img)[top:bottom, left:right]
+    after = np.asarray(after_img)[top:bottom, left:right]
+    return before, after
+
+
+def reveal_mask(width, frames):
+    """(frames + 1, width) bool array, True where frame i shows the 'after' image."""
+    bar_positions = (width * np.arange(frames + 1)) // frames
+    return np.arange(width)[None, :] < bar_positions[:, None]
+
+
+def compose_frames(before, after, frames):
+    """
+    Compose every frame of the reveal at once into one preallocated array.
+
+    `before` and `after` are (H, W) palette indices or (H, W, C) pixels. Returns an array
+    of shape (frames + 1, *before.shape) where frame i shows 'after' left of the bar.
+    """
+    mask = reveal_mask(before.shape[1], frames)
+    # Broadcast the per-column mask over rows (and channels)
+    mask = mask[:, None, :] if before.ndim == 2 else mask[:, None, :, None]
+    output = np.empty((frames + 1,) + before.shape, dtype=before.dtype)
+    output[:] = before
+    np.copyto(output, after, where=mask)
+    return output
+
+
+def shared_palette_indices(before, after, colors=256):
+    """
+    Quantize both images with one shared palette.
+
+    Every frame is made of 'before' and 'after' pixels only, so the two images are
+    quantized once and the frames are composed from their palette indices. This is
+    faster than quantizing every frame, but both images now share `colors` entries
+    instead of each frame getting its own palette, so GIF quality can drop (more
+    banding) when the two images differ a lot in colour.
+
+    Returns:
+        tuple: (before indices, after indices, palette)
+    """
+    width = before.shape[1]
+    combined = Image.fromarray(np.concatenate([before, after], axis=1)).quantize(colors=colors, method=Image.MEDIANCUT)
+    indices = np.asarray(combined)
+    return indices[:, :width], indices[:, width:], combined.getpalette()
+
+
+def save_gif(before, after, output_path, duration, frames):
+    before_indices, after_indices, palette = shared_palette_indices(before, after)
+    frame_indices = compose_frames(before_indices, after_indices, frames)
+    images = []
+    for indices in frame_indices:
+        image = Image.fromarray(indices)
+        image.putpalette(palette)
+        images.append(image)
+    images[0].save(
         output_path,
         save_all=True,
-        append_images=gif_frames[1:],
+        append_images=images[1:],
         optimize=False,
         duration=duration,
         loop=0,
         disposal=2
     )
-    
+
+
+def save_webp(before, after, output_path, duration, frames, quality=80):
+    # Pillow's WebP writer lists every appended frame up front, so the frames can't be
+    # streamed; composing them one at a time at least keeps a single copy of each
+    images = [Image.fromarray(np.where(mask[None, :, None], after, before))
+              for mask in reveal_mask(before.shape[1], frames)]
+    images[0].save(
+        output_path,
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+        quality=quality,
+        method=4
+    )
+
+
+def save_mp4(before, after, output_path, duration, frames, crf=18):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("MP4 output needs ffmpeg on the PATH; use a .gif or .webp output instead")
+    height, width = before.shape[:2]
+    command = [
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-framerate', f'{1000 / duration:g}',
+        '-i', '-',
+        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', str(crf), '-movflags', '+faststart',
+        str(output_path),
+    ]
+    # Stream one reused frame buffer to ffmpeg instead of composing every frame up front
+    frame = np.empty_like(before, order='C')
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for mask in reveal_mask(width, frames):
+            frame[:] = before
+            np.copyto(frame, after, where=mask[None, :, None])
+            process.stdin.write(frame)
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its return code below says why
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+SAVERS = {
+    ".gif": save_gif,
+    ".webp": save_webp,
+    ".mp4": save_mp4,
+}
+
+
+def create_comparison_gif(before_img_path, after_img_path, output_path=None, duration=100, frames=20, crop_pixels=0, bottom_bias=0.50):
+    """
+    Create a comparison animation with a vertical bar revealing the 'after' image.
+
+    Frames are composed with NumPy. MP4 frames are written one at a time to ffmpeg's
+    stdin. GIF (palette indices, one byte per pixel) and WebP (full RGB, since Pillow
+    needs the whole frame list) still hold every frame in memory. GIFs use a single
+    palette shared by every frame. The format follows the output extension: .gif,
+    .webp (animated WebP, smaller) or .mp4 (H.264, smallest; needs ffmpeg).
+
+    Args:
+        before_img_path (str): Path to the 'before' image
+        after_img_path (str): Path to the 'after' image
+        output_path (str, optional): Path for the output. Defaults to 'comparison.gif'
+        duration (int, optional): Duration of each frame in ms. Defaults to 100.
+        frames (int, optional): Number of frames in the GIF. Defaults to 20.
+        crop_pixels (int, optional): Number of pixels to crop from each side. Defaults to 0.
+        bottom_bias (float, optional): Percentage of additional cropping from the bottom. Defaults to 0.50 (50% more from the bottom).
+
+    Returns:
+        str: Path to the created animation
+    """
+    # Default output path
+    if output_path is None:
+        output_path = 'comparison.gif'
+    extension = Path(output_path).suffix.lower()
+    if extension not in SAVERS:
+        raise ValueError(f"Unsupported output format '{extension}'. Use one of: {', '.join(FORMATS)}")
+
+    before, after = load_pair(before_img_path, after_img_path, crop_pixels, bottom_bias, even=extension == ".mp4")
+    SAVERS[extension](before, after, output_path, duration, frames)
     return output_path
 
+
+def find_pairs(before_dir, after_dir):
+    """
+    Pairs the images in two directories by file stem, e.g. before/dany_1.png with after/dany_1.jpg.
+
+    Raises ValueError if a directory holds two images with the same stem (e.g. dany_1.png
+    and dany_1.jpg): the pairing would be ambiguous and both would write the same output.
+
+    Returns:
+        tuple: ([(before path, after path)], [paths of images without a partner])
+    """
+    def images(directory):
+        by_stem = {}
+        for path in sorted(Path(directory).iterdir()):
+            if path.suffix.lower() in IMAGE_EXTENSIONS:
+                by_stem.setdefault(path.stem, []).append(path)
+        duplicates = [paths for paths in by_stem.values() if len(paths) > 1]
+        if duplicates:
+            names = "; ".join(", ".join(path.name for path in paths) for paths in duplicates)
+            raise ValueError(f"{directory} has several images with the same file stem, so they cannot be paired by name: {names}")
+        return {stem: paths[0] for stem, paths in by_stem.items()}
+
+    before_images, after_images = images(before_dir), images(after_dir)
+    pairs = [(before_images[stem], after_images[stem]) for stem in before_images if stem in after_images]
+    unmatched = [path for stem, path in before_images.items() if stem not in after_images]
+    unmatched += [path for stem, path in after_images.items() if stem not in before_images]
+    return pairs, unmatched
+
+
+def create_comparison_batch(before_dir, after_dir, output_dir, extension=".gif", workers=None, **options):
+    """
+    Create one comparison per matching pair of images in two directories, on a process pool.
+
+    Images without a partner in the other directory are reported and skipped. A pair that
+    fails does not stop the others.
+
+    Returns:
+        tuple: (paths of the created animations, {stem: error} of the pairs that failed)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pairs, unmatched = find_pairs(before_dir, after_dir)
+    for path in unmatched:
+        print(f"Skipping {path}: no image with the same name in the other directory")
+    created = []
+    failed = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(create_comparison_gif, str(before), str(after),
+                            os.path.join(output_dir, before.stem + extension), **options): before.stem
+            for before, after in pairs
+        }
+        for future in as_completed(futures):
+            try:
+                created.append(future.result())
+                print(f"Created {created[-1]}")
+            except Exception as e:
+                failed[futures[future]] = e
+                print(f"Failed to create the comparison for {futures[future]}: {e}")
+    return created, failed
+
+
 def main():
     parser = argparse.ArgumentParser(description='Create a before/after comparison GIF with a sliding reveal effect')
-    parser.add_argument('before_image', help='Path to the before image')
-    parser.add_argument('after_image', help='Path to the after image')
-    parser.add_argument('--output', '-o', help='Output path for the GIF', default='comparison.gif')
+    parser.add_argument('before_image', help='Path to the before image, or a directory of them with --batch')
+    parser.add_argument('after_image', help='Path to the after image, or a directory of them with --batch')
+    parser.add_argument('--output', '-o', help='Output path (.gif, .webp or .mp4), or a directory with --batch', default='comparison.gif')
     parser.add_argument('--duration', '-d', type=int, help='Duration of each frame in ms', default=100)
     parser.add_argument('--frames', '-f', type=int, help='Number of frames to generate', default=20)
     parser.add_argument('--crop', '-c', type=int, help='Number of pixels to crop from each side', default=0)
-    
+    parser.add_argument('--batch', action='store_true', help='Pair the images in two directories by file name')
+    parser.add_argument('--format', choices=[extension[1:] for extension in FORMATS], default='gif', help='Output format with --batch')
+    parser.add_argument('--workers', '-w', type=int, help='Processes used with --batch (default: one per CPU)')
+
     args = parser.parse_args()
-    
+
+    if args.batch:
+        output_dir = args.output if args.output != 'comparison.gif' else 'comparisons'
+        try:
+            created, failed = create_comparison_batch(
+                args.before_image,
+                args.after_image,
+                output_dir,
+                extension=f".{args.format}",
+                workers=args.workers,
+                duration=args.duration,
+                frames=args.frames,
+                crop_pixels=args.crop
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Created {len(created)} comparisons in {output_dir}")
+        if failed:
+            sys.exit(f"Failed to create {len(failed)} comparisons: {', '.join(sorted(failed))}")
+        return
+
     output_path = create_comparison_gif(
         args.before_image,
         args.after_image,
@@ -101,8 +294,8 @@ def main():
         args.frames,
         args.crop
     )
-    
-    print(f"Created comparison GIF: {output_path}")
+
+    print(f"Created comparison: {output_path}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
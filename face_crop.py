@@ -0,0 +1,76 @@
+import numpy as np
+import torch
+
+from image_utils import resize_image
+
+
+def detect_face_box(face_analysis, image: torch.Tensor):
+    """Returns the (x1, y1, x2, y2) box of the largest face in an image, or None if there is none.
+
+    Args:
+        face_analysis: The InsightFace FaceAnalysis model loaded for PuLID.
+        image: One IMAGE tensor of shape [height, width, channels].
+    """
+    # InsightFace expects uint8 BGR
+    numpy_image = np.clip(255. * image.cpu().numpy(), 0, 255).astype(np.uint8)[..., ::-1]
+    faces = face_analysis.get(np.ascontiguousarray(numpy_image))
+    if not faces:
+        return None
+    x1, y1, x2, y2 = max(faces, key=lambda face: (face.bbox[2] - face.bbox[0]) * (face.bbox[3] - face.bbox[1])).bbox
+    return float(x1), float(y1), float(x2), float(y2)
+
+
+def square_crop_box(face_box, width: int, height: int, padding: float = 0.6):
+    """Expands a face box into a square crop with `padding` face-sizes of context on each side.
+
+    The square is shifted to stay inside the image and shrunk if it is larger than the image.
+    """
+    x1, y1, x2, y2 = face_box
+    side = int(round(max(x2 - x1, y2 - y1) * (1 + 2 * padding)))
+    side = max(1, min(side, width, height))
+    center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+    left = int(round(min(max(center_x - side / 2, 0), width - side)))
+    top = int(round(min(max(center_y - side / 2, 0), height - side)))
+    return left, top, left + side, top + side
+
+
+def feather_mask(box, width: int, height: int, feather: float = 0.1) -> torch.Tensor:
+    """Builds a [box_height, box_width, 1] blend mask that fades to 0 over `feather` of the crop size.
+
+    Edges that lie on the image border are not faded, since there is nothing to blend into there.
+    """
+    left, top, right, bottom = box
+    box_width, box_height = right - left, bottom - top
+    ramp = max(1, int(round(min(box_width, box_height) * feather)))
+
+    def edge_ramp(length, fade_start, fade_end):
+        position = torch.arange(length, dtype=torch.float32) + 0.5
+        weights = torch.ones(length)
+        if fade_start:
+            weights = torch.minimum(weights, position / ramp)
+        if fade_end:
+            weights = torch.minimum(weights, (length - position) / ramp)
+        return weights.clamp(0, 1)
+
+    mask_y = edge_ramp(box_height, top > 0, bottom < height)
+    mask_x = edge_ramp(box_width, left > 0, right < width)
+    return (mask_y[:, None] * mask_x[None, :])[..., None]
+
+
+def crop_image(pixels: torch.Tensor, box, size: int) -> torch.Tensor:
+    """Crops `box` out of an IMAGE tensor and resizes it to a `size` x `size` working resolution."""
+    left, top, right, bottom = box
+    return resize_image(pixels[:, top:bottom, left:right, :], size, size)
+
+
+def paste_back(pixels: torch.Tensor, crop: torch.Tensor, box, feather: float = 0.1) -> torch.Tensor:
+    """Resizes an enhanced crop back to its box and blends it into the original with a feathered mask."""
+    left, top, right, bottom = box
+    height, width = pixels.shape[1], pixels.shape[2]
+    crop = resize_image(crop, bottom - top, right - left).to(pixels.device, pixels.dtype)
+    mask = feather_mask(box, width, height, feather).to(pixels.device, pixels.dtype)
+
+    result = pixels.clone()
+    original = pixels[:, top:bottom, left:right, :]
+    result[:, top:bottom, left:right, :] = crop * mask + original * (1 - mask)
+    return result
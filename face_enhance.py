@@ -1,9 +1,21 @@
+import contextvars
+import functools
 import os
+import queue
 import random
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from typing import Sequence, Mapping, Any, Union
 import torch
 import spaces
+from caches import IdentityEmbeddingCache, LRUCache
+from loading import load_parallel
+from image_utils import to_image_tensor, to_pil_images
+from previews import CallbackGuider, EnhancementCancelled, latent_to_image
+from face_scoring import FaceScorer, distance_image
+import profiling
 COMFYUI_PATH = "./ComfyUI"
 
 """
@@ -11,6 +23,127 @@ To avoid loading the models each time, we store them in a global variable.
 """
 COMFY_MODELS = None
 
+"""
+With FACE_ENHANCE_LAZY=1, importing this module does not touch ComfyUI and every model
+is loaded on first use. STARTUP_TIMINGS records how long each startup phase took.
+"""
+LAZY_STARTUP = os.environ.get("FACE_ENHANCE_LAZY", "0") == "1"
+
+"""
+With FACE_ENHANCE_PARALLEL_LOAD=1, load_models() overlaps the loaders on a thread pool of
+FACE_ENHANCE_LOAD_WORKERS threads, with at most FACE_ENHANCE_LOAD_RAM_GB of files in flight.
+"""
+PARALLEL_LOAD = os.environ.get("FACE_ENHANCE_PARALLEL_LOAD", "0") == "1"
+LOAD_WORKERS = int(os.environ.get("FACE_ENHANCE_LOAD_WORKERS", 4))
+LOAD_RAM_GB = float(os.environ["FACE_ENHANCE_LOAD_RAM_GB"]) if "FACE_ENHANCE_LOAD_RAM_GB" in os.environ else None
+COMFYUI_READY = False
+STARTUP_TIMINGS = {}
+
+"""
+With FACE_ENHANCE_SHARED_WEIGHTS=mmap (or shm), safetensors weights are memory-mapped so
+every worker process on a host shares one copy of the pages; see shared_weights.py.
+"""
+SHARED_WEIGHTS = os.environ.get("FACE_ENHANCE_SHARED_WEIGHTS")
+
+"""
+Scores outputs by face-embedding distance to the reference with the InsightFace model
+loaded for PuLID; created on first use by get_face_scorer().
+"""
+FACE_SCORER = None
+
+"""
+Held by every run_workflow() call, so runs on the shared models never overlap: a cancelled
+stream finishes its current sampling step before main(), main_batch(), main_best_of() or
+the next stream start sampling. Reentrant, since main_stream() holds it around main().
+"""
+PIPELINE_LOCK = threading.RLock()
+
+"""
+PuLID identity embeddings keyed by the reference face, so a reused reference skips
+InsightFace and EVA-CLIP. Set FACE_ENHANCE_ID_CACHE_DIR to also keep them on disk.
+"""
+IDENTITY_CACHE = IdentityEmbeddingCache(
+    max_entries=int(os.environ.get("FACE_ENHANCE_ID_CACHE_SIZE", 64)),
+    cache_dir=os.environ.get("FACE_ENHANCE_ID_CACHE_DIR"),
+)
+
+"""
+Weight precision per component, selected with FACE_ENHANCE_PRECISION. "unet" and
+"controlnet" are storage dtypes: "default" keeps the file's own dtype (bf16 for
+flux1-dev), fp16/bf16 cast to that dtype, and fp8 variants store fp8 weights that
+ComfyUI upcasts per layer, so compute stays in fp16/bf16. "fp8_e4m3fn_fast" also uses fp8
+matmuls where the GPU supports them. "t5" picks the T5-XXL file. Roughly, fp8 halves the
+UNET and ControlNet and the fp8 T5 file halves the text encoder; see
+benchmarks/bench_precision.py for a per-profile memory report and quality check.
+"""
+PRECISION_PROFILES = {
+    "bf16": {"unet": "default", "controlnet": "default", "t5": "t5xxl_fp16.safetensors"},
+    "fp16": {"unet": "fp16", "controlnet": "fp16", "t5": "t5xxl_fp16.safetensors"},
+    "fp8_t5": {"unet": "default", "controlnet": "default", "t5": "t5xxl_fp8_e4m3fn.safetensors"},
+    "fp8": {"unet": "fp8_e4m3fn", "controlnet": "fp8_e4m3fn", "t5": "t5xxl_fp8_e4m3fn.safetensors"},
+    "fp8_fast": {"unet": "fp8_e4m3fn_fast", "controlnet": "fp8_e4m3fn", "t5": "t5xxl_fp8_e4m3fn.safetensors"},
+}
+PRECISION = os.environ.get("FACE_ENHANCE_PRECISION", "bf16")
+if PRECISION not in PRECISION_PROFILES:
+    raise ValueError(f"Unknown FACE_ENHANCE_PRECISION '{PRECISION}'. Choose one of: {', '.join(PRECISION_PROFILES)}")
+# Storage dtypes UNETLoader handles itself; the others go through comfy.sd with a dtype
+UNET_NODE_DTYPES = ("default", "fp8_e4m3fn", "fp8_e4m3fn_fast", "fp8_e5m2")
+
+"""
+With FACE_ENHANCE_DEVICE_GB set, memory_budget.plan_memory() decides which components stay
+on the GPU and which are moved in before the stages that use them and out again after
+(to host memory up to FACE_ENHANCE_HOST_GB, beyond that released and reloaded from disk).
+MEMORY_MANAGER applies the plan around each stage() and logs every transfer.
+"""
+DEVICE_GB = float(os.environ["FACE_ENHANCE_DEVICE_GB"]) if "FACE_ENHANCE_DEVICE_GB" in os.environ else None
+HOST_GB = float(os.environ["FACE_ENHANCE_HOST_GB"]) if "FACE_ENHANCE_HOST_GB" in os.environ else None
+MEMORY_MANAGER = None
+
+"""
+Text conditioning keyed by (clip model, prompt). Prompts are nearly always "" or one of
+a few strings, so once they are all cached the text encoders can be released.
+"""
+CLIP_MODEL_ID = (PRECISION_PROFILES[PRECISION]["t5"], "clip_l.safetensors")
+CONDITIONING_CACHE = LRUCache(max_entries=int(os.environ.get("FACE_ENHANCE_PROMPT_CACHE_SIZE", 32)))
+
+"""
+Latency/quality presets for the sampler, ControlNet window and PuLID start. "max" is the
+original workflow. On purpose, the presets differ only in step count, the one setting that
+trades latency for quality. Denoise, the ControlNet window and the PuLID start decide how
+much of the target and the reference survive, not how long sampling takes, so changing
+them would alter the look of the result rather than just its cost. The windows are
+fractions of the full schedule, and with denoise=0.75 sampling only begins at 0.25, so
+they stay valid at any step count. The remaining keys are kept per preset so that a tuned
+preset can override them. benchmarks/bench_presets.py measures each preset.
+"""
+PRESETS = {
+    "draft": {
+        "steps": 8,
+        "denoise": 0.75,
+        "scheduler": "beta",
+        "controlnet_start": 0.1,
+        "controlnet_end": 0.8,
+        "pulid_start_at": 0.10000000000000002,
+    },
+    "balanced": {
+        "steps": 16,
+        "denoise": 0.75,
+        "scheduler": "beta",
+        "controlnet_start": 0.1,
+        "controlnet_end": 0.8,
+        "pulid_start_at": 0.10000000000000002,
+    },
+    "max": {
+        "steps": 28,
+        "denoise": 0.75,
+        "scheduler": "beta",
+        "controlnet_start": 0.1,
+        "controlnet_end": 0.8,
+        "pulid_start_at": 0.10000000000000002,
+    },
+}
+DEFAULT_PRESET = "max"
+
 def get_value_at_index(obj: Union[Sequence, Mapping], index: int) -> Any:
     """Returns the value at the given index of a sequence or mapping.
 
@@ -88,10 +221,6 @@ def add_extra_model_paths() -> None:
         print("Could not find the extra_model_paths config file.")
 
 
-add_comfyui_directory_to_sys_path()
-add_extra_model_paths()
-
-
 def import_custom_nodes() -> None:
     """Find all custom nodes in the custom_nodes folder and add those node objects to NODE_CLASS_MAPPINGS
 
@@ -115,131 +244,929 @@ def import_custom_nodes() -> None:
     init_extra_nodes()
 
 
-from nodes import (
-    LoadImage,
-    SaveImage,
-    NODE_CLASS_MAPPINGS,
-    CLIPTextEncode,
-    VAELoader,
-    VAEEncode,
-    DualCLIPLoader,
-    VAEDecode,
-    UNETLoader,
-    ControlNetLoader,
-    ControlNetApplyAdvanced,
-)
+@contextmanager
+def startup_phase(name: str):
+    """Records the wall time of a startup phase in STARTUP_TIMINGS."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = time.perf_counter() - start
+
+
+def startup_report() -> str:
+    """Formats STARTUP_TIMINGS as a per-phase breakdown."""
+    lines = [f"{name:<36} {seconds:8.3f}s" for name, seconds in STARTUP_TIMINGS.items()]
+    lines.append(f"{'total':<36} {sum(STARTUP_TIMINGS.values()):8.3f}s")
+    return "\n".join(lines)
+
+
+def setup_comfyui() -> None:
+    """Makes ComfyUI and its custom nodes importable. Only the first call does any work."""
+    global COMFYUI_READY
+    if COMFYUI_READY:
+        return
+    with startup_phase("sys_path"):
+        add_comfyui_directory_to_sys_path()
+    with startup_phase("extra_model_paths"):
+        add_extra_model_paths()
+    if SHARED_WEIGHTS:
+        # Before the custom nodes import, so any that import load_torch_file get the mapped one
+        import shared_weights
+        shared_weights.enable(SHARED_WEIGHTS)
+    with startup_phase("custom_nodes"):
+        import_custom_nodes()  # Ensure NODE_CLASS_MAPPINGS is initialized
+    COMFYUI_READY = True
+
 
 @torch.inference_mode()
-def load_models():
+def load_dualclip():
+    from nodes import DualCLIPLoader
+
     dualcliploader = DualCLIPLoader()
-    dualcliploader_94 = dualcliploader.load_clip(
-        clip_name1="t5xxl_fp16.safetensors",
-        clip_name2="clip_l.safetensors",
+    return dualcliploader.load_clip(
+        clip_name1=CLIP_MODEL_ID[0],
+        clip_name2=CLIP_MODEL_ID[1],
         type="flux",
         device="default",
     )
 
+@torch.inference_mode()
+def load_vae():
+    from nodes import VAELoader
+
     vaeloader = VAELoader()
-    vaeloader_95 = vaeloader.load_vae(vae_name="ae.safetensors")
+    return vaeloader.load_vae(vae_name="ae.safetensors")
+
+@torch.inference_mode()
+def load_pulid_flux():
+    from nodes import NODE_CLASS_MAPPINGS
 
     pulidfluxmodelloader = NODE_CLASS_MAPPINGS["PulidFluxModelLoader"]()
-    pulidfluxmodelloader_44 = pulidfluxmodelloader.load_model(
+    return pulidfluxmodelloader.load_model(
         pulid_file="pulid_flux_v0.9.1.safetensors"
     )
 
+@torch.inference_mode()
+def load_eva_clip():
+    from nodes import NODE_CLASS_MAPPINGS
+
     pulidfluxevacliploader = NODE_CLASS_MAPPINGS["PulidFluxEvaClipLoader"]()
-    pulidfluxevacliploader_45 = pulidfluxevacliploader.load_eva_clip()
+    return pulidfluxevacliploader.load_eva_clip()
+
+@torch.inference_mode()
+def load_insightface():
+    from nodes import NODE_CLASS_MAPPINGS
 
     pulidfluxinsightfaceloader = NODE_CLASS_MAPPINGS["PulidFluxInsightFaceLoader"]()
-    pulidfluxinsightfaceloader_46 = pulidfluxinsightfaceloader.load_insightface(
+    return pulidfluxinsightfaceloader.load_insightface(
         provider="CUDA"
     )
 
+def torch_dtype(name: str):
+    """Maps a PRECISION_PROFILES storage dtype name to a torch dtype."""
+    return {
+        "fp16": torch.float16,
+        "bf16": torch.bfloat16,
+        "fp8_e4m3fn": torch.float8_e4m3fn,
+        "fp8_e4m3fn_fast": torch.float8_e4m3fn,
+        "fp8_e5m2": torch.float8_e5m2,
+    }[name]
+
+@torch.inference_mode()
+def load_controlnet():
+    from nodes import ControlNetLoader
+
+    control_net_name = "Flux_Dev_ControlNet_Union_Pro_ShakkerLabs.safetensors"
+    dtype = PRECISION_PROFILES[PRECISION]["controlnet"]
+    if dtype != "default":
+        import comfy.controlnet
+        import folder_paths
+
+        path = folder_paths.get_full_path("controlnet", control_net_name)
+        try:
+            return (comfy.controlnet.load_controlnet(path, model_options={"dtype": torch_dtype(dtype)}),)
+        except TypeError:  # ComfyUI versions before model_options
+            print(f"This ComfyUI can't load ControlNets as {dtype}; using the file's dtype.")
+
     controlnetloader = ControlNetLoader()
-    controlnetloader_49 = controlnetloader.load_controlnet(
-        control_net_name="Flux_Dev_ControlNet_Union_Pro_ShakkerLabs.safetensors"
+    return controlnetloader.load_controlnet(
+        control_net_name=control_net_name
     )
 
+@torch.inference_mode()
+def load_unet():
+    from nodes import UNETLoader
+
+    dtype = PRECISION_PROFILES[PRECISION]["unet"]
+    if dtype not in UNET_NODE_DTYPES:
+        import comfy.sd
+        import folder_paths
+
+        path = folder_paths.get_full_path("diffusion_models", "flux1-dev.safetensors")
+        return (comfy.sd.load_diffusion_model(path, model_options={"dtype": torch_dtype(dtype)}),)
+
     unetloader = UNETLoader()
-    unetloader_93 = unetloader.load_unet(
-        unet_name="flux1-dev.safetensors", weight_dtype="default"
+    return unetloader.load_unet(
+        unet_name="flux1-dev.safetensors", weight_dtype=dtype
     )
 
-    return {
-        "dualcliploader_94": dualcliploader_94,
-        "vaeloader_95": vaeloader_95,
-        "pulidfluxmodelloader_44": pulidfluxmodelloader_44,
-        "pulidfluxevacliploader_45": pulidfluxevacliploader_45,
-        "pulidfluxinsightfaceloader_46": pulidfluxinsightfaceloader_46,
-        "controlnetloader_49": controlnetloader_49,
-        "unetloader_93": unetloader_93
+"""
+One loader per model component, keyed by its name in COMFY_MODELS.
+"""
+MODEL_LOADERS = {
+    "dualcliploader_94": load_dualclip,
+    "vaeloader_95": load_vae,
+    "pulidfluxmodelloader_44": load_pulid_flux,
+    "pulidfluxevacliploader_45": load_eva_clip,
+    "pulidfluxinsightfaceloader_46": load_insightface,
+    "controlnetloader_49": load_controlnet,
+    "unetloader_93": load_unet,
+}
+
+"""
+The (ComfyUI model folder, file name) pairs each loader reads, used to size parallel loads.
+EVA-CLIP is fetched by its loader and InsightFace is small, so they are estimated.
+"""
+MODEL_FILES = {
+    "dualcliploader_94": [("text_encoders", CLIP_MODEL_ID[0]), ("text_encoders", CLIP_MODEL_ID[1])],
+    "vaeloader_95": [("vae", "ae.safetensors")],
+    "pulidfluxmodelloader_44": [("pulid", "pulid_flux_v0.9.1.safetensors")],
+    "controlnetloader_49": [("controlnet", "Flux_Dev_ControlNet_Union_Pro_ShakkerLabs.safetensors")],
+    "unetloader_93": [("diffusion_models", "flux1-dev.safetensors")],
+}
+DEFAULT_MODEL_BYTES = 1 << 30
+
+def estimate_model_bytes(name: str) -> int:
+    """Returns the on-disk size of the files a loader reads, or an estimate if they can't be found."""
+    import folder_paths
+
+    total = 0
+    for folder, filename in MODEL_FILES.get(name, []):
+        try:
+            path = folder_paths.get_full_path(folder, filename)
+        except KeyError:  # Folder not registered by this ComfyUI version
+            path = None
+        total += os.path.getsize(path) if path else DEFAULT_MODEL_BYTES
+    return total or DEFAULT_MODEL_BYTES
+
+def module_bytes(model) -> int:
+    """Bytes held by the parameters and buffers of a loaded component's torch module(s)."""
+    seen, total = set(), 0
+    # ModelPatcher.model, CLIP/VAE .patcher.model, ControlNet .control_model, VAE .first_stage_model
+    candidates = [model]
+    for attribute in ("model", "patcher", "control_model", "first_stage_model", "cond_stage_model"):
+        candidate = getattr(model, attribute, None)
+        if candidate is not None:
+            candidates.append(candidate)
+            candidates.append(getattr(candidate, "model", None))
+    for candidate in candidates:
+        if isinstance(candidate, torch.nn.Module) and id(candidate) not in seen:
+            seen.add(id(candidate))
+            for tensor in list(candidate.parameters()) + list(candidate.buffers()):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+def memory_report() -> dict:
+    """Weight bytes per loaded component under the current PRECISION profile, plus CUDA usage."""
+    components = {}
+    for name, outputs in (COMFY_MODELS or {}).items():
+        components[name] = sum(module_bytes(output) for output in outputs if output is not None)
+    report = {
+        "precision": PRECISION,
+        "profile": PRECISION_PROFILES[PRECISION],
+        "weight_bytes": components,
+        "total_weight_bytes": sum(components.values()),
     }
+    if torch.cuda.is_available():
+        report["cuda_allocated_bytes"] = torch.cuda.memory_allocated()
+        report["cuda_max_allocated_bytes"] = torch.cuda.max_memory_allocated()
+    return report
+
+def component_bytes() -> dict:
+    """Weight bytes per component: measured for loaded ones, estimated from their files otherwise."""
+    sizes = {}
+    for name in MODEL_LOADERS:
+        outputs = (COMFY_MODELS or {}).get(name)
+        measured = sum(module_bytes(output) for output in outputs if output is not None) if outputs else 0
+        sizes[name] = measured or estimate_model_bytes(name)
+    return sizes
+
+def configure_memory_budget(device_gb: float = None, host_gb: float = None, verbose: bool = True):
+    """Plans component placement for a device/host budget and installs MEMORY_MANAGER.
+
+    Returns the memory_budget.MemoryPlan; pass device_gb=None to turn staging off again.
+    """
+    global MEMORY_MANAGER
+    from memory_budget import MemoryManager, plan_memory
+
+    if device_gb is None:
+        MEMORY_MANAGER = None
+        return None
+    # Puts ComfyUI on sys.path before comfy.model_management is imported, and creates
+    # COMFY_MODELS for the manager even when called before the first request in lazy mode
+    initialize_models()
+    import comfy.model_management
+
+    plan = plan_memory(
+        component_bytes(),
+        device_budget=int(device_gb * (1 << 30)),
+        host_budget=int(host_gb * (1 << 30)) if host_gb is not None else None,
+    )
+    if verbose:
+        print(plan.describe())
+    MEMORY_MANAGER = MemoryManager(
+        plan, COMFY_MODELS, get_model,
+        device=comfy.model_management.get_torch_device(),
+        offload_device=comfy.model_management.unet_offload_device(),
+        verbose=verbose,
+    )
+    return plan
+
+@contextmanager
+def stage(name: str):
+    """profiling.stage() that also moves components in and out around it under MEMORY_MANAGER."""
+    manager = MEMORY_MANAGER
+    if manager is not None:
+        manager.before(name)
+    try:
+        with profiling.stage(name):
+            yield
+    finally:
+        # Also on errors, so the next request's plan starts from the expected placement
+        if manager is not None:
+            manager.after(name)
+
+def load_model(name: str):
+    setup_comfyui()
+    with startup_phase(f"load:{name}"):
+        return MODEL_LOADERS[name]()
+
+def load_models(parallel: bool = None, max_workers: int = None, host_memory_gb: float = None):
+    """Loads every model component, optionally overlapping the loaders.
+
+    Safetensors files are memory-mapped by ComfyUI's loaders, so parallel loading mostly
+    overlaps page-ins and host-to-device copies; host_memory_gb caps how much is in flight.
+    """
+    if parallel is None:
+        parallel = PARALLEL_LOAD
+    setup_comfyui()
+    with startup_phase("load_models"):
+        if not parallel:
+            return {name: load_model(name) for name in MODEL_LOADERS}
+
+        host_memory_gb = LOAD_RAM_GB if host_memory_gb is None else host_memory_gb
+        return load_parallel(
+            {name: (lambda name=name: load_model(name)) for name in MODEL_LOADERS},
+            sizes={name: estimate_model_bytes(name) for name in MODEL_LOADERS},
+            max_workers=max_workers or LOAD_WORKERS,
+            host_memory_limit=int(host_memory_gb * (1 << 30)) if host_memory_gb else None,
+        )
+
+def get_model(name: str):
+    """Returns a model component, loading it first if this is its first use."""
+    initialize_models()
+    if name not in COMFY_MODELS:
+        COMFY_MODELS[name] = load_model(name)
+    return COMFY_MODELS[name]
+
+WORKFLOW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflows", "FaceEnhancementProd.json")
 
-def initialize_models():
+
+def load_workflow(path: str = WORKFLOW_PATH, share_models: bool = True):
+    """Returns a workflow.WorkflowExecutor for a ComfyUI workflow JSON, running on NODE_CLASS_MAPPINGS.
+
+    With share_models=True the loader nodes that match a MODEL_LOADERS entry (by class and
+    node id, e.g. UNETLoader 93 -> "unetloader_93") are fed the models this module already
+    holds instead of loading a second copy. ApplyPulidFlux's reference embedding is
+    removed from the shared Flux model after every run (see workflow.STATEFUL_NODE_TYPES),
+    so it never leaks into main() or later runs.
+
+        executor = load_workflow()
+        executor.inject(24, (load_pixels("face.jpg"),))    # reference LoadImage
+        executor.inject(40, (load_pixels("target.png"),))  # target LoadImage
+        for seed in range(4):
+            image = executor.run(targets=[114], overrides={39: {"noise_seed": seed}})[114][0]
+    """
+    # Sets up ComfyUI first: in lazy mode `nodes` isn't importable until then
+    initialize_models()
+    from nodes import NODE_CLASS_MAPPINGS
+    from workflow import WorkflowExecutor
+
+    executor = WorkflowExecutor(path, NODE_CLASS_MAPPINGS)
+    if share_models:
+        for node_id, node in executor.nodes.items():
+            name = f"{node.class_type.lower()}_{node_id}"
+            if name in MODEL_LOADERS:
+                executor.inject(node_id, get_model(name))
+    return executor
+
+
+class SeedListNoise:
+    """Initial noise for a latent batch in which item i is sampled with seeds[i].
+
+    Each item gets exactly the noise RandomNoise(seeds[i]) gives a batch of one, so any
+    candidate from a batched run can be reproduced on its own with its seed.
+    """
+
+    def __init__(self, seeds: Sequence[int]):
+        self.seeds = list(seeds)
+        self.seed = self.seeds[0]
+
+    def generate_noise(self, input_latent):
+        import comfy.sample
+
+        samples = input_latent["samples"]
+        if samples.shape[0] != len(self.seeds):
+            raise ValueError(f"Got {len(self.seeds)} seeds for a latent batch of {samples.shape[0]}")
+        return torch.cat([
+            comfy.sample.prepare_noise(samples[i:i + 1], seed) for i, seed in enumerate(self.seeds)
+        ], dim=0)
+
+
+class CachedApplyPulidFlux:
+    """ApplyPulidFlux that reuses identity embeddings from IDENTITY_CACHE.
+
+    On a miss the real node runs and the embedding it attached to the model is stored.
+    On a hit face analysis and EVA-CLIP are skipped and the cached embedding is attached
+    directly. The first application always goes through the node, since it is what
+    installs the PuLID forward on the Flux model.
+    """
+
+    def __init__(self, cache: IdentityEmbeddingCache = None):
+        from nodes import NODE_CLASS_MAPPINGS
+
+        self.cache = cache if cache is not None else IDENTITY_CACHE
+        self.node = NODE_CLASS_MAPPINGS["ApplyPulidFlux"]()
+        self.pulid_data_dict = None
+
+    def apply_pulid_flux(self, model, pulid_flux, eva_clip, face_analysis, image, weight, start_at, end_at,
+                         fusion="mean", fusion_weight_max=1.0, fusion_weight_min=0.0, train_step=1000,
+                         use_gray=True, unique_id=None):
+        flux_model = model.model.diffusion_model
+        key = self.cache.make_key(
+            image,
+            fusion=fusion,
+            fusion_weight_max=fusion_weight_max,
+            fusion_weight_min=fusion_weight_min,
+            train_step=train_step,
+            use_gray=use_gray,
+        )
+
+        embedding = self.cache.get(key) if hasattr(flux_model, "pulid_data") else None
+        if embedding is None:
+            result = self.node.apply_pulid_flux(
+                model=model, pulid_flux=pulid_flux, eva_clip=eva_clip, face_analysis=face_analysis,
+                image=image, weight=weight, start_at=start_at, end_at=end_at, fusion=fusion,
+                fusion_weight_max=fusion_weight_max, fusion_weight_min=fusion_weight_min,
+                train_step=train_step, use_gray=use_gray, unique_id=unique_id,
+            )
+            # No entry means no face was found in the reference, which is not worth caching
+            pulid_data = getattr(flux_model, "pulid_data", {}).get(unique_id)
+            if pulid_data is not None:
+                self.cache.put(key, pulid_data["embedding"])
+            return result
+
+        import comfy.model_management
+
+        model = model.clone()
+        model_sampling = model.get_model_object("model_sampling")
+        flux_model.pulid_data[unique_id] = {
+            "weight": weight,
+            "embedding": embedding.to(comfy.model_management.get_torch_device(), dtype=flux_model.dtype),
+            "sigma_start": model_sampling.percent_to_sigma(start_at),
+            "sigma_end": model_sampling.percent_to_sigma(end_at),
+        }
+        # Like the node, drop the embedding from the shared Flux model once this application is gone
+        self.pulid_data_dict = {"data": flux_model.pulid_data, "unique_id": unique_id}
+        return (model,)
+
+    def __del__(self):
+        if self.pulid_data_dict is not None:
+            self.pulid_data_dict["data"].pop(self.pulid_data_dict["unique_id"], None)
+
+
+def initialize_models(lazy: bool = None):
+    """Sets up ComfyUI and loads every model component.
+
+    With lazy=True (the default when FACE_ENHANCE_LAZY=1) nothing is loaded here;
+    each component is loaded by get_model() the first time a request needs it.
+    """
     global COMFY_MODELS
+    if lazy is None:
+        lazy = LAZY_STARTUP
     if COMFY_MODELS is None:
-        import_custom_nodes()  # Ensure NODE_CLASS_MAPPINGS is initialized
-        COMFY_MODELS = load_models()
+        setup_comfyui()
+        if lazy:
+            COMFY_MODELS = {}
+        else:
+            COMFY_MODELS = load_models()
+        if DEVICE_GB is not None:
+            configure_memory_budget(DEVICE_GB, HOST_GB)
+        if not lazy:
+            with torch.inference_mode():
+                encode_prompt("")  # The negative prompt of every request
+
+def encode_prompt(text: str):
+    """Returns the CLIPTextEncode output for `text`, running the text encoders only on a cache miss.
+
+    If the text encoders were released by precompute_prompts(), a miss loads them again.
+    """
+    from nodes import CLIPTextEncode
+
+    key = (CLIP_MODEL_ID, text)
+    conditioning = CONDITIONING_CACHE.get(key)
+    if conditioning is None:
+        clip = get_value_at_index(get_model("dualcliploader_94"), 0)
+        with stage("clip_encode"):
+            cliptextencode = CLIPTextEncode()
+            conditioning = cliptextencode.encode(text=text, clip=clip)
+        CONDITIONING_CACHE.put(key, conditioning)
+    return conditioning
+
+def precompute_prompts(prompts: Sequence[str], release_text_encoder: bool = False):
+    """Encodes `prompts` ahead of time.
+
+    With release_text_encoder=True the T5-XXL and CLIP-L encoders are dropped afterwards,
+    which frees several GB as long as requests stick to the precomputed prompts.
+    """
+    import gc
+    import comfy.model_management
+
+    with torch.inference_mode():
+        for prompt in prompts:
+            encode_prompt(prompt)
+
+    if release_text_encoder and COMFY_MODELS.pop("dualcliploader_94", None) is not None:
+        gc.collect()
+        comfy.model_management.soft_empty_cache()
+
+if not LAZY_STARTUP:
+    initialize_models()
+
+def get_face_scorer() -> FaceScorer:
+    global FACE_SCORER
+    if FACE_SCORER is None:
+        FACE_SCORER = FaceScorer(get_value_at_index(get_model("pulidfluxinsightfaceloader_46"), 0))
+    return FACE_SCORER
+
+
+def score_faces(face_image, images, metric: str = "cosine") -> list:
+    """Face-embedding distances from the reference `face_image` to each of `images`, without ComfyUI.
+
+    `face_image` is anything load_pixels() accepts. `images` is an IMAGE tensor batch, or a
+    list of images that all have the same size. The candidates are embedded in one
+    recognition batch and compared to the cached reference embedding.
+
+    Returns:
+        list: One distance per image (lower is closer), or None where no face was found.
+    """
+    if not isinstance(images, torch.Tensor):
+        images = torch.cat([load_pixels(image) for image in images], dim=0)
+    with torch.inference_mode():
+        return get_face_scorer().score(load_pixels(face_image), images, metric)
+
+
+def load_pixels(image):
+    """Returns an IMAGE tensor for `image`.
+
+    PIL images, arrays, tensors and paths that exist on disk are converted in memory.
+    Any other string is treated as a path relative to ComfyUI/input and goes through LoadImage.
+    """
+    with stage("load_image"):
+        if isinstance(image, str) and not os.path.exists(image):
+            from nodes import LoadImage
+
+            loadimage = LoadImage()
+            return get_value_at_index(loadimage.load_image(image=image), 0)
+        return to_image_tensor(image)
 
-initialize_models()
 
 def main(
-    face_image: str,
-    input_image: str,
-    output_image: str,
+    face_image,
+    input_image,
+    output_image: str = None,
     dist_image: str = None,
     positive_prompt: str = "",
     id_weight: float = 0.75,
+    seed: int = None,
+    **options,
 ):
+    """Enhance the face in `input_image` using `face_image` as the identity reference.
+
+    Both images can be paths, PIL images, NumPy arrays or tensors (see load_pixels).
+    Extra keyword `options` such as crop_face, tile_size or max_megapixels are passed
+    to enhance_pixels().
+
+    If `dist_image` is given, the cosine face-embedding distance between the output and
+    the reference is computed and saved there as a side-by-side comparison.
+
+    Returns:
+        PIL.Image.Image: The enhanced image, which is also saved to `output_image` if given.
+    """
     global COMFY_MODELS
     if COMFY_MODELS is None:
         raise ValueError("Models must be initialized before calling main(). Call initialize_models() first.")
     with torch.inference_mode():
-        dualcliploader_94 = COMFY_MODELS["dualcliploader_94"]
-        vaeloader_95 = COMFY_MODELS["vaeloader_95"]
-        pulidfluxmodelloader_44 = COMFY_MODELS["pulidfluxmodelloader_44"]
-        pulidfluxevacliploader_45 = COMFY_MODELS["pulidfluxevacliploader_45"]
-        pulidfluxinsightfaceloader_46 = COMFY_MODELS["pulidfluxinsightfaceloader_46"]
-        controlnetloader_49 = COMFY_MODELS["controlnetloader_49"]
-        unetloader_93 = COMFY_MODELS["unetloader_93"]
-
-        cliptextencode = CLIPTextEncode()
-        cliptextencode_23 = cliptextencode.encode(
-            text="", clip=get_value_at_index(dualcliploader_94, 0)
+        face_pixels = load_pixels(face_image)
+        enhanced = enhance_pixels(
+            face_pixels=face_pixels,
+            input_pixels=load_pixels(input_image),
+            positive_prompt=positive_prompt,
+            id_weight=id_weight,
+            seed=seed,
+            **options,
         )
 
-        loadimage = LoadImage()
-        loadimage_24 = loadimage.load_image(image=face_image)
+        with stage("to_pil"):
+            result = to_pil_images(enhanced)[0]
+        if dist_image:
+            with stage("face_score"):
+                distance = get_face_scorer().score(face_pixels, enhanced)[0]
+            print(f"Face embedding distance (cosine): {distance}")
+            save_pil_image(distance_image(to_pil_images(face_pixels)[0], result, distance), dist_image)
+    if output_image:
+        save_pil_image(result, output_image)
+    return result
+
+
+def main_best_of(
+    face_image,
+    input_image,
+    output_image: str = None,
+    positive_prompt: str = "",
+    id_weight: float = 0.75,
+    num_candidates: int = 4,
+    batch_size: int = None,
+    distance_threshold: float = None,
+    seeds: Sequence[int] = None,
+    metric: str = "cosine",
+    **options,
+):
+    """Samples several seeds and keeps the candidate whose face is closest to the reference.
+
+    Candidates are sampled `batch_size` seeds at a time (default: all of them in one run,
+    or one at a time when `distance_threshold` is set, so that stopping early saves work).
+    A batch shares the VAE latent, the conditioning and the PuLID-patched model, and is
+    scored with one batched face-embedding pass (see score_faces()). With
+    `distance_threshold` set, no further batches are sampled once a candidate's distance
+    is at or below it.
+
+    Args:
+        num_candidates: Number of seeds to try when `seeds` isn't given.
+        seeds: Explicit seeds to try, in order.
+        metric: Distance metric, one of face_scoring.METRICS.
+        options: Passed to enhance_pixels(), as in main().
+
+    Returns:
+        dict: "image" (the best PIL image, also saved to `output_image` if given), its
+        "seed" and "distance", and "candidates", a list of {"seed", "distance"} for every
+        candidate sampled. Distances are None where no face was found.
+    """
+    global COMFY_MODELS
+    if seeds is not None and not len(seeds):
+        raise ValueError("seeds must contain at least one seed")
+    if seeds is None and num_candidates < 1:
+        raise ValueError(f"num_candidates must be at least 1, got {num_candidates}")
+    if batch_size is not None and batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+    if COMFY_MODELS is None:
+        raise ValueError("Models must be initialized before calling main(). Call initialize_models() first.")
+    seeds = list(seeds) if seeds is not None else [random.randint(1, 2**64) for _ in range(num_candidates)]
+    batch_size = batch_size or (1 if distance_threshold is not None else len(seeds))
+
+    best = None
+    candidates = []
+    with torch.inference_mode():
+        face_pixels = load_pixels(face_image)
+        input_pixels = load_pixels(input_image)
+        for start in range(0, len(seeds), batch_size):
+            batch_seeds = seeds[start:start + batch_size]
+            enhanced = enhance_pixels(
+                face_pixels=face_pixels,
+                input_pixels=input_pixels,
+                positive_prompt=positive_prompt,
+                id_weight=id_weight,
+                seed=batch_seeds,
+                **options,
+            )
+            with stage("face_score"):
+                distances = get_face_scorer().score(face_pixels, enhanced, metric)
+            for index, (seed, distance) in enumerate(zip(batch_seeds, distances)):
+                candidates.append({"seed": seed, "distance": distance})
+                rank = float("inf") if distance is None else distance
+                if best is None or rank < best[0]:
+                    best = (rank, seed, distance, enhanced[index:index + 1])
+            if distance_threshold is not None and best[0] <= distance_threshold:
+                break
+
+        _, seed, distance, pixels = best
+        result = to_pil_images(pixels)[0]
+    if output_image:
+        save_pil_image(result, output_image)
+    return {"image": result, "seed": seed, "distance": distance, "candidates": candidates}
+
+
+def main_stream(
+    face_image,
+    input_image,
+    output_image: str = None,
+    dist_image: str = None,
+    positive_prompt: str = "",
+    id_weight: float = 0.75,
+    seed: int = None,
+    preview_every: int = 4,
+    cancel_event: threading.Event = None,
+    **options,
+):
+    """Like main(), but yields low-resolution previews while the sampler runs.
+
+    Every `preview_every` steps the current denoised latent is projected to RGB with
+    latent_to_image(), which costs a few milliseconds instead of a VAE decode. The
+    pipeline runs on a worker thread and this generator yields dicts:
+
+        {"type": "preview", "step": 4, "total_steps": 28, "image": PIL.Image}
+        {"type": "result", "image": PIL.Image}
+
+    The previews are latent-sized (1/8 of the sampled resolution) and show whatever is being
+    sampled, i.e. the face crop with crop_face=True or the current tile when tiling.
+
+    Setting `cancel_event`, or closing the generator, stops the run at the next sampling
+    step and nothing more is yielded. Every run_workflow() call holds PIPELINE_LOCK, so a
+    cancelled run releases the models before any other run, streamed or not, starts.
+    """
+    global COMFY_MODELS
+    if COMFY_MODELS is None:
+        raise ValueError("Models must be initialized before calling main(). Call initialize_models() first.")
+    cancel_event = cancel_event or threading.Event()
+    latent_format = get_value_at_index(get_model("unetloader_93"), 0).model.latent_format
+    events = queue.Queue()
+
+    def on_step(step, x0, x, total_steps):
+        if cancel_event.is_set():
+            raise EnhancementCancelled()
+        done = step + 1
+        if preview_every and done % preview_every == 0 and done < total_steps:
+            events.put(("preview", done, total_steps, latent_to_image(x0, latent_format)))
+
+    def work():
+        try:
+            with PIPELINE_LOCK:
+                if cancel_event.is_set():
+                    raise EnhancementCancelled()
+                result = main(face_image, input_image, output_image, dist_image, positive_prompt, id_weight, seed,
+                              step_callback=on_step, **options)
+            events.put(("result", result))
+        except EnhancementCancelled:
+            events.put(("cancelled",))
+        except Exception as e:
+            events.put(("error", e))
+
+    # Run in a copy of the caller's context so its telemetry trace also covers the worker's stages
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(work,), name="face-enhance-stream",
+                              daemon=True)
+    worker.start()
+    try:
+        while True:
+            event = events.get()
+            if event[0] == "preview":
+                _, step, total_steps, preview = event
+                yield {"type": "preview", "step": step, "total_steps": total_steps,
+                       "image": to_pil_images(preview)[0]}
+            elif event[0] == "result":
+                yield {"type": "result", "image": event[1]}
+                return
+            elif event[0] == "cancelled":
+                return
+            else:
+                raise event[1]
+    finally:
+        # Reached on completion, on errors and when the consumer closes the generator early
+        cancel_event.set()
+
+
+def main_batch(
+    pairs: Sequence[Sequence[str]],
+    positive_prompt: str = "",
+    id_weight: float = 0.75,
+    seed: int = None,
+    max_batch_size: int = 4,
+    **options,
+):
+    """Enhance many (face_image, input_image, output_image) triples.
+
+    Targets that share a reference face and a resolution are stacked into one
+    latent batch, so VAE encode, ControlNet, sampling and VAE decode run once per
+    batch instead of once per image. PuLID fuses every image it is given into a
+    single identity, so different references can never share a batch.
+
+    Args:
+        pairs: Triples of (face_image, input_image, output_image), with images given
+            in any form main() accepts. output_image may be None to skip saving.
+        max_batch_size: Upper bound on the number of targets sampled together.
+        options: Passed to enhance_pixels(), as in main().
+
+    Returns:
+        list: The enhanced PIL images, in the order of `pairs`.
+    """
+    global COMFY_MODELS
+    if COMFY_MODELS is None:
+        raise ValueError("Models must be initialized before calling main(). Call initialize_models() first.")
+    with torch.inference_mode():
+        # Group targets by (reference, height, width); insertion order keeps the output stable.
+        # In-memory references are grouped by identity, since arrays and tensors aren't hashable.
+        groups = {}
+        references = {}
+        for index, (face_image, input_image, output_image) in enumerate(pairs):
+            face_key = face_image if isinstance(face_image, str) else id(face_image)
+            references[face_key] = face_image
+            pixels = load_pixels(input_image)
+            key = (face_key, pixels.shape[1], pixels.shape[2])
+            groups.setdefault(key, []).append((index, pixels, output_image))
+
+        results = [None] * sum(len(items) for items in groups.values())
+        face_pixels = {}
+        for (face_key, _, _), items in groups.items():
+            if face_key not in face_pixels:
+                face_pixels[face_key] = load_pixels(references[face_key])
+
+            for start in range(0, len(items), max_batch_size):
+                chunk = items[start:start + max_batch_size]
+                enhanced = enhance_pixels(
+                    face_pixels=face_pixels[face_key],
+                    input_pixels=torch.cat([pixels for _, pixels, _ in chunk], dim=0),
+                    positive_prompt=positive_prompt,
+                    id_weight=id_weight,
+                    seed=seed,
+                    **options,
+                )
+                with stage("to_pil"):
+                    images = to_pil_images(enhanced)
+                for (index, _, output_image), image in zip(chunk, images):
+                    results[index] = image
+                    if output_image:
+                        save_pil_image(image, output_image)
+
+    return results
+
+
+def enhance_pixels(face_pixels, input_pixels, positive_prompt="", id_weight=0.75, seed=None,
+                   crop_face=False, crop_size=1024, crop_padding=0.6, feather=0.1,
+                   tile_size=None, tile_overlap=128, max_megapixels=None, min_megapixels=None,
+                   preset=DEFAULT_PRESET, step_callback=None):
+    """Enhances a batch of targets and returns the enhanced IMAGE tensor.
+
+    `preset` names an entry in PRESETS and trades sampling steps for latency.
+    `step_callback`, if given, is called after every sampling step of every sampler run
+    (see run_workflow()). `seed` may be a list of seeds; see run_workflow().
+
+    Full-frame targets are first normalized: snapped to a multiple of the Flux latent
+    stride (16 px) and scaled to fit between `min_megapixels` and `max_megapixels`.
+    Enhancement runs at that size and the result is resized back to the original
+    dimensions, so the megapixel budget bounds per-request latency and memory.
+
+    With crop_face=True the largest face in each target is found with the InsightFace model
+    already loaded for PuLID. Only a square crop around it, with `crop_padding` face-sizes of
+    context, is enhanced at `crop_size` x `crop_size` and blended back with a feathered mask.
+    Sampling cost and memory then depend on `crop_size` instead of the input resolution.
+    If any target has no detectable face, the whole batch is enhanced at full frame.
+
+    With `tile_size` set, a full-frame target larger than one tile is enhanced in
+    overlapping tiles (VAE encode, ControlNet tile conditioning, sampling and decode per
+    tile) that are blended across `tile_overlap` pixels, so peak memory stays bounded
+    by the tile size. The identity embedding and text conditioning are cached, so only
+    the first tile pays for them.
+    """
+    import face_crop
+    import tiling
+    from image_utils import normalize_resolution, resize_image
 
-        loadimage_40 = loadimage.load_image(image=input_image)
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown preset '{preset}'. Choose one of: {', '.join(PRESETS)}")
+    if tile_size and tile_overlap >= tile_size:
+        raise ValueError(f"tile_overlap ({tile_overlap}) must be smaller than tile_size ({tile_size})")
 
+    if crop_face:
+        face_analysis = get_value_at_index(get_model("pulidfluxinsightfaceloader_46"), 0)
+        height, width = input_pixels.shape[1], input_pixels.shape[2]
+        boxes = []
+        for image in input_pixels:
+            with stage("face_detect"):
+                face_box = face_crop.detect_face_box(face_analysis, image)
+            if face_box is None:
+                print("No face found in the target image; enhancing the full image instead.")
+                crop_face = False
+                break
+            boxes.append(face_crop.square_crop_box(face_box, width, height, crop_padding))
+
+    if not crop_face:
+        def enhance_tile(tile):
+            return get_value_at_index(
+                run_workflow(face_pixels, tile, positive_prompt, id_weight, seed, preset, step_callback), 0
+            )
+
+        height, width = input_pixels.shape[1], input_pixels.shape[2]
+        with stage("resize"):
+            normalized = normalize_resolution(input_pixels, max_megapixels=max_megapixels, min_megapixels=min_megapixels)
+        if tile_size and max(normalized.shape[1], normalized.shape[2]) > tile_size:
+            enhanced = tiling.tiled_apply(normalized, enhance_tile, tile_size, tile_overlap)
+        else:
+            enhanced = enhance_tile(normalized)
+        with stage("resize"):
+            return resize_image(enhanced, height, width)
+
+    crops = torch.cat([
+        face_crop.crop_image(input_pixels[i:i + 1], box, crop_size) for i, box in enumerate(boxes)
+    ], dim=0)
+    vaedecode_114 = run_workflow(face_pixels, crops, positive_prompt, id_weight, seed, preset, step_callback)
+    enhanced_crops = get_value_at_index(vaedecode_114, 0)
+    # A single target sampled with a list of seeds comes back as one crop per seed
+    with stage("paste_back"):
+        return torch.cat([
+            face_crop.paste_back(input_pixels[i % len(boxes):i % len(boxes) + 1], enhanced_crops[i:i + 1],
+                                 boxes[i % len(boxes)], feather)
+            for i in range(enhanced_crops.shape[0])
+        ], dim=0)
+
+
+def _serialized(function):
+    """Runs `function` holding PIPELINE_LOCK."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with PIPELINE_LOCK:
+            return function(*args, **kwargs)
+    return wrapper
+
+
+@_serialized
+def run_workflow(face_pixels, input_pixels, positive_prompt="", id_weight=0.75, seed=None, preset=DEFAULT_PRESET,
+                 step_callback=None):
+    """Run the enhancement workflow on already loaded images.
+
+    Args:
+        face_pixels: Reference face IMAGE tensor of shape [batch_size, height, width, channels].
+        input_pixels: Target IMAGE tensor of shape [batch_size, height, width, channels]. Every
+            target in the batch is enhanced in the same sampler run.
+        seed: A seed, None for a random one, or a list of seeds. With a list and a single
+            target, one candidate per seed is sampled in the same run from the same VAE
+            latent, conditioning and PuLID-patched model; with a batch of targets, the list
+            gives one seed per target.
+        preset: Name of the entry in PRESETS that sets the steps and schedule.
+        step_callback: Optional callable(step, x0, x, total_steps) run after every sampling
+            step with the current denoised latent `x0`. Raising from it aborts the run.
+
+    Returns:
+        tuple: The VAEDecode output, holding one decoded image per target.
+    """
+    from nodes import NODE_CLASS_MAPPINGS, VAEEncode, VAEDecode, ControlNetApplyAdvanced
+
+    vaeloader_95 = get_model("vaeloader_95")
+    pulidfluxmodelloader_44 = get_model("pulidfluxmodelloader_44")
+    pulidfluxevacliploader_45 = get_model("pulidfluxevacliploader_45")
+    pulidfluxinsightfaceloader_46 = get_model("pulidfluxinsightfaceloader_46")
+    controlnetloader_49 = get_model("controlnetloader_49")
+    unetloader_93 = get_model("unetloader_93")
+
+    if seed is None:
+        seed = random.randint(1, 2**64)
+    candidates = len(seed) if isinstance(seed, (list, tuple)) else 1
+    settings = PRESETS[preset]
+
+    cliptextencode_23 = encode_prompt("")
+
+    with stage("vae_encode"):
         vaeencode = VAEEncode()
         vaeencode_35 = vaeencode.encode(
-            pixels=get_value_at_index(loadimage_40, 0),
+            pixels=input_pixels,
             vae=get_value_at_index(vaeloader_95, 0),
         )
 
+    if candidates > 1:
+        randomnoise_39 = (SeedListNoise(seed),)
+        if input_pixels.shape[0] == 1:
+            # Encode once and sample every seed from the same latent
+            vaeencode_35 = ({"samples": get_value_at_index(vaeencode_35, 0)["samples"].repeat(candidates, 1, 1, 1)},)
+    else:
         randomnoise = NODE_CLASS_MAPPINGS["RandomNoise"]()
-        randomnoise_39 = randomnoise.get_noise(noise_seed=random.randint(1, 2**64))
+        randomnoise_39 = randomnoise.get_noise(noise_seed=seed[0] if isinstance(seed, (list, tuple)) else seed)
 
-        cliptextencode_42 = cliptextencode.encode(
-            text=positive_prompt, clip=get_value_at_index(dualcliploader_94, 0)
-        )
+    cliptextencode_42 = encode_prompt(positive_prompt)
 
-        ksamplerselect = NODE_CLASS_MAPPINGS["KSamplerSelect"]()
-        ksamplerselect_50 = ksamplerselect.get_sampler(sampler_name="euler")
+    ksamplerselect = NODE_CLASS_MAPPINGS["KSamplerSelect"]()
+    ksamplerselect_50 = ksamplerselect.get_sampler(sampler_name="euler")
 
-        applypulidflux = NODE_CLASS_MAPPINGS["ApplyPulidFlux"]()
-        setunioncontrolnettype = NODE_CLASS_MAPPINGS["SetUnionControlNetType"]()
-        controlnetapplyadvanced = ControlNetApplyAdvanced()
-        basicguider = NODE_CLASS_MAPPINGS["BasicGuider"]()
-        basicscheduler = NODE_CLASS_MAPPINGS["BasicScheduler"]()
-        samplercustomadvanced = NODE_CLASS_MAPPINGS["SamplerCustomAdvanced"]()
-        vaedecode = VAEDecode()
+    applypulidflux = CachedApplyPulidFlux()
+    setunioncontrolnettype = NODE_CLASS_MAPPINGS["SetUnionControlNetType"]()
+    controlnetapplyadvanced = ControlNetApplyAdvanced()
+    basicguider = NODE_CLASS_MAPPINGS["BasicGuider"]()
+    basicscheduler = NODE_CLASS_MAPPINGS["BasicScheduler"]()
+    samplercustomadvanced = NODE_CLASS_MAPPINGS["SamplerCustomAdvanced"]()
+    vaedecode = VAEDecode()
 
+    with stage("apply_pulid"):
         applypulidflux_133 = applypulidflux.apply_pulid_flux(
             weight=id_weight,
-            start_at=0.10000000000000002,
+            start_at=settings["pulid_start_at"],
             end_at=1,
             fusion="mean",
             fusion_weight_max=1,
@@ -250,73 +1177,95 @@ def main(
             pulid_flux=get_value_at_index(pulidfluxmodelloader_44, 0),
             eva_clip=get_value_at_index(pulidfluxevacliploader_45, 0),
             face_analysis=get_value_at_index(pulidfluxinsightfaceloader_46, 0),
-            image=get_value_at_index(loadimage_24, 0),
+            image=face_pixels,
             unique_id=1674270197144619516,
         )
 
+    with stage("controlnet_apply"):
         setunioncontrolnettype_41 = setunioncontrolnettype.set_controlnet_type(
             type="tile", control_net=get_value_at_index(controlnetloader_49, 0)
         )
 
+        # The ControlNet hint is the whole target batch, matched item-for-item to the latent batch
         controlnetapplyadvanced_37 = controlnetapplyadvanced.apply_controlnet(
             strength=1,
-            start_percent=0.1,
-            end_percent=0.8,
+            start_percent=settings["controlnet_start"],
+            end_percent=settings["controlnet_end"],
             positive=get_value_at_index(cliptextencode_42, 0),
             negative=get_value_at_index(cliptextencode_23, 0),
             control_net=get_value_at_index(setunioncontrolnettype_41, 0),
-            image=get_value_at_index(loadimage_40, 0),
+            image=input_pixels,
             vae=get_value_at_index(vaeloader_95, 0),
         )
 
+    with stage("sampling"):
         basicguider_122 = basicguider.get_guider(
             model=get_value_at_index(applypulidflux_133, 0),
             conditioning=get_value_at_index(controlnetapplyadvanced_37, 0),
         )
 
         basicscheduler_131 = basicscheduler.get_sigmas(
-            scheduler="beta",
-            steps=28,
-            denoise=0.75,
+            scheduler=settings["scheduler"],
+            steps=settings["steps"],
+            denoise=settings["denoise"],
             model=get_value_at_index(applypulidflux_133, 0),
         )
 
+        guider = get_value_at_index(basicguider_122, 0)
+        if step_callback is not None:
+            guider = CallbackGuider(guider, step_callback)
+
         samplercustomadvanced_1 = samplercustomadvanced.sample(
             noise=get_value_at_index(randomnoise_39, 0),
-            guider=get_value_at_index(basicguider_122, 0),
+            guider=guider,
             sampler=get_value_at_index(ksamplerselect_50, 0),
             sigmas=get_value_at_index(basicscheduler_131, 0),
             latent_image=get_value_at_index(vaeencode_35, 0),
         )
 
+    with stage("vae_decode"):
         vaedecode_114 = vaedecode.decode(
             samples=get_value_at_index(samplercustomadvanced_1, 0),
             vae=get_value_at_index(vaeloader_95, 0),
         )
+    return vaedecode_114
 
-        save_comfy_images(get_value_at_index(vaedecode_114, 0), [output_image])
+
+def save_pil_image(image, output_path):
+    # Create the output directory if it doesn't exist
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    with stage("save"):
+        image.save(output_path)
 
 
 def save_comfy_images(images, output_dirs):
     # images is a PyTorch tensor with shape [batch_size, height, width, channels]
-    import numpy as np
-    from PIL import Image
-    
-    for idx, image in enumerate(images):
-        # Create the output directory if it doesn't exist
-        output_dir = os.path.dirname(output_dirs[idx])
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-            
-        numpy_image = 255. * image.cpu().numpy()
-        numpy_image = np.clip(numpy_image, 0, 255).astype(np.uint8)
-        pil_image = Image.fromarray(numpy_image)
-        pil_image.save(output_dirs[idx])
+    for idx, pil_image in enumerate(to_pil_images(images)):
+        save_pil_image(pil_image, output_dirs[idx])
+
+@spaces.GPU
+def face_enhance(face_image, input_image, output_image: str = None, dist_image: str = None, positive_prompt: str = "", id_weight: float = 0.75, seed: int = None, **options):
+    initialize_models()  # Ensure models are loaded
+    return main(face_image, input_image, output_image, dist_image, positive_prompt, id_weight, seed, **options)
+
+@spaces.GPU
+def face_enhance_best_of(face_image, input_image, output_image: str = None, positive_prompt: str = "", id_weight: float = 0.75, num_candidates: int = 4, distance_threshold: float = None, **options):
+    initialize_models()  # Ensure models are loaded
+    return main_best_of(face_image, input_image, output_image, positive_prompt, id_weight,
+                        num_candidates=num_candidates, distance_threshold=distance_threshold, **options)
+
+@spaces.GPU
+def face_enhance_stream(face_image, input_image, output_image: str = None, dist_image: str = None, positive_prompt: str = "", id_weight: float = 0.75, seed: int = None, preview_every: int = 4, cancel_event=None, **options):
+    initialize_models()  # Ensure models are loaded
+    yield from main_stream(face_image, input_image, output_image, dist_image, positive_prompt, id_weight, seed,
+                           preview_every=preview_every, cancel_event=cancel_event, **options)
 
 @spaces.GPU
-def face_enhance(face_image: str, input_image: str, output_image: str, dist_image: str = None, positive_prompt: str = "", id_weight: float = 0.75):
+def face_enhance_batch(pairs, positive_prompt: str = "", id_weight: float = 0.75, max_batch_size: int = 4, **options):
     initialize_models()  # Ensure models are loaded
-    main(face_image, input_image, output_image, dist_image, positive_prompt, id_weight)
+    return main_batch(pairs, positive_prompt=positive_prompt, id_weight=id_weight, max_batch_size=max_batch_size, **options)
 
 if __name__ == "__main__":
     pass
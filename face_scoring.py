@@ -0,0 +1,120 @@
+import numpy as np
+import torch
+
+from caches import LRUCache, tensor_hash
+
+METRICS = ("cosine", "L2", "L2_norm")
+# antelopev2's recognition model (glintr100) produces 512-d embeddings
+EMBEDDING_DIM = 512
+
+
+def to_bgr_uint8(image: torch.Tensor) -> np.ndarray:
+    """Converts one IMAGE tensor of shape [height, width, channels] to the uint8 BGR array InsightFace expects."""
+    numpy_image = np.clip(255. * image.cpu().numpy(), 0, 255).astype(np.uint8)[..., ::-1]
+    return np.ascontiguousarray(numpy_image)
+
+
+def pairwise_distances(reference: np.ndarray, embeddings: np.ndarray, metric: str = "cosine") -> np.ndarray:
+    """Distances from one embedding [dim] to a batch of embeddings [N, dim].
+
+    The metrics match the FaceEmbedDistance node used by workflows/FaceDistanceProd.json:
+    "cosine" is 1 - cosine similarity, "L2" the Euclidean distance between the raw embeddings
+    and "L2_norm" the Euclidean distance between the L2-normalized ones. Rows that are NaN
+    (no face found) stay NaN.
+    """
+    if metric == "cosine":
+        reference = reference / np.linalg.norm(reference)
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return 1.0 - embeddings @ reference
+    if metric == "L2":
+        return np.linalg.norm(embeddings - reference, axis=1)
+    if metric == "L2_norm":
+        reference = reference / np.linalg.norm(reference)
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return np.linalg.norm(embeddings - reference, axis=1)
+    raise ValueError(f"Unknown metric '{metric}'. Choose one of: {', '.join(METRICS)}")
+
+
+class FaceScorer:
+    """Face-embedding distances computed with the InsightFace model loaded for PuLID.
+
+    Faces are detected one image at a time, but the aligned 112x112 crops of a whole batch go
+    through the recognition model in a single forward pass. Reference embeddings are cached
+    by pixel hash, so scoring many outputs against one reference embeds it once.
+    """
+
+    def __init__(self, face_analysis, max_references: int = 64):
+        self.face_analysis = face_analysis
+        self.references = LRUCache(max_entries=max_references)
+
+    def align_largest_face(self, image: torch.Tensor):
+        """Returns the aligned 112x112 BGR crop of the largest face in `image` [H, W, C], or None."""
+        from insightface.utils import face_align
+
+        bgr = to_bgr_uint8(image)
+        bboxes, kpss = self.face_analysis.det_model.detect(bgr, max_num=0, metric="default")
+        if bboxes is None or len(bboxes) == 0 or kpss is None:
+            return None
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        return face_align.norm_crop(bgr, landmark=kpss[int(np.argmax(areas))])
+
+    def embed(self, images: torch.Tensor) -> np.ndarray:
+        """Embeds the largest face of every image in an IMAGE batch [N, H, W, C].
+
+        Returns:
+            np.ndarray: [N, dim] raw embeddings, with NaN rows where no face was found.
+        """
+        recognition = self.face_analysis.models["recognition"]
+        crops = [self.align_largest_face(image) for image in images]
+        found = [i for i, crop in enumerate(crops) if crop is not None]
+        embeddings = np.full((len(crops), EMBEDDING_DIM), np.nan, dtype=np.float32)
+        if found:
+            embeddings[found] = recognition.get_feat([crops[i] for i in found])
+        return embeddings
+
+    def reference_embedding(self, face_pixels: torch.Tensor):
+        """Embedding of the first reference image, or None if it has no detectable face."""
+        key = tensor_hash(face_pixels[:1])
+        embedding = self.references.get(key)
+        if embedding is None:
+            embedding = self.embed(face_pixels[:1])[0]
+            if np.isnan(embedding).any():
+                return None
+            self.references.put(key, embedding)
+        return embedding
+
+    def score(self, face_pixels: torch.Tensor, images: torch.Tensor, metric: str = "cosine") -> list:
+        """Distances from the reference face to the face in each image.
+
+        Returns:
+            list: One float per image, or None where either image has no detectable face.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}'. Choose one of: {', '.join(METRICS)}")
+        reference = self.reference_embedding(face_pixels)
+        if reference is None:
+            return [None] * len(images)
+        distances = pairwise_distances(reference, self.embed(images), metric)
+        return [None if np.isnan(distance) else float(distance) for distance in distances]
+
+
+def distance_image(reference, output, distance, metric: str = "cosine"):
+    """Renders the reference and the output side by side with the distance written underneath.
+
+    Args:
+        reference: Reference face PIL image.
+        output: Enhanced PIL image.
+        distance: The score from FaceScorer.score(), or None if no face was found.
+    """
+    from PIL import Image, ImageDraw
+
+    height = output.height
+    reference = reference.convert("RGB")
+    reference = reference.resize((max(1, round(reference.width * height / reference.height)), height))
+    label_height = max(24, height // 20)
+    canvas = Image.new("RGB", (reference.width + output.width, height + label_height), "white")
+    canvas.paste(reference, (0, 0))
+    canvas.paste(output.convert("RGB"), (reference.width, 0))
+    label = f"{metric} distance: {distance:.4f}" if distance is not None else "no face detected"
+    ImageDraw.Draw(canvas).text((8, height + label_height // 4), label, fill="black")
+    return canvas
@@ -0,0 +1,106 @@
+import os
+import warnings
+
+import numpy as np
+import torch
+from PIL import Image, ImageOps
+
+
+def to_image_tensor(image) -> torch.Tensor:
+    """Converts an image to a ComfyUI IMAGE tensor of shape [batch_size, height, width, 3] in [0, 1].
+
+    Accepts a file path, a PIL image, a uint8 or float NumPy array ([height, width],
+    [height, width, channels] or batched), or a tensor in the same layouts. uint8 data is
+    wrapped without copying and converted to float32 in one pass; float32 arrays are not
+    copied at all.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        with Image.open(image) as img:
+            return to_image_tensor(ImageOps.exif_transpose(img))
+
+    if isinstance(image, Image.Image):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image = np.asarray(image)
+
+    if isinstance(image, np.ndarray):
+        with warnings.catch_warnings():
+            # Arrays backed by PIL's buffer are read-only; they are only read before the float conversion
+            warnings.simplefilter("ignore", UserWarning)
+            image = torch.from_numpy(image)
+
+    if not isinstance(image, torch.Tensor):
+        raise TypeError(f"Unsupported image type: {type(image).__name__}")
+
+    if image.ndim == 2:
+        image = image[..., None]
+    if image.ndim == 3:
+        image = image[None,]
+    if image.ndim != 4:
+        raise ValueError(f"Expected an image of shape [height, width, channels], got {tuple(image.shape)}")
+
+    channels = image.shape[-1]
+    if channels == 1:
+        image = image.expand(-1, -1, -1, 3)
+    elif channels == 4:
+        image = image[..., :3]
+    elif channels != 3:
+        raise ValueError(f"Expected 1, 3 or 4 channels, got {channels}")
+
+    if image.dtype == torch.uint8:
+        return image.to(torch.float32).div_(255.0)
+    return image.to(torch.float32).contiguous()
+
+
+def to_pil_images(images) -> list:
+    """Converts an IMAGE tensor of shape [batch_size, height, width, channels] to a list of PIL images."""
+    pil_images = []
+    for image in images:
+        numpy_image = 255. * image.cpu().numpy()
+        numpy_image = np.clip(numpy_image, 0, 255).astype(np.uint8)
+        pil_images.append(Image.fromarray(numpy_image))
+    return pil_images
+
+
+def resize_image(pixels: torch.Tensor, height: int, width: int) -> torch.Tensor:
+    """Resizes an IMAGE tensor of shape [batch_size, height, width, channels] with antialiased bicubic filtering."""
+    if pixels.shape[1] == height and pixels.shape[2] == width:
+        return pixels
+    resized = torch.nn.functional.interpolate(
+        pixels.movedim(-1, 1), size=(height, width), mode="bicubic", antialias=True
+    )
+    return resized.movedim(1, -1).clamp(0, 1)
+
+
+def normalized_size(height: int, width: int, multiple: int = 16, max_megapixels: float = None,
+                    min_megapixels: float = None):
+    """Returns the (height, width) to process an image at.
+
+    The aspect ratio is kept, the area is scaled into [min_megapixels, max_megapixels] when
+    those are given, and both sides are rounded to a multiple of `multiple`.
+    """
+    scale = 1.0
+    megapixels = height * width / 1e6
+    if max_megapixels and megapixels > max_megapixels:
+        scale = (max_megapixels / megapixels) ** 0.5
+    elif min_megapixels and megapixels < min_megapixels:
+        scale = (min_megapixels / megapixels) ** 0.5
+
+    def snap(length):
+        return max(multiple, int(round(length * scale / multiple)) * multiple)
+
+    new_height, new_width = snap(height), snap(width)
+    # Rounding can push the area just past the budget; step down until it fits
+    while max_megapixels and new_height * new_width / 1e6 > max_megapixels and min(new_height, new_width) > multiple:
+        if new_height >= new_width:
+            new_height -= multiple
+        else:
+            new_width -= multiple
+    return new_height, new_width
+
+
+def normalize_resolution(pixels: torch.Tensor, multiple: int = 16, max_megapixels: float = None,
+                         min_megapixels: float = None) -> torch.Tensor:
+    """Resizes an IMAGE tensor to normalized_size(); returns it unchanged if it already fits."""
+    height, width = normalized_size(pixels.shape[1], pixels.shape[2], multiple, max_megapixels, min_megapixels)
+    return resize_image(pixels, height, width)
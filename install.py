@@ -58,9 +58,8 @@ def install_comfyui():
     )
 
 
-def download_huggingface_models(cache_models=True):
-    """Download required models from Hugging Face."""
-    from huggingface_hub import hf_hub_download
+def huggingface_models():
+    """The Hugging Face files the pipeline needs, with the name each is saved under in ComfyUI/models."""
     hf_models = [
         {"repo_id": "black-forest-labs/FLUX.1-dev", "filename": "flux1-dev.safetensors", "folder": "unet"},
         {"repo_id": "black-forest-labs/FLUX.1-dev", "filename": "ae.safetensors", "folder": "vae"},
@@ -71,19 +70,32 @@ def download_huggingface_models(cache_models=True):
          "folder": "text_encoders"},
         {"repo_id": "comfyanonymous/flux_text_encoders", "filename": "clip_l.safetensors", "folder": "text_encoders"},
     ]
+    if os.environ.get("FACE_ENHANCE_PRECISION", "bf16").startswith("fp8"):
+        # The fp8 precision profiles read the fp8 T5-XXL instead (see PRECISION_PROFILES in face_enhance.py)
+        hf_models.append({"repo_id": "comfyanonymous/flux_text_encoders", "filename": "t5xxl_fp8_e4m3fn.safetensors",
+                          "folder": "text_encoders"})
 
     # More specific filenames
     filename_mappings = {
         "Shakker-Labs/FLUX.1-dev-ControlNet-Union-Pro": "Flux_Dev_ControlNet_Union_Pro_ShakkerLabs.safetensors",
     }
+    for model in hf_models:
+        # Use mapping if it exists, otherwise use original filename
+        model["target"] = filename_mappings.get(model["repo_id"], os.path.basename(model["filename"]))
+    return hf_models
+
+
+def download_huggingface_models(cache_models=True):
+    """Download required models from Hugging Face."""
+    from huggingface_hub import hf_hub_download
+    hf_models = huggingface_models()
 
     for model in hf_models:
         try:
             target_dir = os.path.join(COMFYUI_PATH, "models", model["folder"])
             os.makedirs(target_dir, exist_ok=True)
 
-            # Use mapping if it exists, otherwise use original filename
-            file_name_only = filename_mappings.get(model["repo_id"], os.path.basename(model["filename"]))
+            file_name_only = model["target"]
             target_path = os.path.join(target_dir, file_name_only)
 
             if os.path.exists(target_path):
@@ -175,6 +187,314 @@ def download_and_extract_antelopev2():
         print("✅ AntelopeV2 model already exists")
 
 
+"""
+Manifest installer: fetches every model file concurrently, resumes partial downloads,
+verifies each file's size and sha256 and extracts archives straight into place. Sizes and
+hashes come from a manifest JSON when given; otherwise they are taken from the source
+(Hugging Face reports both for LFS files) and can be saved with --write-manifest so later
+installs are checked against them.
+"""
+CHUNK_SIZE = 8 << 20
+
+
+def model_artifacts():
+    """Manifest entries for every model file, without sizes or hashes.
+
+    "path" is relative to ComfyUI/models. "extract" marks a zip whose members under
+    "strip" are extracted into "path" as a directory.
+    """
+    artifacts = [
+        {"name": model["target"], "repo_id": model["repo_id"], "filename": model["filename"],
+         "path": os.path.join(model["folder"], model["target"])}
+        for model in huggingface_models()
+    ]
+    artifacts.append({"name": "antelopev2.zip", "repo_id": "MonsterMMORPG/tools", "filename": "antelopev2.zip",
+                      "path": os.path.join("insightface", "models", "antelopev2"), "extract": {"strip": "antelopev2/"}})
+    return artifacts
+
+
+def load_manifest(path):
+    """Reads a manifest written by write_manifest(), keyed by artifact name."""
+    import json
+
+    with open(path) as f:
+        return {artifact["name"]: artifact for artifact in json.load(f)["artifacts"]}
+
+
+def write_manifest(path, artifacts):
+    import json
+
+    with open(path, "w") as f:
+        json.dump({"artifacts": artifacts}, f, indent=2)
+
+
+class LocalSource:
+    """Reads artifacts from a directory laid out like Hugging Face: <root>/<repo_id>/<filename>."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, artifact):
+        return os.path.join(self.root, artifact["repo_id"], artifact["filename"])
+
+    def describe(self, artifact):
+        """Returns (size, sha256) as far as the source knows them."""
+        return os.path.getsize(self._path(artifact)), None
+
+    def open(self, artifact, offset=0):
+        """Returns (stream, offset) for reading the artifact from `offset`; offset 0 if it can't resume."""
+        stream = open(self._path(artifact), "rb")
+        stream.seek(offset)
+        return stream, offset
+
+
+class HTTPSource:
+    """Downloads artifacts from <base_url>/<repo_id>/<filename>, resuming with HTTP Range requests."""
+
+    def __init__(self, base_url, token=None):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+
+    def url(self, artifact):
+        from urllib.parse import quote
+
+        return f"{self.base_url}/{artifact['repo_id']}/{quote(artifact['filename'])}"
+
+    def _request(self, url, method="GET", headers=None):
+        import urllib.request
+
+        class DropAuthOnRedirect(urllib.request.HTTPRedirectHandler):
+            # Hugging Face redirects to a CDN, which must not receive the token
+            def redirect_request(self, req, fp, code, msg, hdrs, newurl):
+                new = super().redirect_request(req, fp, code, msg, hdrs, newurl)
+                if new is not None and urllib.parse.urlsplit(newurl).netloc != urllib.parse.urlsplit(req.full_url).netloc:
+                    new.remove_header("Authorization")
+                return new
+
+        request = urllib.request.Request(url, method=method, headers=dict(headers or {}))
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        return urllib.request.build_opener(DropAuthOnRedirect).open(request, timeout=60)
+
+    def describe(self, artifact):
+        with self._request(self.url(artifact), method="HEAD") as response:
+            size = response.headers.get("Content-Length")
+            return (int(size) if size else None), None
+
+    def open(self, artifact, offset=0):
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = self._request(self.url(artifact), headers=headers)
+        # 206 means the server honoured the range; a plain 200 sends the whole file again
+        return response, offset if response.status == 206 else 0
+
+
+class HuggingFaceSource(HTTPSource):
+    """Downloads from the Hugging Face Hub (HF_ENDPOINT, default https://huggingface.co)."""
+
+    def __init__(self, token=None, revision="main"):
+        super().__init__(os.environ.get("HF_ENDPOINT", "https://huggingface.co"), token or os.getenv('HUGGINGFACE_TOKEN'))
+        self.revision = revision
+
+    def url(self, artifact):
+        from urllib.parse import quote
+
+        return f"{self.base_url}/{artifact['repo_id']}/resolve/{self.revision}/{quote(artifact['filename'])}"
+
+    def describe(self, artifact):
+        import urllib.request
+
+        # Ask for the resolve URL without following the CDN redirect: for LFS files its
+        # headers carry the real size and the sha256 of the content (X-Linked-Etag)
+        class NoRedirect(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kwargs):
+                return None
+
+        request = urllib.request.Request(self.url(artifact), method="HEAD")
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            response = urllib.request.build_opener(NoRedirect).open(request, timeout=60)
+        except urllib.error.HTTPError as e:
+            if e.code not in (301, 302, 303, 307, 308):
+                raise
+            response = e
+        headers = response.headers
+        size = headers.get("X-Linked-Size") or headers.get("Content-Length")
+        etag = (headers.get("X-Linked-Etag") or headers.get("ETag") or "").strip('"').removeprefix("W/").strip('"')
+        sha256 = etag if len(etag) == 64 and all(c in "0123456789abcdef" for c in etag) else None
+        return (int(size) if size else None), sha256
+
+
+def make_source(spec):
+    """Source from a --source value: "hf", a local directory, or an http(s):// base URL."""
+    if spec in (None, "hf", "huggingface"):
+        return HuggingFaceSource()
+    if spec.startswith(("http://", "https://")):
+        return HTTPSource(spec)
+    return LocalSource(spec)
+
+
+def file_sha256(path, length=None):
+    """sha256 of the first `length` bytes of a file (all of it by default), as a hashlib object."""
+    import hashlib
+
+    digest = hashlib.sha256()
+    remaining = length
+    if remaining == 0:
+        return digest
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest
+
+
+def download_artifact(artifact, source, path):
+    """Downloads `artifact` to `path`, resuming from `path`.partial, and checks size and sha256.
+
+    The file only appears at `path` once it is complete and verified. A mismatch deletes
+    the partial file, so the next attempt starts over.
+    """
+    partial = path + ".partial"
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    expected_size, expected_sha256 = artifact.get("size"), artifact.get("sha256")
+    if expected_size is not None and offset > expected_size:
+        offset = 0
+
+    if expected_size is not None and offset == expected_size:
+        # A previous run wrote every byte but stopped before the rename; a Range request
+        # starting at the end would get 416, so go straight to verification
+        digest = file_sha256(partial)
+    else:
+        stream, offset = source.open(artifact, offset)
+        # Resuming means hashing what is already on disk first
+        digest = file_sha256(partial, offset)
+        with stream, open(partial, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                digest.update(chunk)
+
+    size = os.path.getsize(partial)
+    problem = None
+    if expected_size is not None and size != expected_size:
+        problem = f"size {size} != {expected_size}"
+    elif expected_sha256 and digest.hexdigest() != expected_sha256:
+        problem = f"sha256 {digest.hexdigest()} != {expected_sha256}"
+    if problem:
+        os.remove(partial)
+        raise ValueError(problem)
+    os.replace(partial, path)
+    return size, digest.hexdigest()
+
+
+def extract_zip(zip_path, target_dir, strip=""):
+    """Extracts the members of `zip_path` under `strip` into `target_dir`, which appears in one rename."""
+    import shutil
+    import zipfile
+
+    staging = target_dir + ".partial"
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    root = os.path.realpath(staging)
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in archive.infolist():
+            name = member.filename
+            if member.is_dir() or not name.startswith(strip) or name == strip:
+                continue
+            destination = os.path.realpath(os.path.join(staging, name[len(strip):]))
+            if not destination.startswith(root + os.sep):
+                raise ValueError(f"Refusing to extract {name} outside {target_dir}")
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with archive.open(member) as source, open(destination, "wb") as f:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+    if os.path.exists(target_dir):
+        shutil.rmtree(target_dir)
+    os.replace(staging, target_dir)
+
+
+def install_artifact(artifact, source, models_dir, verify_existing=False):
+    """Installs one artifact unless it is already in place. Returns the artifact with its size and sha256."""
+    path = os.path.join(models_dir, artifact["path"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if artifact.get("size") is None or artifact.get("sha256") is None:
+        size, sha256 = source.describe(artifact)
+        artifact = dict(artifact, size=artifact.get("size") or size, sha256=artifact.get("sha256") or sha256)
+
+    if artifact.get("extract"):
+        if os.path.isdir(path) and os.listdir(path):
+            print(f"✅ Already exists: {artifact['name']}")
+            return artifact
+        archive = path + ".download"
+        size, sha256 = download_artifact(artifact, source, archive)
+        extract_zip(archive, path, artifact["extract"].get("strip", ""))
+        os.remove(archive)
+        print(f"✅ Installed: {artifact['name']} -> {path}")
+        return dict(artifact, size=size, sha256=sha256)
+
+    if os.path.exists(path):
+        size = os.path.getsize(path)
+        if artifact.get("size") is not None and size != artifact["size"]:
+            print(f"⚠️ {artifact['name']} is {size} bytes, expected {artifact['size']}. Downloading again.")
+            os.remove(path)
+        elif verify_existing and artifact.get("sha256") and file_sha256(path).hexdigest() != artifact["sha256"]:
+            print(f"⚠️ {artifact['name']} fails its sha256 check. Downloading again.")
+            os.remove(path)
+        else:
+            print(f"✅ Already exists: {artifact['name']}")
+            return artifact
+
+    size, sha256 = download_artifact(artifact, source, path)
+    checked = "sha256 verified" if artifact.get("sha256") else "no sha256 to check against"
+    print(f"✅ Downloaded: {artifact['name']} ({size / (1 << 30):.2f} GB, {checked})")
+    return dict(artifact, size=size, sha256=sha256)
+
+
+def install_models(source=None, max_workers=4, manifest_path=None, write_manifest_path=None, verify_existing=False):
+    """Installs every model artifact on a pool of `max_workers` threads.
+
+    Args:
+        source: "hf" (default), a local directory or an http(s):// base URL; see make_source().
+        manifest_path: JSON with the expected "size" and "sha256" of each artifact.
+        write_manifest_path: Where to save the sizes and hashes of what was installed.
+        verify_existing: Also hash files that are already in place.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    source = make_source(source) if source is None or isinstance(source, str) else source
+    models_dir = os.path.join(COMFYUI_PATH, "models")
+    pinned = load_manifest(manifest_path) if manifest_path else {}
+    artifacts = [dict(artifact, **pinned.get(artifact["name"], {})) for artifact in model_artifacts()]
+
+    installed, failed = {}, []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="install") as executor:
+        futures = {executor.submit(install_artifact, artifact, source, models_dir, verify_existing): artifact
+                   for artifact in artifacts}
+        for future in as_completed(futures):
+            artifact = futures[future]
+            try:
+                installed[artifact["name"]] = future.result()
+            except Exception as e:
+                failed.append(artifact["name"])
+                print(f"❌ Failed to install {artifact['name']}: {e}")
+
+    if write_manifest_path:
+        write_manifest(write_manifest_path, [installed[artifact["name"]] for artifact in artifacts
+                                             if artifact["name"] in installed])
+    if failed:
+        print(f"❌ {len(failed)} model(s) failed: {', '.join(failed)}. Run again to resume.")
+    return not failed
+
+
 def install_custom_nodes():
     """Install all custom nodes for ComfyUI."""
 
@@ -216,19 +536,46 @@ def install_hfdemo_dependencies():
     run_cmd("python -m pip install -r requirements.txt")
 
 
-def install(is_hf_space=False, cache_models=True):
+def install(is_hf_space=False, cache_models=True, manifest_install=False, **install_models_options):
+    """Sets everything up. With manifest_install=True the models go through install_models()."""
     install_lfs_files()
     install_comfyui()
     install_custom_nodes()
     if is_hf_space:
         print("🔄 Installing HF spaces dependencies...")
         install_hfdemo_dependencies()
-    download_huggingface_models(cache_models)
-    download_and_extract_antelopev2()
+    if manifest_install:
+        if not install_models(**install_models_options):
+            exit(1)
+    else:
+        download_huggingface_models(cache_models)
+        download_and_extract_antelopev2()
     print("🎉 Setup Complete!")
     
     print("\n📂 Listing installed models:")
     run_cmd("ls -Rh ./ComfyUI/models/")
 
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Install ComfyUI, the custom nodes and the models')
+    parser.add_argument('--models-only', action='store_true', help='Only install the models, with the manifest installer')
+    parser.add_argument('--manifest-install', action='store_true',
+                        help='Install the models concurrently with resume and size/sha256 checks')
+    parser.add_argument('--source', type=str, default='hf',
+                        help='Where models come from: hf, a local directory or an http(s):// base URL')
+    parser.add_argument('--jobs', type=int, default=4, help='Models downloaded at once')
+    parser.add_argument('--manifest', type=str, help='JSON manifest with the expected size and sha256 per model')
+    parser.add_argument('--write-manifest', type=str, help='Save the sizes and hashes of the installed models here')
+    parser.add_argument('--verify-existing', action='store_true', help='Also hash models that are already installed')
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    install()
+    args = parse_args()
+    options = dict(source=args.source, max_workers=args.jobs, manifest_path=args.manifest,
+                   write_manifest_path=args.write_manifest, verify_existing=args.verify_existing)
+    if args.models_only:
+        exit(0 if install_models(**options) else 1)
+    install(manifest_install=args.manifest_install, **options)
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HostMemoryBudget:
+    """Bounds the bytes of model files being read into host memory at the same time.
+
+    A load that is larger than the whole budget is still allowed, but only on its own.
+    """
+
+    def __init__(self, limit_bytes: int = None):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes: int) -> None:
+        with self._condition:
+            if self.limit_bytes is not None:
+                self._condition.wait_for(
+                    lambda: self.in_use == 0 or self.in_use + nbytes <= self.limit_bytes
+                )
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+
+    def release(self, nbytes: int) -> None:
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+
+def load_parallel(loaders: dict, sizes: dict = None, max_workers: int = 4, host_memory_limit: int = None) -> dict:
+    """Runs independent model loaders on a thread pool.
+
+    Reading safetensors releases the GIL, so loaders overlap on disk and memory
+    bandwidth. Loaders start largest first, which keeps the slowest one from being
+    scheduled last, and `host_memory_limit` caps the total size of files in flight.
+
+    Args:
+        loaders (dict): Component name -> zero-argument loader function.
+        sizes (dict, optional): Component name -> estimated bytes read by its loader.
+        max_workers (int): Number of loader threads.
+        host_memory_limit (int, optional): Bytes allowed in flight at once. Unbounded if None.
+
+    Returns:
+        dict: Component name -> loaded value, in the order of `loaders`.
+
+    Raises:
+        Exception: The first exception raised by any loader, once all loaders have finished.
+    """
+    sizes = sizes or {}
+    budget = HostMemoryBudget(host_memory_limit)
+
+    def run(name):
+        nbytes = sizes.get(name, 0)
+        budget.acquire(nbytes)
+        try:
+            return loaders[name]()
+        finally:
+            budget.release(nbytes)
+
+    order = sorted(loaders, key=lambda name: sizes.get(name, 0), reverse=True)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-loader") as executor:
+        futures = {name: executor.submit(run, name) for name in order}
+    return {name: futures[name].result() for name in loaders}
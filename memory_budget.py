@@ -0,0 +1,372 @@
+"""Plans which model components stay on the device and which are staged in around their stages.
+
+    python memory_budget.py --device-gb 24 --host-gb 48            # dry run with the default sizes
+    python memory_budget.py --device-gb 16 --sizes sizes.json      # sizes in bytes per component
+
+plan_memory() is pure Python, so plans can be checked on CPU. MemoryManager applies a plan
+at runtime and logs every transfer with its size and duration.
+"""
+import argparse
+import gc
+import itertools
+import json
+import time
+
+import profiling
+
+GB = 1 << 30
+
+"""
+Approximate weight sizes of the default (bf16) profile, used by the dry run when no
+measured sizes are given. face_enhance passes real sizes when it builds a plan.
+"""
+DEFAULT_COMPONENT_BYTES = {
+    "dualcliploader_94": int(10.0 * GB),
+    "vaeloader_95": int(0.33 * GB),
+    "pulidfluxmodelloader_44": int(1.1 * GB),
+    "pulidfluxevacliploader_45": int(0.9 * GB),
+    "pulidfluxinsightfaceloader_46": int(0.4 * GB),
+    "controlnetloader_49": int(6.6 * GB),
+    "unetloader_93": int(23.8 * GB),
+}
+# Components the fp8 profiles store at half the size
+FP8_COMPONENTS = ("dualcliploader_94", "controlnetloader_49", "unetloader_93")
+
+"""
+The pipeline stages (profiling.stage names) in the order a request runs them, and the
+stages each component is used in. InsightFace runs on onnxruntime and can't be moved.
+"""
+STAGE_ORDER = ["clip_encode", "face_detect", "vae_encode", "apply_pulid", "controlnet_apply", "sampling",
+               "vae_decode", "face_score"]
+COMPONENT_STAGES = {
+    "dualcliploader_94": ["clip_encode"],
+    "vaeloader_95": ["vae_encode", "sampling", "vae_decode"],
+    "pulidfluxmodelloader_44": ["apply_pulid", "sampling"],
+    "pulidfluxevacliploader_45": ["apply_pulid"],
+    "pulidfluxinsightfaceloader_46": ["face_detect", "apply_pulid", "face_score"],
+    "controlnetloader_49": ["sampling"],
+    "unetloader_93": ["sampling"],
+}
+PINNED_COMPONENTS = {"pulidfluxinsightfaceloader_46"}
+
+
+class MemoryPlan:
+    """Where each component lives and the transfers to make around each stage.
+
+    Attributes:
+        resident: Components kept on the device for the life of the process.
+        host: Components parked in host memory between their stages.
+        disk: Components released between their stages and loaded again from disk.
+        steps: Transfers in request order, each {"stage", "when" ("before"/"after"),
+            "action" ("load"/"offload"/"reload"/"drop"), "component", "bytes", "est_seconds"}.
+    """
+
+    def __init__(self, resident, host, disk, steps, peak_device_bytes, device_budget, host_budget):
+        self.resident = resident
+        self.host = host
+        self.disk = disk
+        self.steps = steps
+        self.peak_device_bytes = peak_device_bytes
+        self.device_budget = device_budget
+        self.host_budget = host_budget
+
+    def steps_for(self, stage: str, when: str) -> list:
+        return [step for step in self.steps if step["stage"] == stage and step["when"] == when]
+
+    @property
+    def transfer_bytes(self) -> int:
+        return sum(step["bytes"] for step in self.steps if step["action"] in ("load", "reload"))
+
+    @property
+    def transfer_seconds(self) -> float:
+        return sum(step["est_seconds"] for step in self.steps)
+
+    def to_dict(self) -> dict:
+        return {
+            "resident": self.resident,
+            "host": self.host,
+            "disk": self.disk,
+            "peak_device_bytes": self.peak_device_bytes,
+            "device_budget": self.device_budget,
+            "host_budget": self.host_budget,
+            "transfer_bytes_per_request": self.transfer_bytes,
+            "est_transfer_seconds_per_request": round(self.transfer_seconds, 3),
+            "steps": self.steps,
+        }
+
+    def describe(self) -> str:
+        lines = [
+            f"Device budget {self.device_budget / GB:.1f} GB, peak {self.peak_device_bytes / GB:.1f} GB",
+            f"Resident: {', '.join(self.resident) or '-'}",
+            f"Staged via host: {', '.join(self.host) or '-'}",
+            f"Staged via disk: {', '.join(self.disk) or '-'}",
+        ]
+        for step in self.steps:
+            lines.append(f"  {step['when']:>6} {step['stage']:<16} {step['action']:<7} {step['component']:<30} "
+                         f"{step['bytes'] / GB:6.2f} GB  ~{step['est_seconds']:.2f}s")
+        lines.append(f"Per request: {self.transfer_bytes / GB:.1f} GB moved, ~{self.transfer_seconds:.1f}s")
+        return "\n".join(lines)
+
+
+def _uses(component_stages, component, stage_order):
+    """Number of separate runs of consecutive stages a component is used in, i.e. how often it is staged in."""
+    used = [stage in component_stages[component] for stage in stage_order]
+    return sum(1 for i, flag in enumerate(used) if flag and (i == 0 or not used[i - 1]))
+
+
+def plan_memory(component_bytes: dict, device_budget: int, host_budget: int = None,
+                component_stages: dict = None, stage_order=None, pinned=None,
+                host_to_device_gbps: float = 12.0, disk_gbps: float = 2.0) -> MemoryPlan:
+    """Decides which components stay on the device and how the rest are staged.
+
+    Every stage needs all of its components on the device at once. The rest are moved in
+    before the stages that use them and out again after: to host memory while it stays
+    under `host_budget`, otherwise released and reloaded from disk. Of the resident sets
+    that keep every stage within `device_budget`, the one with the least estimated
+    transfer time per request is kept.
+
+    Args:
+        component_bytes: Component name -> weight bytes.
+        device_budget: Bytes of device memory the weights may use.
+        host_budget: Bytes of host memory for parked components (None: unlimited).
+        pinned: Components that can't be moved and are always resident.
+        host_to_device_gbps, disk_gbps: Bandwidths used to estimate transfer time.
+
+    Raises:
+        ValueError: If some stage's components can't fit on the device together.
+    """
+    component_stages = component_stages or COMPONENT_STAGES
+    stage_order = stage_order or STAGE_ORDER
+    pinned = set(PINNED_COMPONENTS if pinned is None else pinned) & set(component_bytes)
+    components = [name for name in component_bytes if name in component_stages]
+
+    def stage_bytes(stage, names):
+        return sum(component_bytes[name] for name in names if stage in component_stages[name])
+
+    resident = [name for name in components if name in pinned]
+    pinned_bytes = sum(component_bytes[name] for name in resident)
+    for stage in stage_order:
+        needed = stage_bytes(stage, components) + pinned_bytes - stage_bytes(stage, resident)
+        if needed > device_budget:
+            raise ValueError(f"Stage '{stage}' needs {needed / GB:.1f} GB on the device at once, "
+                             f"more than the {device_budget / GB:.1f} GB budget")
+
+    def fits(names):
+        staged = [name for name in components if name not in names]
+        resident_bytes = sum(component_bytes[name] for name in names)
+        return all(resident_bytes + stage_bytes(stage, staged) <= device_budget for stage in stage_order)
+
+    def tiers(staged):
+        """Splits staged components into host and disk tiers; the most often moved get host memory."""
+        host, disk, host_used = [], [], 0
+        for name in sorted(staged, key=lambda name: uses[name] * component_bytes[name], reverse=True):
+            if host_budget is None or host_used + component_bytes[name] <= host_budget:
+                host.append(name)
+                host_used += component_bytes[name]
+            else:
+                disk.append(name)
+        return host, disk
+
+    def seconds(host, disk):
+        # A host-tier use is a copy in and a copy out; a disk-tier use is a read and a free
+        return (sum(uses[name] * component_bytes[name] * 2 / (host_to_device_gbps * GB) for name in host)
+                + sum(uses[name] * component_bytes[name] / (disk_gbps * GB) for name in disk))
+
+    # A handful of components, so every resident set is tried and the one with the least
+    # estimated transfer time per request wins
+    candidates = [name for name in components if name not in pinned]
+    uses = {name: _uses(component_stages, name, stage_order) for name in candidates}
+    best, best_seconds = None, None
+    for count in range(len(candidates) + 1):
+        for subset in itertools.combinations(candidates, count):
+            if not fits(resident + list(subset)):
+                continue
+            cost = seconds(*tiers([name for name in candidates if name not in subset]))
+            if best_seconds is None or cost < best_seconds:
+                best, best_seconds = list(subset), cost
+    resident += best
+    staged = [name for name in candidates if name not in resident]
+    host, disk = tiers(staged)
+
+    steps = []
+    on_device = set(resident)
+    peak = sum(component_bytes[name] for name in resident)
+    for index, stage in enumerate(stage_order):
+        next_stage = stage_order[(index + 1) % len(stage_order)]
+        for name in staged:
+            if stage in component_stages[name] and name not in on_device:
+                from_disk = name in disk
+                nbytes = component_bytes[name]
+                steps.append({"stage": stage, "when": "before", "action": "reload" if from_disk else "load",
+                              "component": name, "bytes": nbytes,
+                              "est_seconds": round(nbytes / GB / (disk_gbps if from_disk else host_to_device_gbps), 3)})
+                on_device.add(name)
+        peak = max(peak, sum(component_bytes[name] for name in on_device))
+        for name in staged:
+            if name in on_device and next_stage not in component_stages[name]:
+                from_disk = name in disk
+                nbytes = component_bytes[name]
+                steps.append({"stage": stage, "when": "after", "action": "drop" if from_disk else "offload",
+                              "component": name, "bytes": nbytes,
+                              "est_seconds": 0.0 if from_disk else round(nbytes / GB / host_to_device_gbps, 3)})
+                on_device.discard(name)
+
+    return MemoryPlan(resident, host, disk, steps, peak, device_budget, host_budget)
+
+
+def _patcher(output):
+    patcher = getattr(output, "patcher", None) or getattr(output, "control_model_wrapped", None)
+    if patcher is None and hasattr(output, "model") and hasattr(output, "load_device"):
+        patcher = output
+    return patcher
+
+
+def unload_patcher(patcher) -> bool:
+    """Unloads `patcher` and every clone of it from comfy.model_management. Returns False if none was loaded.
+
+    Sampling runs on clones (CachedApplyPulidFlux patches a model.clone()), so the loaded
+    entry is usually a clone sharing the original's weights rather than the patcher itself.
+    """
+    import comfy.model_management as model_management
+
+    unloaded = False
+    for loaded in list(model_management.current_loaded_models):
+        model = loaded.model
+        if model is not None and (model is patcher or model.is_clone(patcher)):
+            loaded.model_unload()
+            model_management.current_loaded_models.remove(loaded)
+            unloaded = True
+    return unloaded
+
+
+def move_component(outputs, device) -> bool:
+    """Moves a loaded component (a loader's output tuple) to `device`. Returns False if nothing moved.
+
+    ComfyUI-managed models (anything with a ModelPatcher) go through comfy.model_management
+    so its bookkeeping stays right; plain torch modules are moved with .to().
+    """
+    import torch
+
+    moved = False
+    for output in outputs:
+        patcher = _patcher(output)
+        if patcher is not None:
+            import comfy.model_management as model_management
+
+            if torch.device(device) == patcher.load_device:
+                model_management.load_models_gpu([patcher])
+                moved = True
+            else:
+                moved = unload_patcher(patcher) or moved
+        elif isinstance(output, torch.nn.Module):
+            output.to(device)
+            moved = True
+    return moved
+
+
+def release_component(outputs) -> None:
+    """Unloads a component's ComfyUI-managed models so dropping the last reference frees their memory."""
+    for output in outputs:
+        patcher = _patcher(output)
+        if patcher is not None:
+            unload_patcher(patcher)
+
+
+class MemoryManager:
+    """Applies a MemoryPlan around pipeline stages and logs every transfer.
+
+    Args:
+        plan: The MemoryPlan to follow.
+        models: The dict holding loaded components (face_enhance.COMFY_MODELS).
+        load: Callable(name) that returns a component, loading it if it was dropped.
+        device, offload_device: Where staged components are moved in and out.
+    """
+
+    def __init__(self, plan: MemoryPlan, models: dict, load, device, offload_device="cpu", verbose: bool = True):
+        self.plan = plan
+        self.models = models
+        self.load = load
+        self.device = device
+        self.offload_device = offload_device
+        self.verbose = verbose
+        self.transfers = []
+
+    def _log(self, step, seconds, applied=True):
+        record = {"stage": step["stage"], "action": step["action"], "component": step["component"],
+                  "bytes": step["bytes"], "seconds": round(seconds, 4), "applied": applied}
+        if seconds > 0:
+            record["gbps"] = round(step["bytes"] / GB / seconds, 2)
+        self.transfers.append(record)
+        if self.verbose:
+            print(f"[memory] {step['action']} {step['component']} ({step['bytes'] / GB:.2f} GB) "
+                  f"around {step['stage']} in {seconds:.3f}s" + ("" if applied else " (skipped)"))
+
+    def _apply(self, step):
+        import torch
+
+        name = step["component"]
+        start = time.perf_counter()
+        applied = True
+        with profiling.stage(f"memory:{step['action']}"):
+            if step["action"] in ("load", "reload"):
+                applied = move_component(self.load(name), self.device)
+            elif step["action"] == "offload":
+                applied = name in self.models and move_component(self.models[name], self.offload_device)
+            elif step["action"] == "drop":
+                outputs = self.models.pop(name, None)
+                applied = outputs is not None
+                if applied:
+                    # comfy.model_management still references loaded weights until they are unloaded
+                    release_component(outputs)
+                    del outputs
+                    gc.collect()
+                    if torch.cuda.is_available():
+                        torch.cuda.empty_cache()
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+        self._log(step, time.perf_counter() - start, applied)
+
+    def before(self, stage: str) -> None:
+        for step in self.plan.steps_for(stage, "before"):
+            self._apply(step)
+
+    def after(self, stage: str) -> None:
+        for step in self.plan.steps_for(stage, "after"):
+            self._apply(step)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Dry-run the model memory planner')
+    parser.add_argument('--device-gb', type=float, required=True, help='Device memory budget for weights')
+    parser.add_argument('--host-gb', type=float, default=None, help='Host memory for parked components (default: unlimited)')
+    parser.add_argument('--sizes', type=str, help='JSON file of component name -> bytes (default: bf16 estimates)')
+    parser.add_argument('--fp8', action='store_true', help='Halve the default T5, ControlNet and UNET sizes')
+    parser.add_argument('--pcie-gbps', type=float, default=12.0, help='Host-to-device bandwidth in GB/s')
+    parser.add_argument('--disk-gbps', type=float, default=2.0, help='Disk read bandwidth in GB/s')
+    parser.add_argument('--json', action='store_true', help='Print the plan as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sizes = dict(DEFAULT_COMPONENT_BYTES)
+    if args.fp8:
+        sizes.update({name: sizes[name] // 2 for name in FP8_COMPONENTS})
+    if args.sizes:
+        with open(args.sizes) as f:
+            sizes = {name: int(nbytes) for name, nbytes in json.load(f).items()}
+    try:
+        plan = plan_memory(
+            sizes,
+            device_budget=int(args.device_gb * GB),
+            host_budget=int(args.host_gb * GB) if args.host_gb is not None else None,
+            host_to_device_gbps=args.pcie_gbps,
+            disk_gbps=args.disk_gbps,
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(json.dumps(plan.to_dict(), indent=2) if args.json else plan.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import torch
+
+
+class EnhancementCancelled(Exception):
+    """Raised from the sampler callback to stop a run that is no longer wanted."""
+
+
+class CallbackGuider:
+    """Wraps a ComfyUI guider so every sampling step also reaches `step_callback`.
+
+    SamplerCustomAdvanced passes its own (preview) callback to guider.sample(); this
+    chains ours after it and forwards everything else to the wrapped guider.
+    """
+
+    def __init__(self, guider, step_callback):
+        self.guider = guider
+        self.step_callback = step_callback
+
+    def __getattr__(self, name):
+        return getattr(self.guider, name)
+
+    def sample(self, *args, callback=None, **kwargs):
+        def chained(step, x0, x, total_steps):
+            if callback is not None:
+                callback(step, x0, x, total_steps)
+            self.step_callback(step, x0, x, total_steps)
+
+        return self.guider.sample(*args, callback=chained, **kwargs)
+
+
+def latent_to_image(x0: torch.Tensor, latent_format) -> torch.Tensor:
+    """Cheap latent-to-RGB approximation of a denoised latent, instead of a VAE decode.
+
+    Projects the latent channels to RGB with the model's latent_rgb_factors, the same
+    approximation ComfyUI uses for its sampler previews. Returns an IMAGE tensor of shape
+    [batch_size, latent_height, latent_width, 3] on the CPU.
+    """
+    factors = torch.tensor(latent_format.latent_rgb_factors, device=x0.device, dtype=x0.dtype)
+    rgb = torch.einsum("bchw,cr->bhwr", x0, factors)
+    bias = getattr(latent_format, "latent_rgb_factors_bias", None)
+    if bias is not None:
+        rgb = rgb + torch.tensor(bias, device=x0.device, dtype=x0.dtype)
+    return ((rgb + 1.0) / 2.0).clamp(0, 1).float().cpu()
@@ -0,0 +1,82 @@
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+_listeners = []
+
+
+class StageRecorder:
+    """Collects the wall time of every stage() entered on this thread while it is active."""
+
+    def __init__(self, synchronize: bool = False):
+        self.synchronize = synchronize
+        self.timings = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.timings.setdefault(name, []).append(seconds)
+
+    def totals(self) -> dict:
+        """Total seconds per stage, in the order the stages were first entered."""
+        return {name: sum(seconds) for name, seconds in self.timings.items()}
+
+
+def _active_recorders():
+    return getattr(_local, "recorders", None)
+
+
+def _cuda_synchronize():
+    import torch
+
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+@contextmanager
+def record(synchronize: bool = False):
+    """Records the stages run on this thread inside the block and yields the StageRecorder.
+
+    With synchronize=True CUDA is synchronized around every stage, so asynchronous kernels
+    are charged to the stage that launched them instead of the next one that waits.
+    """
+    recorder = StageRecorder(synchronize)
+    if _active_recorders() is None:
+        _local.recorders = []
+    _local.recorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        _local.recorders.remove(recorder)
+
+
+def add_listener(listener) -> None:
+    """Calls listener(name, seconds) after every stage on any thread."""
+    _listeners.append(listener)
+
+
+def remove_listener(listener) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+@contextmanager
+def stage(name: str):
+    """Times the block as pipeline stage `name`. Costs one attribute lookup when nothing is recording."""
+    recorders = _active_recorders()
+    if not recorders and not _listeners:
+        yield
+        return
+    synchronize = any(recorder.synchronize for recorder in recorders or ())
+    if synchronize:
+        _cuda_synchronize()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if synchronize:
+            _cuda_synchronize()
+        seconds = time.perf_counter() - start
+        for recorder in recorders or ():
+            recorder.add(name, seconds)
+        for listener in list(_listeners):
+            listener(name, seconds)
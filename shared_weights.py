@@ -0,0 +1,238 @@
+"""Shares safetensors weights between processes on one host by memory-mapping them read-only.
+
+By default every face_enhance process reads its own copy of the Flux UNET, T5-XXL,
+ControlNet and PuLID weights into private memory, so host RAM grows with the worker count.
+With enable(), ComfyUI's load_torch_file() maps .safetensors files instead of reading
+them. Modules then take the mapped tensors as their weights wherever the dtype and device
+already match, so every process maps the same page-cache pages. The mapping is
+copy-on-write, so a process that modifies a weight in place gets a private copy of just
+that page and never touches the file.
+
+Mode "mmap" maps the model files where they are. Mode "shm" first copies each file into
+/dev/shm (once per host; later processes reuse the copy), which keeps the pages resident
+when the page cache is under pressure, at the cost of the copy's RAM.
+
+    python shared_weights.py --pids 1234 1235     # unique vs shared resident memory per process
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+
+SHM_DIR = os.path.join("/dev/shm", "face_enhance")
+MODES = ("mmap", "shm")
+
+_maps = {}  # path -> (mmap, start address, length)
+_maps_lock = threading.Lock()
+_original_load_torch_file = None
+_original_load_state_dict = None
+
+
+def _dtypes():
+    import torch
+
+    dtypes = {
+        "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+        "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+        "BOOL": torch.bool,
+    }
+    for name, attribute in (("F8_E4M3", "float8_e4m3fn"), ("F8_E5M2", "float8_e5m2")):
+        if hasattr(torch, attribute):
+            dtypes[name] = getattr(torch, attribute)
+    return dtypes
+
+
+def read_header(path: str):
+    """Returns (header, data offset) of a safetensors file: the JSON header and where tensor data starts."""
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    return header, 8 + length
+
+
+def stage_to_shm(path: str) -> str:
+    """Copies `path` into SHM_DIR unless a complete copy is already there, and returns the copy's path.
+
+    The copy is written under a temporary name and renamed into place, so processes
+    starting together never map a half-written file.
+    """
+    os.makedirs(SHM_DIR, exist_ok=True)
+    stat = os.stat(path)
+    target = os.path.join(SHM_DIR, f"{os.path.basename(path)}.{stat.st_size}.{int(stat.st_mtime)}")
+    if os.path.exists(target):
+        return target
+    partial = f"{target}.{os.getpid()}.partial"
+    with open(path, "rb") as source, open(partial, "wb") as destination:
+        while True:
+            chunk = source.read(64 << 20)
+            if not chunk:
+                break
+            destination.write(chunk)
+    os.replace(partial, target)
+    return target
+
+
+def _map(path: str):
+    with _maps_lock:
+        if path not in _maps:
+            with open(path, "rb") as f:
+                # ACCESS_COPY is MAP_PRIVATE: clean pages come from the shared page cache
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            import ctypes
+
+            address = ctypes.addressof(ctypes.c_char.from_buffer(mapped))
+            _maps[path] = (mapped, address, len(mapped))
+        return _maps[path][0]
+
+
+def load_mapped(path: str, mode: str = "mmap"):
+    """Returns ({name: tensor}, metadata) for a safetensors file, with every tensor a view of one mapping."""
+    import torch
+
+    if mode == "shm":
+        path = stage_to_shm(path)
+    header, data_start = read_header(path)
+    mapped = _map(path)
+    dtypes = _dtypes()
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        begin, end = info["data_offsets"]
+        dtype = dtypes[info["dtype"]]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+        else:
+            tensors[name] = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + begin).reshape(info["shape"])
+    return tensors, header.get("__metadata__")
+
+
+def is_mapped(tensor) -> bool:
+    """True if `tensor`'s memory lies in one of the mappings made by load_mapped()."""
+    if tensor.device.type != "cpu":
+        return False
+    pointer = tensor.untyped_storage().data_ptr()
+    with _maps_lock:
+        return any(start <= pointer < start + length for _, start, length in _maps.values())
+
+
+def enable(mode: str = "mmap") -> None:
+    """Routes ComfyUI's safetensors loads through load_mapped() and lets modules keep the mapped tensors.
+
+    Call after ComfyUI is importable and before the models load. Idempotent.
+    """
+    global _original_load_torch_file, _original_load_state_dict
+    if mode not in MODES:
+        raise ValueError(f"Unknown shared weights mode '{mode}'. Choose one of: {', '.join(MODES)}")
+    if _original_load_torch_file is not None:
+        return
+    import torch
+    import comfy.utils
+
+    _original_load_torch_file = comfy.utils.load_torch_file
+    _original_load_state_dict = torch.nn.Module.load_state_dict
+
+    def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
+        if not str(ckpt).lower().endswith((".safetensors", ".sft")) or (device is not None and torch.device(device).type != "cpu"):
+            # return_metadata is only passed when asked for; older ComfyUI versions don't take it
+            extra = {"return_metadata": True} if return_metadata else {}
+            return _original_load_torch_file(ckpt, safe_load=safe_load, device=device, **extra)
+        tensors, metadata = load_mapped(ckpt, mode)
+        return (tensors, metadata) if return_metadata else tensors
+
+    def load_state_dict(module, state_dict, strict=True, assign=False):
+        if assign or not any(isinstance(value, torch.Tensor) and is_mapped(value) for value in state_dict.values()):
+            return _original_load_state_dict(module, state_dict, strict=strict, assign=assign)
+        # Keep a mapped tensor only where it already has the parameter's dtype and device;
+        # anything that needs a cast (fp8 storage, weights loaded straight to the GPU) is
+        # converted here, which makes the private copy load_state_dict would have made anyway
+        current = module.state_dict(keep_vars=True)
+        prepared = {}
+        for key, value in state_dict.items():
+            target = current.get(key)
+            if (isinstance(value, torch.Tensor) and target is not None and value.shape == target.shape
+                    and (value.dtype != target.dtype or value.device != target.device)):
+                value = value.to(device=target.device, dtype=target.dtype)
+            prepared[key] = value
+        return _original_load_state_dict(module, prepared, strict=strict, assign=True)
+
+    comfy.utils.load_torch_file = load_torch_file
+    torch.nn.Module.load_state_dict = load_state_dict
+
+
+def smaps_report(pid="self", weight_paths=None) -> dict:
+    """Unique versus shared resident memory of a process, from /proc/<pid>/smaps.
+
+    "unique" is private memory (what stopping the process would free), "shared" is pages
+    also mapped by other processes, and "pss" splits shared pages evenly among them.
+    "weights" is the same breakdown restricted to mapped weight files.
+
+    Args:
+        weight_paths: Substrings that mark a mapping as weights (default: .safetensors files and SHM_DIR).
+    """
+    weight_paths = weight_paths or (".safetensors", ".sft", SHM_DIR)
+    fields = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+    totals = {field: 0 for field in fields}
+    weights = {field: 0 for field in fields}
+    files = {}
+    path = None
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if not parts[0].endswith(":"):
+                # Mapping header: address perms offset dev inode [path]
+                path = parts[5] if len(parts) > 5 else None
+                continue
+            field = parts[0][:-1]
+            if field not in totals:
+                continue
+            kilobytes = int(parts[1]) * 1024
+            totals[field] += kilobytes
+            if path and any(marker in path for marker in weight_paths):
+                weights[field] += kilobytes
+                files.setdefault(path, {name: 0 for name in fields})[field] += kilobytes
+
+    def summarize(values):
+        return {
+            "rss_bytes": values["Rss"],
+            "pss_bytes": values["Pss"],
+            "unique_bytes": values["Private_Clean"] + values["Private_Dirty"],
+            "shared_bytes": values["Shared_Clean"] + values["Shared_Dirty"],
+        }
+
+    return {
+        "pid": os.getpid() if pid == "self" else int(pid),
+        **summarize(totals),
+        "weights": summarize(weights),
+        "weight_files": {name: summarize(values) for name, values in files.items()},
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Unique vs shared resident memory per process')
+    parser.add_argument('--pids', type=int, nargs='+', required=True, help='Processes to report on')
+    parser.add_argument('--json', action='store_true', help='Print the reports as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    reports = [smaps_report(pid) for pid in args.pids]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    gb = float(1 << 30)
+    print(f"{'pid':>8} {'rss':>9} {'unique':>9} {'shared':>9} {'pss':>9} {'weights shared':>15}")
+    for report in reports:
+        print(f"{report['pid']:>8} {report['rss_bytes'] / gb:8.2f}G {report['unique_bytes'] / gb:8.2f}G "
+              f"{report['shared_bytes'] / gb:8.2f}G {report['pss_bytes'] / gb:8.2f}G "
+              f"{report['weights']['shared_bytes'] / gb:14.2f}G")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import profiling
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, float("inf"))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+    # Appended to the name on the HELP/TYPE lines; counters are exposed as <name>_total
+    family_suffix = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self):
+        """Yields (suffix, label values, extra labels, value) for the text exposition."""
+        raise NotImplementedError
+
+    def render(self):
+        family = self.name + self.family_suffix
+        lines = [f"# HELP {family} {self.help}", f"# TYPE {family} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, values, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+    family_suffix = "_total"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for values, value in items:
+            yield "_total", values, (), value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_max(self, value: float, **labels):
+        """Raises the gauge to `value` if that is higher; used for high-water marks."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for values, value in items:
+            yield "", values, (), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) if buckets[-1] == float("inf") else tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(values, (list(counts), total)) for values, (counts, total) in self._values.items()]
+        for values, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                yield "_bucket", values, (("le", _format_value(bound)),), count
+            yield "_sum", values, (), total
+            yield "_count", values, (), counts[-1]
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text exposition format.
+
+    Collectors are callables run before every render, for values that are cheaper to read
+    at scrape time than to track (cache stats, memory high-water marks).
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help, **kwargs):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._get_or_create(Counter, name, help, labels=labels)
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labels=labels)
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labels=labels, buckets=buckets)
+
+    def add_collector(self, collector) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in list(self.collectors):
+            try:
+                collector(self)
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram("face_enhance_request_seconds", "End-to-end request latency.", labels=("endpoint",))
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("face_enhance_queue_wait_seconds", "Time requests spent queued before running.",
+                                        labels=("endpoint",))
+STAGE_SECONDS = REGISTRY.histogram("face_enhance_stage_seconds", "Time spent in each pipeline stage.", labels=("stage",))
+REQUESTS = REGISTRY.counter("face_enhance_requests", "Finished requests by outcome.", labels=("endpoint", "status"))
+
+
+"""
+Spans of the current request. Set FACE_ENHANCE_TRACE_LOG to a path to append each finished
+trace there as one JSON line.
+"""
+TRACE_LOG = os.environ.get("FACE_ENHANCE_TRACE_LOG")
+_current_trace = contextvars.ContextVar("face_enhance_trace", default=None)
+_current_span = contextvars.ContextVar("face_enhance_span", default=None)
+_trace_log_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.spans = []
+        self.start = time.time()
+
+    def add_span(self, name, start, seconds, parent=None, span_id=None, **attributes):
+        span_id = span_id or uuid.uuid4().hex[:16]
+        self.spans.append({"span_id": span_id, "parent_id": parent, "name": name, "start": round(start, 6),
+                           "seconds": round(seconds, 6), **attributes})
+        return span_id
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "name": self.name, "start": self.start, **self.attributes,
+                "spans": self.spans}
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Starts a trace for one request; spans opened inside it are collected into it.
+
+    Yields the Trace. The root span is recorded with the trace's outcome and, with
+    TRACE_LOG set, the whole trace is written out when the block exits.
+
+    The trace is found through context variables. A generator that yields inside the block
+    may be resumed in another context (Gradio runs each step in a fresh copy), so spans
+    after a yield should pass the Trace explicitly to span().
+    """
+    current = Trace(name, attributes)
+    root_id = uuid.uuid4().hex[:16]
+    previous_trace, previous_span = _current_trace.get(), _current_span.get()
+    _current_trace.set(current)
+    _current_span.set(root_id)
+    start = time.time()
+    status = "ok"
+    try:
+        yield current
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        # set() rather than reset(): the block may end in a different context than it began in
+        _current_span.set(previous_span)
+        _current_trace.set(previous_trace)
+        current.add_span(name, start, time.time() - start, span_id=root_id, status=status)
+        if TRACE_LOG:
+            write_trace(current)
+
+
+@contextmanager
+def span(name: str, trace: Trace = None, **attributes):
+    """Records a span in `trace` (default: the current one), nested under the enclosing span.
+
+    A no-op outside a trace.
+    """
+    current = trace or _current_trace.get()
+    if current is None:
+        yield
+        return
+    parent = _current_span.get()
+    span_id = uuid.uuid4().hex[:16]
+    _current_span.set(span_id)
+    start = time.time()
+    try:
+        yield
+    finally:
+        _current_span.set(parent)
+        current.add_span(name, start, time.time() - start, parent=parent, span_id=span_id, **attributes)
+
+
+def write_trace(current: Trace) -> None:
+    with _trace_log_lock, open(TRACE_LOG, "a") as f:
+        f.write(json.dumps(current.to_dict()) + "\n")
+
+
+def _record_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    current = _current_trace.get()
+    if current is not None:
+        current.add_span(name, time.time() - seconds, seconds, parent=_current_span.get())
+
+
+def _collect_memory(registry: Registry) -> None:
+    import resource
+    import sys
+
+    scale = 1 if sys.platform == "darwin" else 1024
+    registry.gauge("face_enhance_peak_rss_bytes", "Process resident memory high-water mark.").set_max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    )
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        registry.gauge("face_enhance_peak_cuda_bytes", "CUDA memory allocated high-water mark.").set_max(
+            torch.cuda.max_memory_allocated()
+        )
+
+
+_enabled = False
+
+
+def enable() -> None:
+    """Feeds profiling.stage() timings into STAGE_SECONDS and the current trace. Idempotent."""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    profiling.add_listener(_record_stage)
+    REGISTRY.add_collector(_collect_memory)
+
+
+def add_cache_collector(cache_name: str, stats) -> None:
+    """Exports the dict returned by `stats()` (hits, misses, entries, ...) as gauges at scrape time."""
+
+    def collect(registry):
+        values = stats()
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                registry.gauge(f"face_enhance_cache_{key}", f"Cache statistic '{key}'.", labels=("cache",)).set(
+                    value, cache=cache_name
+                )
+
+    REGISTRY.add_collector(collect)
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0"):
+    """Serves REGISTRY.render() at http://host:port/metrics from a daemon thread and returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
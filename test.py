@@ -1,16 +1,55 @@
 import argparse
 import os
 import shutil
-from face_enhance import face_enhance
+import time
+
+import telemetry
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Face Enhancement Tool')
-    parser.add_argument('--input', type=str, required=True, help='Path to the input image')
-    parser.add_argument('--ref', type=str, required=True, help='Path to the reference image')
-    parser.add_argument('--output', type=str, required=True, help='Path to save the output image')
+    parser.add_argument('--input', type=str, help='Path to the input image')
+    parser.add_argument('--ref', type=str, help='Path to the reference image')
+    parser.add_argument('--output', type=str, help='Path to save the output image')
     parser.add_argument('--id_weight', type=float, default=0.75, help='face ID weight')
+    parser.add_argument('--manifest', type=str, help='Bulk mode: CSV or JSONL manifest with input, ref and output columns')
+    parser.add_argument('--input-dir', type=str, help='Bulk mode: enhance every image in this directory against --ref')
+    parser.add_argument('--output-dir', type=str, help='Bulk mode: where --input-dir outputs are written')
+    parser.add_argument('--journal', type=str, help='Bulk mode: progress journal used to resume (default: next to the outputs)')
+    parser.add_argument('--prefetch', type=int, default=2, help='Bulk mode: images decoded ahead of the GPU')
+    parser.add_argument('--preset', choices=['draft', 'balanced', 'max'], default='max', help='Latency/quality preset')
+    parser.add_argument('--crop-face', action='store_true', help='Only enhance a crop around the face and blend it back')
+    parser.add_argument('--tile-size', type=int, default=None, help='Enhance images larger than this in overlapping tiles of this size')
+    parser.add_argument('--tile-overlap', type=int, default=128, help='With --tile-size, pixels shared and blended by neighbouring tiles')
+    parser.add_argument('--max-megapixels', type=float, default=None, help='Downscale larger inputs to this budget before enhancing')
+    parser.add_argument('--min-megapixels', type=float, default=None, help='Upscale smaller inputs to this size before enhancing')
+    parser.add_argument('--best-of', type=int, default=None, help='Sample this many seeds and keep the closest face to the reference')
+    parser.add_argument('--distance-threshold', type=float, default=None, help='With --best-of, stop once a candidate is at or below this cosine distance')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='With --best-of, seeds sampled per run (default: all at once, or 1 with --distance-threshold)')
+    parser.add_argument('--scratch', action='store_true', help='Copy the inputs into ComfyUI/input/scratch for debugging')
+    parser.add_argument('--lazy', action='store_true', help='Load each model on first use instead of all at import')
+    parser.add_argument('--parallel-load', action='store_true', help='Load the models concurrently on a thread pool')
+    parser.add_argument('--timings', action='store_true', help='Print a per-phase startup timing breakdown')
     args = parser.parse_args()
 
+    if args.tile_size is not None and not 0 <= args.tile_overlap < args.tile_size:
+        parser.error(f"--tile-overlap must be at least 0 and smaller than --tile-size ({args.tile_size})")
+    if args.manifest:
+        if not os.path.exists(args.manifest):
+            parser.error(f"Manifest does not exist: {args.manifest}")
+        return args
+    if args.input_dir:
+        if not os.path.isdir(args.input_dir):
+            parser.error(f"Input directory does not exist: {args.input_dir}")
+        if not args.ref or not os.path.exists(args.ref):
+            parser.error(f"Reference file does not exist: {args.ref}")
+        if not args.output_dir:
+            parser.error("--output-dir is required with --input-dir")
+        return args
+
+    for name in ('input', 'ref', 'output'):
+        if getattr(args, name) is None:
+            parser.error(f"--{name} is required unless --manifest or --input-dir is given")
     if not os.path.exists(args.input):
         parser.error(f"Input file does not exist: {args.input}")
     if not os.path.exists(args.ref):
@@ -39,51 +78,121 @@ def create_scratch_dir():
 
     return new_dir
 
-def process_face(input_path, ref_path, output_path=None, id_weight=0.75):
+def enhance_options(args):
+    """Collect the enhancement options given on the command line, passed through to face_enhance."""
+    return {
+        "preset": args.preset,
+        "crop_face": args.crop_face,
+        "tile_size": args.tile_size,
+        "tile_overlap": args.tile_overlap,
+        "max_megapixels": args.max_megapixels,
+        "min_megapixels": args.min_megapixels,
+    }
+
+def process_face(input_path, ref_path, output_path=None, id_weight=0.75, positive_prompt="", seed=None, scratch=False,
+                 best_of=None, distance_threshold=None, batch_size=None, **options):
     """
     Process a face image using the given parameters.
 
+    The images are read straight from their paths. Extra keyword `options` are passed to
+    face_enhance (see face_enhance.enhance_pixels). With scratch=True they are first
+    copied into a new ./ComfyUI/input/scratch directory, which is useful for debugging
+    the same inputs in the ComfyUI workflow. With best_of=N, N seeds are sampled and the
+    candidate closest to the reference face is saved, `batch_size` seeds per run.
+
     Returns:
-        str: Path to the scratch directory used for processing
+        str: Path to the scratch directory used for processing, or None without scratch
     """
+    # Imported here so that argument errors and --help never wait for ComfyUI or the models
+    from face_enhance import face_enhance, face_enhance_best_of
+
     print(f"Processing image: {input_path}")
     print(f"Reference image: {ref_path}")
     print(f"Output will be saved to: {output_path}")
 
-    # Create a new scratch directory for this run
-    scratch_dir = create_scratch_dir()
-    print(f"Created scratch directory: {scratch_dir}")
-
-    # Copy input and reference images to scratch directory
-    input_filename = os.path.basename(input_path)
-    ref_filename = os.path.basename(ref_path)
-
-    scratch_input = os.path.join(scratch_dir, input_filename)
-    scratch_ref = os.path.join(scratch_dir, ref_filename)
-
-    shutil.copy(input_path, scratch_input)
-    shutil.copy(ref_path, scratch_ref)
-
-    # Convert paths to ComfyUI format (relative to ComfyUI/input/)
-    # For example: "./ComfyUI/input/scratch/1/image.png" becomes "scratch/1/image.png"
-    comfy_ref_path = os.path.relpath(scratch_ref, "./ComfyUI/input")
-    comfy_input_path = os.path.relpath(scratch_input, "./ComfyUI/input")
-
-    face_enhance(comfy_ref_path, comfy_input_path, output_path, dist_image=f"{output_path}_dist.png", id_weight=id_weight)
+    scratch_dir = None
+    with telemetry.trace("cli_request", input=input_path, ref=ref_path):
+        if scratch:
+            with telemetry.span("temp_io"):
+                # Create a new scratch directory for this run
+                scratch_dir = create_scratch_dir()
+                print(f"Created scratch directory: {scratch_dir}")
+
+                # Copy input and reference images to scratch directory
+                scratch_input = os.path.join(scratch_dir, os.path.basename(input_path))
+                scratch_ref = os.path.join(scratch_dir, os.path.basename(ref_path))
+                shutil.copy(input_path, scratch_input)
+                shutil.copy(ref_path, scratch_ref)
+                input_path, ref_path = scratch_input, scratch_ref
+
+        if best_of:
+            result = face_enhance_best_of(ref_path, input_path, output_path, positive_prompt=positive_prompt,
+                                          id_weight=id_weight, num_candidates=best_of,
+                                          batch_size=batch_size, distance_threshold=distance_threshold,
+                                          **options)
+            for candidate in result["candidates"]:
+                print(f"Seed {candidate['seed']}: distance {candidate['distance']}")
+            print(f"Best seed {result['seed']} with distance {result['distance']}")
+        else:
+            face_enhance(ref_path, input_path, output_path, dist_image=f"{output_path}_dist.png",
+                         positive_prompt=positive_prompt, id_weight=id_weight, seed=seed, **options)
 
     print(f"Enhanced image saved to: {output_path}")
-    print(f"Working files are in: {scratch_dir}")
+    if scratch_dir:
+        print(f"Working files are in: {scratch_dir}")
 
     return scratch_dir
 
+def process_bulk(args):
+    """Run bulk mode over a manifest or a directory of targets, keeping the models loaded."""
+    from bulk import JOURNAL_NAME, read_manifest, run_bulk, scan_directory
+
+    defaults = {"id_weight": args.id_weight}
+    if args.manifest:
+        items = read_manifest(args.manifest, defaults)
+        journal_dir = os.path.dirname(os.path.abspath(args.manifest))
+    else:
+        items = scan_directory(args.input_dir, args.ref, args.output_dir, defaults)
+        os.makedirs(args.output_dir, exist_ok=True)
+        journal_dir = args.output_dir
+    journal_path = args.journal or os.path.join(journal_dir, JOURNAL_NAME)
+
+    print(f"Processing {len(items)} images, journal: {journal_path}")
+    counts = run_bulk(items, journal_path, prefetch=args.prefetch, **enhance_options(args))
+    print(f"Done: {counts['done']}, skipped: {counts['skipped']}, failed: {counts['failed']}")
+    return counts
+
 def main():
+    start = time.perf_counter()
     args = parse_args()
-    return process_face(
-        input_path=args.input,
-        ref_path=args.ref,
-        output_path=args.output,
-        id_weight=args.id_weight
-    )
+    if args.lazy:
+        os.environ["FACE_ENHANCE_LAZY"] = "1"
+    if args.parallel_load:
+        os.environ["FACE_ENHANCE_PARALLEL_LOAD"] = "1"
+    if telemetry.TRACE_LOG:
+        telemetry.enable()
+
+    if args.manifest or args.input_dir:
+        result = process_bulk(args)
+    else:
+        result = process_face(
+            input_path=args.input,
+            ref_path=args.ref,
+            output_path=args.output,
+            id_weight=args.id_weight,
+            scratch=args.scratch,
+            best_of=args.best_of,
+            distance_threshold=args.distance_threshold,
+            batch_size=args.batch_size,
+            **enhance_options(args),
+        )
+
+    if args.timings:
+        from face_enhance import startup_report
+        print("Startup timings:")
+        print(startup_report())
+        print(f"Total wall time: {time.perf_counter() - start:.3f}s")
+    return result
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+# Lazy startup: importing face_enhance must not load any model
+os.environ.setdefault("FACE_ENHANCE_LAZY", "1")
+import face_enhance  # noqa: E402
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    ({"num_candidates": 0}, "num_candidates"),
+    ({"seeds": []}, "seeds"),
+])
+def test_main_best_of_rejects_no_candidates(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        face_enhance.main_best_of("face.png", "target.png", **kwargs)
@@ -0,0 +1,23 @@
+import telemetry
+
+
+def test_counter_help_and_type_use_the_total_name():
+    registry = telemetry.Registry()
+    requests = registry.counter("face_enhance_requests", "Finished requests by outcome.", labels=("status",))
+    requests.inc(status="done")
+    assert requests.render() == [
+        "# HELP face_enhance_requests_total Finished requests by outcome.",
+        "# TYPE face_enhance_requests_total counter",
+        'face_enhance_requests_total{status="done"} 1',
+    ]
+
+
+def test_gauge_lines_keep_the_metric_name():
+    registry = telemetry.Registry()
+    gauge = registry.gauge("face_enhance_queue_depth", "Jobs waiting.")
+    gauge.set(3)
+    assert gauge.render() == [
+        "# HELP face_enhance_queue_depth Jobs waiting.",
+        "# TYPE face_enhance_queue_depth gauge",
+        "face_enhance_queue_depth 3",
+    ]
@@ -0,0 +1,18 @@
+import pytest
+
+from worker_pool import NoWorkersAvailable, WorkerPool
+
+
+def test_pending_jobs_fail_when_every_worker_fails_to_start():
+    # StubBackend takes no `missing` argument, so the worker fails while loading
+    pool = WorkerPool(["cpu"], backend="stub", backend_kwargs={"missing": True}, heartbeat_interval=0.2)
+    pool.start(wait=False)
+    try:
+        future = pool.submit(None, None)
+        with pytest.raises(NoWorkersAvailable):
+            future.result(timeout=60)
+        stats = pool.stats()
+        assert [worker["state"] for worker in stats["workers"]] == ["failed"]
+        assert stats["pending"] == 0
+    finally:
+        pool.stop()
@@ -0,0 +1,73 @@
+import torch
+
+from image_utils import resize_image
+
+
+def tile_spans(length: int, tile_size: int, overlap: int):
+    """Splits [0, length) into (start, end) spans of `tile_size` that overlap by at least `overlap`.
+
+    The last span is aligned to the end, so every span is full size unless `length` is
+    smaller than one tile. Raises ValueError unless `overlap` is smaller than `tile_size`,
+    since the tiles would otherwise never advance past each other.
+    """
+    if overlap >= tile_size:
+        raise ValueError(f"Tile overlap ({overlap}) must be smaller than the tile size ({tile_size})")
+    if length <= tile_size:
+        return [(0, length)]
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size, stride)) + [length - tile_size]
+    return [(start, start + tile_size) for start in starts]
+
+
+def blend_window(height: int, width: int, overlap: int, fade_top: bool, fade_bottom: bool,
+                 fade_left: bool, fade_right: bool) -> torch.Tensor:
+    """Builds a [height, width, 1] weight that ramps linearly across the overlap on the faded sides."""
+
+    def edge_ramp(length, fade_start, fade_end):
+        position = torch.arange(length, dtype=torch.float32) + 0.5
+        weights = torch.ones(length)
+        ramp = max(1, min(overlap, length))
+        if fade_start:
+            weights = torch.minimum(weights, position / ramp)
+        if fade_end:
+            weights = torch.minimum(weights, (length - position) / ramp)
+        return weights
+
+    window_y = edge_ramp(height, fade_top, fade_bottom)
+    window_x = edge_ramp(width, fade_left, fade_right)
+    return (window_y[:, None] * window_x[None, :])[..., None]
+
+
+def tiled_apply(pixels: torch.Tensor, fn, tile_size: int = 1024, overlap: int = 128) -> torch.Tensor:
+    """Applies an image-to-image `fn` tile by tile and blends the overlapping results.
+
+    Only one tile is processed at a time, so the memory `fn` needs is bounded by the tile size.
+    The full-size result is accumulated on the CPU. Outputs that come back at a different
+    size (e.g. cropped to the VAE stride) are resized to their tile. The output batch size
+    follows what `fn` returns, which may differ from the input's.
+
+    Args:
+        pixels: IMAGE tensor of shape [batch_size, height, width, channels].
+        fn: Maps an IMAGE tile to an enhanced IMAGE tile.
+        tile_size: Tile side in pixels; a multiple of 16 keeps tiles aligned to Flux latents.
+        overlap: Pixels shared by neighbouring tiles, blended with a linear ramp.
+    """
+    height, width, channels = pixels.shape[1:]
+    rows = tile_spans(height, tile_size, overlap)
+    columns = tile_spans(width, tile_size, overlap)
+
+    output = None
+    weight = torch.zeros((1, height, width, 1), dtype=torch.float32)
+    for top, bottom in rows:
+        for left, right in columns:
+            tile = fn(pixels[:, top:bottom, left:right, :])
+            tile = resize_image(tile.float(), bottom - top, right - left).cpu()
+            if output is None:
+                output = torch.zeros((tile.shape[0], height, width, channels), dtype=torch.float32)
+            window = blend_window(
+                bottom - top, right - left, overlap,
+                fade_top=top > 0, fade_bottom=bottom < height, fade_left=left > 0, fade_right=right < width,
+            )
+            output[:, top:bottom, left:right, :] += tile * window
+            weight[:, top:bottom, left:right, :] += window
+    return output / weight.clamp(min=1e-6)
@@ -0,0 +1,381 @@
+"""Runs the pipeline in several worker processes, one per device, behind a least-loaded dispatcher.
+
+There is one COMFY_MODELS per process and face_enhance runs one request at a time, so
+scaling out means one process per GPU. Each worker is pinned to its device through
+CUDA_VISIBLE_DEVICES before torch is imported and loads its own models.
+
+    pool = WorkerPool(["cuda:0", "cuda:1"])
+    pool.start()
+    image = pool.submit(input_image, ref_image, id_weight=0.8).result()
+    pool.rolling_restart()
+    pool.stop()
+
+WorkerPool(["cpu", "cpu"], backend="stub") runs the same machinery on CPU with the stub backend.
+"""
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker running a job exited or stopped responding before finishing it."""
+
+
+class NoWorkersAvailable(RuntimeError):
+    """Every worker is down or draining."""
+
+
+def _pin_device(device: str) -> None:
+    """Makes `device` the only GPU this process sees; "cpu" hides them all."""
+    if device == "cpu":
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    elif device.startswith("cuda:"):
+        os.environ["CUDA_VISIBLE_DEVICES"] = device.split(":", 1)[1]
+
+
+def _worker_main(worker_id, device, backend_name, backend_kwargs, jobs, events, heartbeat_interval):
+    """Entry point of a worker process: loads the backend, then runs jobs until it gets None."""
+    _pin_device(device)
+    # Imported after pinning so torch only ever sees this worker's device
+    from api_server import BACKENDS
+
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(heartbeat_interval):
+            events.put(("heartbeat", worker_id, time.time()))
+
+    try:
+        backend = BACKENDS[backend_name](**backend_kwargs)
+    except Exception as e:
+        events.put(("failed", worker_id, f"{type(e).__name__}: {e}"))
+        return
+    threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+    events.put(("ready", worker_id, os.getpid()))
+
+    while True:
+        message = jobs.get()
+        if message is None:
+            break
+        job_id, input_image, ref_image, id_weight = message
+        try:
+            result = backend.enhance(input_image, ref_image, id_weight)
+            events.put(("result", worker_id, job_id, result, None))
+        except Exception as e:
+            events.put(("result", worker_id, job_id, None, f"{type(e).__name__}: {e}"))
+    stopped.set()
+
+
+class Worker:
+    """Parent-side state of one worker process."""
+
+    def __init__(self, worker_id: int, device: str):
+        self.id = worker_id
+        self.device = device
+        self.process = None
+        self.jobs = None
+        self.state = "stopped"  # starting, ready, draining, stopped, failed
+        self.in_flight = {}  # job_id -> (Future, job message, attempts)
+        self.last_heartbeat = None
+        self.started_at = None
+        self.restarts = 0  # after crashes or missed heartbeats
+        self.recycles = 0  # deliberate restart()s
+        self.completed = 0
+        self.error = None
+        self.ready = threading.Event()
+
+    def to_dict(self):
+        return {
+            "worker_id": self.id,
+            "device": self.device,
+            "state": self.state,
+            "pid": self.process.pid if self.process is not None else None,
+            "in_flight": len(self.in_flight),
+            "completed": self.completed,
+            "restarts": self.restarts,
+            "recycles": self.recycles,
+            "last_heartbeat_age": round(time.time() - self.last_heartbeat, 3) if self.last_heartbeat else None,
+            "error": self.error,
+        }
+
+
+class WorkerPool:
+    """Worker processes with least-loaded routing, health checks, crash restarts and draining.
+
+    Jobs go to the ready worker with the fewest jobs in flight, up to `max_in_flight` each
+    (queued in the parent beyond that). A monitor thread restarts workers whose process
+    exits or whose heartbeat is older than `heartbeat_timeout`. Jobs lost with a worker are
+    retried on another worker up to `max_retries` times, then fail with WorkerCrashed.
+    Draining a worker stops new jobs going to it and stops it once its jobs are done,
+    which is what rolling_restart() does one worker at a time.
+
+    Args:
+        devices: One worker per entry, e.g. ["cuda:0", "cuda:1"] or ["cpu", "cpu"].
+        backend: api_server.BACKENDS name each worker runs.
+        backend_kwargs: Keyword arguments for the backend, e.g. {"delay": 0.1} for "stub".
+        startup_timeout: Seconds a worker may take to load its models.
+    """
+
+    def __init__(self, devices, backend: str = "face_enhance", backend_kwargs: dict = None,
+                 max_in_flight: int = 1, max_retries: int = 1, heartbeat_interval: float = 2.0,
+                 heartbeat_timeout: float = 30.0, startup_timeout: float = 900.0, max_restarts: int = 5):
+        self.backend = backend
+        self.backend_kwargs = backend_kwargs or {}
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.max_restarts = max_restarts
+        self.workers = [Worker(i, device) for i, device in enumerate(devices)]
+        # spawn, not fork: CUDA can't be used in a forked child of a process that initialized it
+        self._context = multiprocessing.get_context("spawn")
+        self._events = None
+        self._pending = []  # (job message, Future, attempts) waiting for a free worker
+        self._job_ids = itertools.count()
+        self._lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self, wait: bool = True) -> None:
+        """Starts every worker, the event reader and the monitor; with wait=True blocks until they are ready."""
+        self._events = self._context.Queue()
+        for worker in self.workers:
+            self._spawn(worker)
+        for target, name in ((self._read_events, "pool-events"), (self._monitor, "pool-monitor")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if wait:
+            for worker in self.workers:
+                worker.ready.wait(self.startup_timeout)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stops every worker; jobs still in flight fail with WorkerCrashed."""
+        self._stopping.set()
+        for worker in self.workers:
+            self._shutdown(worker, timeout)
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for _, future, _ in pending:
+            future.set_exception(NoWorkersAvailable("The pool was stopped"))
+
+    def _spawn(self, worker: Worker) -> None:
+        worker.jobs = self._context.Queue()
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(worker.id, worker.device, self.backend, self.backend_kwargs, worker.jobs, self._events,
+                  self.heartbeat_interval),
+            name=f"face-enhance-worker-{worker.id}",
+            daemon=True,
+        )
+        worker.state = "starting"
+        worker.error = None
+        worker.ready.clear()
+        worker.started_at = worker.last_heartbeat = time.time()
+        worker.process.start()
+        print(f"Worker {worker.id} starting on {worker.device} (pid {worker.process.pid})")
+
+    def _shutdown(self, worker: Worker, timeout: float) -> None:
+        if worker.process is None:
+            return
+        if worker.process.is_alive():
+            worker.jobs.put(None)
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(timeout)
+        worker.state = "stopped"
+        self._fail_in_flight(worker, "Worker was stopped")
+
+    def submit(self, input_image, ref_image, id_weight: float = 0.75) -> Future:
+        """Queues a job on the least-loaded worker and returns a Future for the enhanced PIL image."""
+        future = Future()
+        message = (next(self._job_ids), input_image, ref_image, id_weight)
+        with self._lock:
+            if not any(worker.state in ("starting", "ready") for worker in self.workers):
+                future.set_exception(NoWorkersAvailable("No worker is running"))
+                return future
+            self._pending.append((message, future, 0))
+            self._dispatch()
+        return future
+
+    def enhance(self, input_image, ref_image, id_weight: float = 0.75):
+        """Blocking submit(), with the same signature as the api_server backends."""
+        return self.submit(input_image, ref_image, id_weight).result()
+
+    def _dispatch(self) -> None:
+        # Called with the lock held
+        while self._pending:
+            ready = [worker for worker in self.workers
+                     if worker.state == "ready" and len(worker.in_flight) < self.max_in_flight]
+            if not ready:
+                return
+            worker = min(ready, key=lambda worker: (len(worker.in_flight), worker.id))
+            message, future, attempts = self._pending.pop(0)
+            # Retried jobs are already running
+            if attempts == 0 and not future.set_running_or_notify_cancel():
+                continue
+            worker.in_flight[message[0]] = (future, message, attempts)
+            worker.jobs.put(message)
+
+    def _read_events(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                event = self._events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            kind, worker_id = event[0], event[1]
+            worker = self.workers[worker_id]
+            with self._lock:
+                worker.last_heartbeat = time.time()
+                if kind == "ready":
+                    worker.state = "ready"
+                    worker.ready.set()
+                    print(f"Worker {worker.id} ready on {worker.device} after "
+                          f"{time.time() - worker.started_at:.1f}s")
+                elif kind == "failed":
+                    worker.state = "failed"
+                    worker.error = event[2]
+                    worker.ready.set()
+                    print(f"Worker {worker.id} failed to start: {event[2]}")
+                    self._fail_pending_if_no_workers()
+                elif kind == "result":
+                    job_id, result, error = event[2], event[3], event[4]
+                    entry = worker.in_flight.pop(job_id, None)
+                    worker.completed += 1
+                    if entry is not None:
+                        if error is None:
+                            entry[0].set_result(result)
+                        else:
+                            entry[0].set_exception(RuntimeError(error))
+                    if worker.state == "draining" and not worker.in_flight:
+                        worker.jobs.put(None)
+                self._dispatch()
+
+    def _monitor(self) -> None:
+        while not self._stopping.wait(self.heartbeat_interval):
+            for worker in self.workers:
+                with self._lock:
+                    self._check(worker)
+
+    def _check(self, worker: Worker) -> None:
+        """Restarts `worker` if its process exited or its heartbeat is too old. Called with the lock held."""
+        if worker.state in ("stopped", "failed"):
+            return
+        alive = worker.process.is_alive()
+        if worker.state == "draining":
+            if not alive:
+                worker.state = "stopped"
+                # Normally empty; a worker that died while draining leaves its jobs here
+                self._fail_in_flight(worker, f"Worker {worker.id} exited with code {worker.process.exitcode} while draining")
+            return
+        limit = self.startup_timeout if worker.state == "starting" else self.heartbeat_timeout
+        if alive and time.time() - worker.last_heartbeat <= limit:
+            return
+        reason = f"exited with code {worker.process.exitcode}" if not alive else f"sent no heartbeat for {limit:.0f}s"
+        print(f"Worker {worker.id} {reason}")
+        if alive:
+            worker.process.terminate()
+            worker.process.join(5)
+        worker.error = reason
+        worker.state = "stopped"
+        self._fail_in_flight(worker, f"Worker {worker.id} {reason}")
+        if worker.restarts >= self.max_restarts:
+            worker.state = "failed"
+            self._fail_pending_if_no_workers()
+            return
+        worker.restarts += 1
+        self._spawn(worker)
+
+    def _fail_in_flight(self, worker: Worker, reason: str) -> None:
+        """Retries the worker's unfinished jobs elsewhere, or fails them once out of retries."""
+        with self._lock:
+            in_flight, worker.in_flight = worker.in_flight, {}
+            for future, message, attempts in in_flight.values():
+                if attempts < self.max_retries and not self._stopping.is_set():
+                    self._pending.insert(0, (message, future, attempts + 1))
+                else:
+                    future.set_exception(WorkerCrashed(reason))
+            self._dispatch()
+
+    def _fail_pending_if_no_workers(self) -> None:
+        """Fails every queued job once no worker is starting, ready or draining. Called with the lock held."""
+        if any(worker.state in ("starting", "ready", "draining") for worker in self.workers):
+            return
+        pending, self._pending = self._pending, []
+        for _, future, _ in pending:
+            if not future.cancelled():
+                future.set_exception(NoWorkersAvailable("Every worker has failed"))
+
+    def drain(self, worker_id: int, wait: bool = True, timeout: float = None) -> None:
+        """Stops routing jobs to a worker and stops it once its in-flight jobs finish."""
+        worker = self.workers[worker_id]
+        with self._lock:
+            if worker.state not in ("starting", "ready"):
+                return
+            worker.state = "draining"
+            if not worker.in_flight:
+                worker.jobs.put(None)
+        if wait:
+            worker.process.join(timeout)
+            with self._lock:
+                if not worker.process.is_alive():
+                    worker.state = "stopped"
+                    self._fail_in_flight(worker, f"Worker {worker.id} exited while draining")
+
+    def restart(self, worker_id: int, wait: bool = True) -> None:
+        """Drains a worker, then starts a fresh process on the same device."""
+        worker = self.workers[worker_id]
+        self.drain(worker_id, wait=True)
+        # Counted apart from `restarts`, which is the crash budget checked against max_restarts
+        worker.recycles += 1
+        with self._lock:
+            self._spawn(worker)
+        if wait:
+            worker.ready.wait(self.startup_timeout)
+
+    def rolling_restart(self) -> None:
+        """Restarts the workers one at a time, so the rest keep serving."""
+        for worker in self.workers:
+            self.restart(worker.id, wait=True)
+
+    def memory_report(self) -> dict:
+        """Unique vs shared resident memory of each running worker (see shared_weights.smaps_report)."""
+        from shared_weights import smaps_report
+
+        report = {}
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                try:
+                    report[worker.id] = smaps_report(worker.process.pid)
+                except OSError as e:  # The worker exited while being read
+                    report[worker.id] = {"error": str(e)}
+        return report
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "pending": len(self._pending),
+                "workers": [worker.to_dict() for worker in self.workers],
+            }
+
+
+class PoolBackend:
+    """Adapts a WorkerPool to the api_server backend interface."""
+
+    name = "pool"
+
+    def __init__(self, pool: WorkerPool):
+        self.pool = pool
+
+    def enhance(self, input_image, ref_image, id_weight=0.75):
+        return self.pool.enhance(input_image, ref_image, id_weight)
+
+    def stats(self):
+        return self.pool.stats()
@@ -0,0 +1,303 @@
+import hashlib
+import itertools
+import json
+from collections import OrderedDict
+
+import torch
+
+from caches import image_key, tensor_hash
+from profiling import stage
+
+# Frontend-only nodes that never reach the ComfyUI backend
+VIRTUAL_NODE_TYPES = {"Reroute", "Note", "MarkdownNote", "PrimitiveNode"}
+WIDGET_TYPES = {"INT", "FLOAT", "STRING", "BOOLEAN", "COMBO"}
+# Extra widget value the frontend stores after seed inputs
+SEED_CONTROL_VALUES = {"fixed", "increment", "decrement", "randomize"}
+MODE_MUTED = 2
+MODE_BYPASSED = 4
+# Nodes that attach per-run state to a shared model: ApplyPulidFlux adds its identity
+# embedding to the Flux model's pulid_data, which every later sampling run would apply
+STATEFUL_NODE_TYPES = {"ApplyPulidFlux"}
+_always_changed = itertools.count()
+
+
+def value_key(value):
+    """A stable, hashable description of an input value, used to build node signatures."""
+    if isinstance(value, torch.Tensor):
+        return ("tensor", tensor_hash(value))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(value_key(item) for item in value))
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((str(key), value_key(item)) for key, item in value.items())))
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if hasattr(value, "tobytes") and hasattr(value, "mode"):
+        return ("image", image_key(value))
+    # Models and other opaque objects are identified by the object itself
+    return (type(value).__name__, id(value))
+
+
+class Link:
+    def __init__(self, node_id: int, slot: int):
+        self.node_id = node_id
+        self.slot = slot
+
+
+class WorkflowNode:
+    def __init__(self, node_id: int, class_type: str, inputs: dict):
+        self.id = node_id
+        self.class_type = class_type
+        self.inputs = inputs
+
+
+class WorkflowExecutor:
+    """Runs a workflow saved from the ComfyUI editor (the "nodes"/"links" JSON) in process.
+
+    The graph is built from the JSON: Reroute nodes are resolved to the links they forward,
+    widget values are matched to each node class's INPUT_TYPES, and muted, bypassed and
+    frontend-only nodes are dropped. run() executes the nodes a set of targets depends on
+    in topological order.
+
+    Every node gets a signature from its class, its constant inputs and the signatures of
+    the nodes feeding it, so a node's signature changes exactly when something upstream of
+    it changes. Outputs are memoized per node by signature (the last `cache_per_node`
+    signatures are kept), so a rerun that only changes the seed or the ID weight reuses
+    the loaders, text encoding and VAE encode and re-executes only the affected subgraph.
+
+    STATEFUL_NODE_TYPES are the exception: their outputs depend on state they leave on a
+    shared model, so they run on a fresh instance every run, are never served from the
+    cache, and have that state removed once the run ends.
+    """
+
+    def __init__(self, workflow, node_classes: dict, cache_per_node: int = 1):
+        if isinstance(workflow, str):
+            with open(workflow) as f:
+                workflow = json.load(f)
+        self.node_classes = node_classes
+        self.cache_per_node = cache_per_node
+        self.nodes = {}
+        self.unavailable = {}
+        self.injected = {}
+        self.objects = {}
+        self._stateful = []
+        self.cache = {}
+        self.last_run = {"executed": [], "cached": []}
+        self._parse(workflow)
+
+    def _parse(self, workflow):
+        raw_nodes = {node["id"]: node for node in workflow["nodes"]}
+        links = {link[0]: (link[1], link[2]) for link in workflow["links"]}
+
+        def resolve(link_id):
+            source_id, slot = links[link_id]
+            source = raw_nodes[source_id]
+            # Reroutes and bypassed nodes pass their first input straight through
+            while source["type"] == "Reroute" or source.get("mode") == MODE_BYPASSED:
+                upstream = [entry["link"] for entry in source.get("inputs", []) if entry.get("link") is not None]
+                if not upstream:
+                    return None
+                source_id, slot = links[upstream[0]]
+                source = raw_nodes[source_id]
+            return Link(source_id, slot)
+
+        for node_id, raw in raw_nodes.items():
+            class_type = raw["type"]
+            if class_type in VIRTUAL_NODE_TYPES or raw.get("mode") in (MODE_MUTED, MODE_BYPASSED):
+                continue
+            if class_type not in self.node_classes:
+                self.unavailable[node_id] = class_type
+                continue
+
+            inputs = {}
+            for entry in raw.get("inputs", []):
+                if entry.get("link") is not None:
+                    link = resolve(entry["link"])
+                    if link is not None:
+                        inputs[entry["name"]] = link
+            widget_values = list(raw.get("widgets_values") or [])
+            if isinstance(raw.get("widgets_values"), dict):
+                inputs.update({name: value for name, value in raw["widgets_values"].items() if name not in inputs})
+                widget_values = []
+            for name, spec in self._input_specs(class_type):
+                if not widget_values:
+                    break
+                input_type = spec[0] if isinstance(spec, (list, tuple)) and spec else spec
+                options = spec[1] if isinstance(spec, (list, tuple)) and len(spec) > 1 else {}
+                if not (isinstance(input_type, list) or input_type in WIDGET_TYPES):
+                    continue
+                value = widget_values.pop(0)
+                if name not in inputs:
+                    inputs[name] = value
+                has_control = input_type == "INT" and (
+                    name in ("seed", "noise_seed") or (isinstance(options, dict) and options.get("control_after_generate"))
+                )
+                if has_control and widget_values and widget_values[0] in SEED_CONTROL_VALUES:
+                    widget_values.pop(0)
+            self.nodes[node_id] = WorkflowNode(node_id, class_type, inputs)
+
+    def _input_specs(self, class_type):
+        input_types = self.node_classes[class_type].INPUT_TYPES()
+        for section in ("required", "optional"):
+            yield from input_types.get(section, {}).items()
+
+    def output_nodes(self):
+        """IDs of the runnable nodes whose class is an OUTPUT_NODE, e.g. SaveImage."""
+        return [node_id for node_id, node in self.nodes.items()
+                if getattr(self.node_classes[node.class_type], "OUTPUT_NODE", False)
+                and not self._missing_dependencies(node_id)]
+
+    def _missing_dependencies(self, node_id):
+        missing = []
+        for source in self.nodes[node_id].inputs.values():
+            if isinstance(source, Link):
+                if source.node_id in self.unavailable:
+                    missing.append(self.unavailable[source.node_id])
+                elif source.node_id in self.nodes:
+                    missing.extend(self._missing_dependencies(source.node_id))
+        return missing
+
+    def inject(self, node_id: int, outputs) -> None:
+        """Replaces a node's outputs with `outputs` (a tuple, like a node's return value).
+
+        Use it to feed in-memory images in place of LoadImage, or already loaded models in
+        place of the loader nodes. Pass None to run the node itself again.
+        """
+        if outputs is None:
+            self.injected.pop(node_id, None)
+        else:
+            self.injected[node_id] = tuple(outputs)
+
+    def execution_order(self, targets):
+        """The nodes `targets` depend on, topologically sorted (Kahn's algorithm)."""
+        needed = set()
+        pending = list(targets)
+        while pending:
+            node_id = pending.pop()
+            if node_id in needed:
+                continue
+            if node_id not in self.nodes:
+                raise ValueError(f"Node {node_id} ({self.unavailable.get(node_id, 'unknown')}) cannot be executed")
+            needed.add(node_id)
+            if node_id not in self.injected:
+                pending.extend(source.node_id for source in self.nodes[node_id].inputs.values()
+                               if isinstance(source, Link))
+
+        def parents(node_id):
+            if node_id in self.injected:
+                return set()
+            return {source.node_id for source in self.nodes[node_id].inputs.values() if isinstance(source, Link)}
+
+        remaining = {node_id: parents(node_id) for node_id in needed}
+        order = []
+        ready = sorted(node_id for node_id, deps in remaining.items() if not deps)
+        while ready:
+            node_id = ready.pop(0)
+            order.append(node_id)
+            for child, deps in remaining.items():
+                if node_id in deps:
+                    deps.discard(node_id)
+                    if not deps and child not in order and child not in ready:
+                        ready.append(child)
+        if len(order) != len(needed):
+            raise ValueError("The workflow contains a cycle")
+        return order
+
+    def _signature(self, node, inputs, signatures):
+        if node.id in self.injected:
+            parts = ["injected", value_key(self.injected[node.id])]
+        else:
+            parts = [node.class_type]
+            for name, source in sorted(inputs.items()):
+                if isinstance(source, Link):
+                    parts.append((name, signatures[source.node_id], source.slot))
+                else:
+                    parts.append((name, value_key(source)))
+            node_class = self.node_classes[node.class_type]
+            if hasattr(node_class, "IS_CHANGED"):
+                constants = {name: value for name, value in inputs.items() if not isinstance(value, Link)}
+                changed = node_class.IS_CHANGED(**constants)
+                if isinstance(changed, float) and changed != changed:
+                    # ComfyUI's convention for "always re-execute": NaN never equals itself
+                    changed = ("always", next(_always_changed))
+                parts.append(("is_changed", value_key(changed)))
+        return hashlib.blake2b(repr(parts).encode(), digest_size=20).hexdigest()
+
+    def _execute(self, node, inputs, outputs):
+        node_class = self.node_classes[node.class_type]
+        kwargs = {name: get_output(outputs, source) if isinstance(source, Link) else source
+                  for name, source in inputs.items()}
+        hidden = node_class.INPUT_TYPES().get("hidden", {})
+        for name, kind in hidden.items():
+            kwargs[name] = str(node.id) if kind == "UNIQUE_ID" else None
+        if node.class_type in STATEFUL_NODE_TYPES:
+            instance = node_class()
+            self._stateful.append(instance)
+        else:
+            # One instance per node, like ComfyUI
+            instance = self.objects.get(node.id)
+            if instance is None:
+                instance = self.objects[node.id] = node_class()
+        with stage(f"node:{node.class_type}"):
+            result = getattr(instance, node_class.FUNCTION)(**kwargs)
+        if isinstance(result, dict):
+            # Output nodes return {"ui": ..., "result": (...)}
+            result = result.get("result", ())
+        return tuple(result)
+
+    def run(self, targets=None, overrides: dict = None) -> dict:
+        """Executes the nodes needed for `targets` and returns {node_id: outputs} for them.
+
+        Args:
+            targets: Node IDs to compute (default: every runnable output node).
+            overrides: {node_id: {input_name: value}} replacing constant inputs for this
+                run only, e.g. {39: {"noise_seed": 7}, 133: {"weight": 0.9}}.
+        """
+        targets = list(targets) if targets is not None else self.output_nodes()
+        overrides = overrides or {}
+        outputs, signatures = {}, {}
+        self.last_run = {"executed": [], "cached": []}
+
+        try:
+            with torch.inference_mode():
+                for node_id in self.execution_order(targets):
+                    node = self.nodes[node_id]
+                    inputs = dict(node.inputs)
+                    inputs.update(overrides.get(node_id, {}))
+                    signature = signatures[node_id] = self._signature(node, inputs, signatures)
+
+                    node_cache = self.cache.setdefault(node_id, OrderedDict())
+                    stateful = node.class_type in STATEFUL_NODE_TYPES
+                    if node_id in self.injected:
+                        outputs[node_id] = self.injected[node_id]
+                    elif signature in node_cache and not stateful:
+                        node_cache.move_to_end(signature)
+                        outputs[node_id] = node_cache[signature]
+                        self.last_run["cached"].append(node_id)
+                    else:
+                        outputs[node_id] = self._execute(node, inputs, outputs)
+                        if not stateful:
+                            node_cache[signature] = outputs[node_id]
+                            while len(node_cache) > self.cache_per_node:
+                                node_cache.popitem(last=False)
+                        self.last_run["executed"].append(node_id)
+        finally:
+            self._release_stateful()
+
+        return {node_id: outputs[node_id] for node_id in targets}
+
+    def _release_stateful(self) -> None:
+        """Removes what this run's STATEFUL_NODE_TYPES instances left on shared models."""
+        instances, self._stateful = self._stateful, []
+        for instance in instances:
+            # ApplyPulidFlux only does this in __del__, whenever the instance is collected
+            attached = getattr(instance, "pulid_data_dict", None)
+            if attached:
+                attached["data"].pop(attached["unique_id"], None)
+                instance.pulid_data_dict = None
+
+    def clear_cache(self) -> None:
+        self.cache.clear()
+
+
+def get_output(outputs, link: Link):
+    return outputs[link.node_id][link.slot]